@@ -1,12 +1,26 @@
-from fastapi import APIRouter
+import json
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from app.api.endpoints.codegen.codegen_service import CodeGenService
+from app.common.exceptions import QueueFullError
 
 router = APIRouter()
 _codegen_service = CodeGenService()
 
 
+@router.on_event("startup")
+async def start_codegen_service():
+    await _codegen_service.start()
+
+
+@router.on_event("shutdown")
+async def stop_codegen_service():
+    await _codegen_service.stop()
+
+
 class RequestCodeBody(BaseModel):
     """Pydantic model for the request body for code generation.
 
@@ -28,4 +42,63 @@ async def request_codegen(body: RequestCodeBody) -> CodeGenService.RequestCodeGe
     Returns:
         CodeGenService.RequestCodeGenRes: An instance of the RequestCodeGenRes class containing the result of the code generation.
     """
-    return _codegen_service.request_codegen(body.repoUrl, body.prompt)
+    return await _codegen_service.request_codegen(body.repoUrl, body.prompt)
+
+
+@router.post("/codegen/stream/")
+async def stream_codegen(body: RequestCodeBody) -> StreamingResponse:
+    """Request code generation and stream its progress as server-sent events.
+
+    Emits a "plan" event for each planner review and plan, a "code_diff_chunk" event for each worker diff,
+    a "code_diff" event for each merged attempt diff, and finally a "result" or "error" event.
+    Disconnecting before the final event cancels the code generation.
+
+    Args:
+        body (RequestCodeBody): The request body containing the repository URL and prompt.
+
+    Returns:
+        StreamingResponse: A text/event-stream response.
+    """
+    async def event_stream():
+        async for event in _codegen_service.stream_codegen(body.repoUrl, body.prompt):
+            yield f"event: {event.event}\ndata: {json.dumps(event.model_dump(mode='json')['data'])}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@router.post("/codegen/jobs/", status_code=status.HTTP_202_ACCEPTED)
+async def submit_codegen_job(body: RequestCodeBody) -> CodeGenService.CodeGenJobRes:
+    """Submit a code generation request to run in the background.
+
+    Args:
+        body (RequestCodeBody): The request body containing the repository URL and prompt.
+
+    Returns:
+        CodeGenService.CodeGenJobRes: The job ID and status, used to poll for the result.
+
+    Raises:
+        HTTPException: 429 when too many jobs are already waiting in the queue.
+    """
+    try:
+        return await _codegen_service.submit_codegen_job(body.repoUrl, body.prompt)
+    except QueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+
+@router.get("/codegen/jobs/{job_id}")
+async def get_codegen_job(job_id: str) -> CodeGenService.CodeGenJobRes:
+    """Get the status of a background code generation job, including its result once it has finished.
+
+    Args:
+        job_id (str): The job ID returned when the job was submitted.
+
+    Returns:
+        CodeGenService.CodeGenJobRes: The job status, result and error.
+
+    Raises:
+        HTTPException: 404 when no job exists with the given ID.
+    """
+    job = await _codegen_service.get_codegen_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+    return job
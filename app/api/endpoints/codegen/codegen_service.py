@@ -1,21 +1,63 @@
+import asyncio
+import json
 import logging
+import uuid
+from typing import AsyncIterator, Optional
+
 from pydantic import BaseModel
 
-from app.lib.codegen.models import CodeGenResult
+from app.common.context import current_job_id
+from app.common.exceptions import ApiError
+from app.common.logger import Payload
+from app.lib.codegen.llm_backends import llm_backend
+from app.lib.codegen.models import CodeGenEvent, CodeGenResult
 from app.lib.codegen.orchestrator import CodeGenOrchestrator
-from app.lib.supabase_client import SupabaseClient
+from app.lib.filesystem import generate_hash_for_repo_and_prompt
+from app.lib.job_queue import Job, JobQueue, JobStatus
+from app.lib.persistence import WriteBehindWriter
+from app.lib.retrieval import shutdown_index_pool
+from app.lib.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def _set_request_id() -> None:
+    # Background jobs already run under their job ID, which must not be replaced
+    if current_job_id.get() is None:
+        current_job_id.set(f"request-{uuid.uuid4().hex}")
 
 
 class CodeGenService:
     """Service class for code generation.
 
     Attributes:
-        supabase_client: An instance of the SupabaseClient class.
+        persistence: Writes code generation results to storage in the background.
+        job_queue: The queue running background code generation jobs, created when the service is started.
+        single_flight: Coalesces identical in-flight requests, keyed by the repository and prompt hash.
     """
 
     def __init__(self):
-        """Initialize the CodeGenService class with a Supabase client."""
-        self.supabase_client = SupabaseClient()
+        """Initialize the CodeGenService class with a background persistence writer."""
+        self.persistence = WriteBehindWriter()
+        self.job_queue: Optional[JobQueue] = None
+        self.single_flight: SingleFlight[CodeGenResult] = SingleFlight()
+
+    async def start(self):
+        """Start the background job workers and persistence writer. Must be called from within the running event
+        loop."""
+        if self.job_queue is None:
+            self.job_queue = JobQueue(self._run_codegen_job)
+        self.job_queue.start()
+        self.persistence.start()
+
+    async def stop(self):
+        """Stop the background job workers, then flush the persistence writer, close the LLM connections and stop
+        the retrieval index workers."""
+        if self.job_queue is not None:
+            await self.job_queue.stop()
+        await self.persistence.stop()
+        await llm_backend.close()
+        await shutdown_index_pool()
 
     class RequestCodeGenRes(BaseModel):
         """Pydantic model for the code generation request response.
@@ -25,9 +67,29 @@ class CodeGenService:
         """
         result: CodeGenResult
 
-    def request_codegen(self, repo_url: str, prompt: str) -> RequestCodeGenRes:
+    class CodeGenJobRes(BaseModel):
+        """Pydantic model for the status of a background code generation job.
+
+        Attributes:
+            jobId (str): The unique identifier of the job.
+            status (JobStatus): The current status of the job.
+            result (Optional[CodeGenResult]): The result of the code generation once the job has succeeded.
+            error (Optional[str]): The error message if the job has failed.
+        """
+        jobId: str
+        status: JobStatus
+        result: Optional[CodeGenResult] = None
+        error: Optional[str] = None
+
+        @classmethod
+        def from_job(cls, job: Job) -> "CodeGenService.CodeGenJobRes":
+            return cls(jobId=job.job_id, status=job.status, result=job.result, error=job.error)
+
+    async def request_codegen(self, repo_url: str, prompt: str) -> RequestCodeGenRes:
         """Request code generation based on a repository URL and a prompt.
 
+        If an identical request is already in flight, its result is shared instead of generating it again.
+
         Args:
             repo_url (str): The URL of the repository for which to generate code.
             prompt (str): The prompt based on which code will be generated.
@@ -35,22 +97,117 @@ class CodeGenService:
         Returns:
             RequestCodeGenRes: An instance of the RequestCodeGenRes class containing the result of the code generation.
         """
-        logging.info(f"Requesting codegen for repo: {repo_url} and prompt: {prompt}")
+        logger.info("Requesting codegen for repo: %s and prompt: %s", repo_url, Payload(prompt))
 
+        _set_request_id()
         codegen_orchestrator = CodeGenOrchestrator(repo_url, prompt)
-        result = codegen_orchestrator.generate_code_diff()
+        result = await self.single_flight.do(
+            generate_hash_for_repo_and_prompt(repo_url, prompt),
+            codegen_orchestrator.generate_code_diff
+        )
+        self._save_result(repo_url, prompt, result)
+
+        return self.RequestCodeGenRes(result=result)
+
+    async def stream_codegen(self, repo_url: str, prompt: str) -> AsyncIterator[CodeGenEvent]:
+        """Request code generation and stream progress events as they are produced.
+
+        The final event is either a "result" event with the CodeGenResult or an "error" event, whose detail is the
+        message of an ApiError or a generic message for any other failure, which is logged instead. Closing the
+        iterator early, e.g. when the client disconnects, cancels the code generation unless other identical
+        requests are waiting for it. A request that joins an identical request already in flight only receives
+        the final event.
+
+        Args:
+            repo_url (str): The URL of the repository for which to generate code.
+            prompt (str): The prompt based on which code will be generated.
+
+        Yields:
+            CodeGenEvent: The progress events of the code generation.
+        """
+        logger.info("Streaming codegen for repo: %s and prompt: %s", repo_url, Payload(prompt))
+
+        _set_request_id()
+        events: "asyncio.Queue[CodeGenEvent]" = asyncio.Queue()
+        codegen_orchestrator = CodeGenOrchestrator(repo_url, prompt, event_handler=events.put)
+
+        is_leader = False
+
+        async def generate_code_diff() -> CodeGenResult:
+            nonlocal is_leader
+            is_leader = True
+            return await codegen_orchestrator.generate_code_diff()
+
+        async def run() -> None:
+            try:
+                result = await self.single_flight.do(
+                    generate_hash_for_repo_and_prompt(repo_url, prompt),
+                    generate_code_diff
+                )
+                if not is_leader:
+                    await events.put(CodeGenEvent(event="result", data={"result": result}))
+            except Exception as e:
+                logger.exception("Streaming codegen failed")
+                # Only API errors are meant for clients, others may expose paths, git output or upstream responses
+                detail = str(e) if isinstance(e, ApiError) else "Code generation failed"
+                await events.put(CodeGenEvent(event="error", data={"detail": detail}))
+                return
+            self._save_result(repo_url, prompt, result)
+
+        task = asyncio.create_task(run())
+        finished = False
+        try:
+            while not finished:
+                event = await events.get()
+                finished = event.event in ("result", "error")
+                yield event
+        finally:
+            if not finished:  # the consumer went away before the result, so stop spending on the LLM
+                logger.info("Cancelling streaming codegen for repo: %s", repo_url)
+                task.cancel()
 
-        # Save record to Supabase
-        subabase_response = self.supabase_client.insert_record(
+    def _save_result(self, repo_url: str, prompt: str, result: CodeGenResult) -> None:
+        # Save record in the background, without delaying the response
+        self.persistence.enqueue(
             'code_gen_requests',
             {
                 'repo_url': repo_url,
                 'prompt': prompt,
                 'code_diff': result.code_diff,
-                'history': [history_item.to_json() for history_item in result.history],
+                'history': [json.dumps(history_item.to_json()) for history_item in result.history],
                 'exceeded_max_attempts': result.exceeded_max_attempts,
             }
         )
-        logging.info(f"Supabase response: {subabase_response}")
 
-        return self.RequestCodeGenRes(result=result)
+    async def submit_codegen_job(self, repo_url: str, prompt: str) -> CodeGenJobRes:
+        """Submit a code generation request to run in the background.
+
+        Args:
+            repo_url (str): The URL of the repository for which to generate code.
+            prompt (str): The prompt based on which code will be generated.
+
+        Returns:
+            CodeGenJobRes: The status of the queued job.
+
+        Raises:
+            QueueFullError: Raised when too many jobs are already waiting.
+        """
+        await self.start()
+        job = await self.job_queue.submit({'repo_url': repo_url, 'prompt': prompt})
+        return self.CodeGenJobRes.from_job(job)
+
+    async def get_codegen_job(self, job_id: str) -> Optional[CodeGenJobRes]:
+        """Get the status and result of a background code generation job.
+
+        Args:
+            job_id (str): The unique identifier of the job.
+
+        Returns:
+            Optional[CodeGenJobRes]: The status of the job, or None if no such job exists.
+        """
+        job = await self.job_queue.get(job_id) if self.job_queue else None
+        return self.CodeGenJobRes.from_job(job) if job else None
+
+    async def _run_codegen_job(self, payload: dict) -> CodeGenResult:
+        response = await self.request_codegen(payload['repo_url'], payload['prompt'])
+        return response.result
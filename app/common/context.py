@@ -0,0 +1,6 @@
+import contextvars
+from typing import Optional
+
+# The identifier of the job or request the current task is working on, e.g. to share resources fairly between jobs
+# and to correlate logs and traces
+current_job_id: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("current_job_id", default=None)
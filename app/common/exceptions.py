@@ -3,4 +3,12 @@ class InputValidationError(Exception):
 
 
 class ApiError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class GitCommandError(Exception):
+    pass
+
+
+class QueueFullError(Exception):
+    pass
@@ -1,8 +1,191 @@
+import atexit
+import copy
+import hashlib
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+from typing import Any, Dict, List, Optional
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+from decouple import Csv, config
+
+from app.common.context import current_job_id
+from app.lib.metrics import metrics
+
+LOG_LEVEL = config("LOG_LEVEL", "INFO")
+LOG_LEVELS = config("LOG_LEVELS", "", cast=Csv())  # per-logger levels, e.g. "app.lib.git=DEBUG,uvicorn=WARNING"
+LOG_FORMAT = config("LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = config("LOG_QUEUE_SIZE", 10000, cast=int)
+LOG_MAX_PAYLOAD_CHARS = config("LOG_MAX_PAYLOAD_CHARS", 500, cast=int)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(job_id)s] %(message)s"
+
+
+class Payload:
+    """A large value to be logged, such as a prompt or a code diff, rendered only if the log record is emitted.
+
+    Values longer than the maximum are cut short and tagged with their length and a hash, so identical payloads can
+    still be correlated across log lines.
+
+    Attributes:
+        value (Any): The value to log.
+        max_chars (int): The maximum number of characters rendered.
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: int = LOG_MAX_PAYLOAD_CHARS):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else str(self.value)
+        if len(text) <= self.max_chars:
+            return text
+        digest = hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:12]
+        return f"{text[:self.max_chars]}... [{len(text)} chars, sha256:{digest}]"
+
+    __repr__ = __str__
+
+
+class JobContextFilter(logging.Filter):
+    """Tags log records with the ID of the job or request they were logged for."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job_id = current_job_id.get() or "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        job_id = getattr(record, "job_id", "-")
+        if job_id != "-":
+            entry["job_id"] = job_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A queue handler that drops records instead of blocking or raising when the queue is full.
+
+    Records are queued unformatted, so their messages, payloads and tracebacks are rendered by the formatter on the
+    listener thread rather than on the thread that logged them.
+
+    Attributes:
+        dropped (int): The number of records dropped.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # A copy, as other handlers may still see the original. The job ID is captured here, on the logging thread.
+        record = copy.copy(record)
+        record.job_id = getattr(record, "job_id", None) or current_job_id.get() or "-"
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_log_levels(levels: List[str]) -> Dict[str, str]:
+    """Parse per-logger levels given as "logger=LEVEL" entries.
+
+    Parameters:
+        levels (List[str]): The entries, e.g. ["app.lib.git=DEBUG"].
+
+    Returns:
+        Dict[str, str]: The level of each logger.
+
+    Raises:
+        ValueError: If an entry is not of the form "logger=LEVEL".
+    """
+    parsed = {}
+    for entry in levels:
+        name, separator, level = entry.partition("=")
+        if not separator or not name.strip() or not level.strip():
+            raise ValueError(f"Invalid log level entry: {entry!r}, expected logger=LEVEL")
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[DroppingQueueHandler] = None
+
+
+def configure_logging(
+        level: str = LOG_LEVEL,
+        levels: Optional[List[str]] = None,
+        log_format: str = LOG_FORMAT,
+        queue_size: int = LOG_QUEUE_SIZE,
+        stream=None
+) -> DroppingQueueHandler:
+    """Route all logs through a bounded in-memory queue to a background thread that writes them to stdout.
+
+    Logging calls only filter and enqueue records, so writing to the stream never blocks the event loop. Records
+    that arrive while the queue is full are dropped. Calling this again replaces the previous configuration.
+
+    Parameters:
+        level (str, optional): The level of the root logger. Defaults to LOG_LEVEL.
+        levels (List[str], optional): Per-logger levels as "logger=LEVEL" entries. Defaults to LOG_LEVELS.
+        log_format (str, optional): Either "json" or "text". Defaults to LOG_FORMAT.
+        queue_size (int, optional): The maximum number of records waiting to be written. Defaults to LOG_QUEUE_SIZE.
+        stream (optional): The stream logs are written to. Defaults to stdout.
+
+    Returns:
+        DroppingQueueHandler: The handler installed on the root logger.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(JobContextFilter())
+    if _handler is not None:
+        handler.dropped = _handler.dropped
+    _handler = handler
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, logger_level in parse_log_levels(LOG_LEVELS if levels is None else levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+    for name in ("uvicorn", "uvicorn.access", "uvicorn.error"):  # handled by the root logger instead
+        logging.getLogger(name).handlers.clear()
+        logging.getLogger(name).propagate = True
+    return handler
+
+
+def shutdown_logging() -> None:
+    """Write all queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+metrics.register_callback(
+    "log_records_dropped_total", "Log records dropped because the log queue was full.", "counter",
+    lambda: [({}, _handler.dropped if _handler else 0)]
+)
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """A two-tier cache of string values, keyed by a content hash.
+
+    The memory tier holds the most recently used entries. The disk tier holds one JSON file per entry and is
+    evicted least recently used first once it exceeds its size budget. Entries in both tiers expire after the TTL.
+
+    Attributes:
+        enabled (bool): Whether values are looked up and stored at all.
+        cache_path (str): The directory of the disk tier.
+        ttl (float): The number of seconds after which entries expire.
+        memory_entries (int): The maximum number of entries in the memory tier.
+        disk_max_bytes (int): The disk budget of the disk tier.
+        memory_hits (int): The number of lookups served from the memory tier.
+        disk_hits (int): The number of lookups served from the disk tier.
+        misses (int): The number of lookups not found in either tier.
+    """
+
+    def __init__(
+            self,
+            cache_path: str,
+            enabled: bool = True,
+            ttl: float = 7 * 24 * 3600,
+            memory_entries: int = 1024,
+            disk_max_bytes: int = 512 * 1024 ** 2
+    ):
+        self.enabled = enabled
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()  # guards the disk tier's size, which is updated from worker threads
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_path, key[:2], f"{key}.json")
+
+    async def get(self, key: str) -> Optional[str]:
+        """Look up a cached value.
+
+        Parameters:
+            key (str): The cache key.
+
+        Returns:
+            Optional[str]: The cached value, or None if it is not cached or has expired.
+        """
+        if not self.enabled:
+            return None
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            created_at, value = entry
+            if time.time() - created_at < self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        entry = await asyncio.to_thread(self._read_disk_entry, key)
+        if entry is not None:
+            self.disk_hits += 1
+            self._store_in_memory(key, *entry)
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """Store a value in both tiers.
+
+        Parameters:
+            key (str): The cache key.
+            value (str): The value to cache.
+        """
+        if not self.enabled:
+            return
+        created_at = time.time()
+        self._store_in_memory(key, created_at, value)
+        await asyncio.to_thread(self._write_disk_entry, key, created_at, value)
+
+    def _store_in_memory(self, key: str, created_at: float, value: str) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk_entry(self, key: str) -> Optional[Tuple[float, str]]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry["created_at"] >= self.ttl:
+            with self._disk_lock:
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    return None
+                self._remove_disk_entry(path)
+                if self._disk_bytes is not None:
+                    self._disk_bytes -= size
+            return None
+        os.utime(path)  # the file's mtime marks its last use for LRU eviction
+        return entry["created_at"], entry["value"]
+
+    def _write_disk_entry(self, key: str, created_at: float, value: str) -> None:
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A uniquely named temp file, so concurrent writers of the same key never write to the same file
+        with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=os.path.dirname(path), suffix=".tmp", delete=False
+        ) as file:
+            json.dump({"created_at": created_at, "value": value}, file)
+
+        with self._disk_lock:
+            try:
+                replaced_size = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(file.name, path)
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._list_disk_entries())
+            else:
+                self._disk_bytes += os.path.getsize(path) - replaced_size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk_entries()
+
+    def _list_disk_entries(self) -> List[Tuple[float, str, int]]:
+        entries = []
+        for dir_path, _, file_names in os.walk(self.cache_path):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    entries.append((stat.st_mtime, os.path.join(dir_path, file_name), stat.st_size))
+        return entries
+
+    def _remove_disk_entry(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict_disk_entries(self) -> None:
+        """Remove the least recently used entries until the disk tier is within 90% of its budget. Must be called
+        with the disk lock held."""
+        entries = sorted(self._list_disk_entries())
+        total_bytes = sum(size for _, _, size in entries)
+        target_bytes = self.disk_max_bytes * 0.9
+        expiry = time.time() - self.ttl
+        for last_used, path, size in entries:
+            if total_bytes <= target_bytes and last_used >= expiry:
+                continue
+            self._remove_disk_entry(path)
+            total_bytes -= size
+        logger.info("Evicted cache entries from %s, disk tier is now %d bytes", self.cache_path, total_bytes)
+        self._disk_bytes = total_bytes
+
+    def stats(self) -> Dict[str, float]:
+        """Return the cache hit and miss counters and the overall hit rate.
+
+        Returns:
+            Dict[str, float]: The counters keyed by name.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
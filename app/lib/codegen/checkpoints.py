@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_ENABLED = config("CHECKPOINTS_ENABLED", True, cast=bool)
+CHECKPOINT_PATH = config("CHECKPOINT_PATH", "/tmp/tinygen_checkpoints.sqlite3")
+CHECKPOINT_TTL = config("CHECKPOINT_TTL", 24 * 3600, cast=float)  # seconds since a run was last checkpointed
+
+
+class CheckpointStore:
+    """Stores the intermediate state of code generation runs in a local SQLite database, so that a run that was
+    interrupted can continue from its last completed stage.
+
+    Each run has a set of named JSON values, e.g. its file map or the state of a candidate, which are overwritten
+    as the run progresses. Runs that have not been checkpointed for longer than the TTL are removed.
+
+    Attributes:
+        enabled (bool): Whether checkpoints are loaded and stored at all.
+        path (str): The path of the SQLite database file.
+        ttl (float): The number of seconds after which the checkpoints of a run expire.
+    """
+
+    def __init__(self, enabled: bool = CHECKPOINTS_ENABLED, path: str = CHECKPOINT_PATH, ttl: float = CHECKPOINT_TTL):
+        self.enabled = enabled
+        self.path = path
+        self.ttl = ttl
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (run_key TEXT NOT NULL, name TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, value TEXT NOT NULL, PRIMARY KEY (run_key, name))"
+        )
+        return connection
+
+    def _load(self, run_key: str) -> Dict[str, Any]:
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "DELETE FROM checkpoints WHERE run_key IN "
+                "(SELECT run_key FROM checkpoints GROUP BY run_key HAVING MAX(updated_at) < ?)",
+                (time.time() - self.ttl,)
+            )
+            rows = connection.execute("SELECT name, value FROM checkpoints WHERE run_key = ?", (run_key,)).fetchall()
+        connection.close()
+        return {name: json.loads(value) for name, value in rows}
+
+    def _save(self, run_key: str, values: Dict[str, Any]) -> None:
+        connection = self._connect()
+        with connection:
+            now = time.time()
+            connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints (run_key, name, updated_at, value) VALUES (?, ?, ?, ?)",
+                [(run_key, name, now, json.dumps(value)) for name, value in values.items()]
+            )
+        connection.close()
+
+    def _delete(self, run_key: str) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM checkpoints WHERE run_key = ?", (run_key,))
+        connection.close()
+
+    async def load(self, run_key: str) -> Dict[str, Any]:
+        """Load the checkpoints of a run, removing expired runs first.
+
+        Parameters:
+            run_key (str): The key of the run.
+
+        Returns:
+            Dict[str, Any]: The checkpointed values by name, empty if the run has none or checkpoints are disabled
+                or could not be read.
+        """
+        if not self.enabled:
+            return {}
+        try:
+            return await asyncio.to_thread(self._load, run_key)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning("Could not load checkpoints of run %s: %r", run_key, e)
+            return {}
+
+    async def save(self, run_key: str, values: Dict[str, Any]) -> None:
+        """Store checkpointed values of a run in a single transaction, replacing earlier values of the same name.
+
+        Failures are logged and otherwise ignored, as the run can continue without its checkpoints.
+
+        Parameters:
+            run_key (str): The key of the run.
+            values (Dict[str, Any]): The JSON-serializable values by name.
+        """
+        if not self.enabled or not values:
+            return
+        try:
+            await asyncio.to_thread(self._save, run_key, values)
+        except sqlite3.Error as e:
+            logger.warning("Could not checkpoint run %s: %r", run_key, e)
+
+    async def delete(self, run_key: str) -> None:
+        """Remove all checkpoints of a run, e.g. once it has finished.
+
+        Parameters:
+            run_key (str): The key of the run.
+        """
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._delete, run_key)
+        except sqlite3.Error as e:
+            logger.warning("Could not remove checkpoints of run %s: %r", run_key, e)
+
+
+checkpoint_store = CheckpointStore()
@@ -0,0 +1,366 @@
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.lib.filesystem import FileRecord
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+GIT_HEADER_PATTERN = re.compile(r"^diff --git a/(.+?) b/(.+)$")
+DEV_NULL = "/dev/null"
+
+
+@dataclass
+class Hunk:
+    """A hunk of a unified diff.
+
+    Attributes:
+        old_start (int): The first line of the hunk in the original file (1-based), or the line before it for a hunk
+            that only adds lines.
+        new_start (int): The first line of the hunk in the changed file, likewise.
+        lines (List[str]): The lines of the hunk, each prefixed with " ", "-", "+" or "\\".
+        section (str): The text after the hunk range, usually the enclosing definition.
+        chunk_index (Optional[int]): The content chunk whose worker generated the hunk, if known.
+    """
+
+    old_start: int
+    new_start: int
+    lines: List[str]
+    section: str = ""
+    chunk_index: Optional[int] = None
+
+    @property
+    def old_lines(self) -> List[str]:
+        """The context and removed lines, as they should appear in the original file."""
+        return [line[1:] for line in self.lines if line[:1] in (" ", "-")]
+
+    @property
+    def new_lines(self) -> List[str]:
+        """The context and added lines, as they appear in the changed file."""
+        return [line[1:] for line in self.lines if line[:1] in (" ", "+")]
+
+    @property
+    def header(self) -> str:
+        old_count, new_count = len(self.old_lines), len(self.new_lines)
+        header = f"@@ -{self.old_start},{old_count} +{self.new_start},{new_count} @@"
+        return f"{header} {self.section}" if self.section else header
+
+    def render(self, context_lines: Optional[int] = None) -> str:
+        """Render the hunk, optionally keeping only the context lines within context_lines of a change. The elided
+        lines are replaced by a marker, so the result is for reading and no longer applies."""
+        if context_lines is None:
+            return "\n".join([self.header, *self.lines])
+        changed = [index for index, line in enumerate(self.lines) if line[:1] in ("-", "+", "\\")]
+        lines, elided = [self.header], 0
+        for index, line in enumerate(self.lines):
+            if any(abs(index - changed_index) <= context_lines for changed_index in changed):
+                if elided:
+                    lines.append(f" ... ({elided} unchanged lines)")
+                lines.append(line)
+                elided = 0
+            else:
+                elided += 1
+        if elided:
+            lines.append(f" ... ({elided} unchanged lines)")
+        return "\n".join(lines)
+
+
+@dataclass
+class FileDiff:
+    """The changes of a unified diff to one file.
+
+    Attributes:
+        old_path (Optional[str]): The repository-relative path of the original file, or None for a new file.
+        new_path (Optional[str]): The repository-relative path of the changed file, or None for a deleted file.
+        hunks (List[Hunk]): The hunks, in the order they apply.
+    """
+
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+    def render(self, context_lines: Optional[int] = None) -> str:
+        """Render the file diff, optionally eliding context lines further than context_lines from a change, see
+        Hunk.render."""
+        old_name = f"a/{self.old_path}" if self.old_path else DEV_NULL
+        new_name = f"b/{self.new_path}" if self.new_path else DEV_NULL
+        lines = [f"diff --git a/{self.old_path or self.path} b/{self.new_path or self.path}"]
+        if self.old_path is None:
+            lines.append("new file mode 100644")
+        elif self.new_path is None:
+            lines.append("deleted file mode 100644")
+        lines += [f"--- {old_name}", f"+++ {new_name}", *(hunk.render(context_lines) for hunk in self.hunks)]
+        return "\n".join(lines)
+
+    def summarize(self) -> str:
+        """Summarize the file diff in one line: the kind of change, the number of lines added and removed, and the
+        definitions the hunks are in."""
+        change = "new file" if self.old_path is None else "deleted file" if self.new_path is None else "modified"
+        added = sum(line.startswith("+") for hunk in self.hunks for line in hunk.lines)
+        removed = sum(line.startswith("-") for hunk in self.hunks for line in hunk.lines)
+        summary = f"{self.path}: {change}, +{added} -{removed} lines in {len(self.hunks)} hunks"
+        sections = list(dict.fromkeys(hunk.section for hunk in self.hunks if hunk.section))
+        return f"{summary} ({', '.join(sections)})" if sections else summary
+
+
+@dataclass
+class HunkFailure:
+    """A hunk that does not apply to the checkout, or a chunk output that is not a diff.
+
+    Attributes:
+        path (Optional[str]): The path of the file the hunk changes, or None if no diff could be parsed.
+        chunk_index (Optional[int]): The content chunk whose worker generated the hunk, if known.
+        hunk (Optional[str]): The header of the hunk, or None if the failure concerns a whole file or chunk.
+        reason (str): Why the hunk does not apply.
+    """
+
+    path: Optional[str]
+    chunk_index: Optional[int]
+    hunk: Optional[str]
+    reason: str
+
+    def describe(self) -> str:
+        location = " ".join(part for part in (self.path, self.hunk) if part)
+        return f"{location}: {self.reason}" if location else self.reason
+
+
+@dataclass
+class DiffValidation:
+    """The result of merging and dry-running the code diffs of all content chunks.
+
+    Attributes:
+        files (List[FileDiff]): The merged file diffs, with only the hunks that apply.
+        failures (List[HunkFailure]): The hunks that do not apply.
+    """
+
+    files: List[FileDiff]
+    failures: List[HunkFailure]
+
+    @property
+    def failed_chunks(self) -> List[int]:
+        """The indices of the content chunks with at least one failure, in ascending order."""
+        return sorted({failure.chunk_index for failure in self.failures if failure.chunk_index is not None})
+
+    def render(self) -> str:
+        """Render the merged diff, with one header per file."""
+        return "".join(file_diff.render() + "\n" for file_diff in self.files if file_diff.hunks)
+
+
+def _strip_path(name: str, prefix: str) -> Optional[str]:
+    name = name.split("\t")[0].strip()
+    if name == DEV_NULL:
+        return None
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def parse_diff(text: str, chunk_index: Optional[int] = None) -> List[FileDiff]:
+    """Parse a unified diff into per-file hunks.
+
+    Parsing is lenient about the mistakes language models make: hunk line counts are recomputed from the hunk body,
+    blank context lines may lack their leading space, and code fences and prose between file diffs are ignored.
+
+    Args:
+        text (str): The unified diff.
+        chunk_index (Optional[int], optional): The content chunk the diff was generated for, recorded on each hunk.
+            Defaults to None.
+
+    Returns:
+        List[FileDiff]: The file diffs, in the order they appear. Files without hunks are left out.
+    """
+    file_diffs: List[FileDiff] = []
+    current: Optional[FileDiff] = None
+    awaiting_paths = False  # whether the current file has a "diff --git" header but no "---" and "+++" headers yet
+    hunk: Optional[Hunk] = None
+    old_remaining = new_remaining = 0  # lines of the current hunk still expected by its header
+    blank_lines = 0  # empty lines that are context lines if the hunk continues after them
+    lines = text.splitlines()
+
+    for index, line in enumerate(lines):
+        git_header = GIT_HEADER_PATTERN.match(line)
+        if git_header:
+            current, hunk, awaiting_paths = FileDiff(git_header.group(1), git_header.group(2)), None, True
+            file_diffs.append(current)
+            continue
+        if line.startswith("--- ") and index + 1 < len(lines) and lines[index + 1].startswith("+++ "):
+            old_path = _strip_path(line[4:], "a/")
+            new_path = _strip_path(lines[index + 1][4:], "b/")
+            if awaiting_paths:
+                current.old_path, current.new_path = old_path, new_path
+            else:
+                current = FileDiff(old_path, new_path)
+                file_diffs.append(current)
+            hunk, awaiting_paths = None, False
+            continue
+        if line.startswith("+++ ") and index > 0 and lines[index - 1].startswith("--- "):
+            continue
+        hunk_header = HUNK_HEADER_PATTERN.match(line)
+        if hunk_header and current is not None:
+            old_start, old_count, new_start, new_count, section = hunk_header.groups()
+            hunk = Hunk(int(old_start), int(new_start), [], section.strip(), chunk_index)
+            old_remaining = int(old_count) if old_count is not None else 1
+            new_remaining = int(new_count) if new_count is not None else 1
+            blank_lines = 0
+            current.hunks.append(hunk)
+            continue
+        if hunk is None:
+            continue
+        if line == "" and min(old_remaining, new_remaining) > blank_lines:
+            blank_lines += 1
+        elif line[:1] in (" ", "-", "+", "\\"):
+            hunk.lines += [" "] * blank_lines
+            old_remaining -= blank_lines + (line[:1] in (" ", "-"))
+            new_remaining -= blank_lines + (line[:1] in (" ", "+"))
+            blank_lines = 0
+            hunk.lines.append(line)
+        else:
+            hunk = None
+
+    return [file_diff for file_diff in file_diffs if file_diff.hunks]
+
+
+def _find_hunk(lines: List[str], old_lines: List[str], expected: int, start: int) -> Tuple[Optional[int], bool]:
+    """Find where the old lines of a hunk appear in the file, at or after `start` and nearest to `expected`.
+
+    Returns the 0-based position, or None, and whether the match ignored trailing whitespace.
+    """
+    if not old_lines:
+        return (min(max(expected, start), len(lines)), False) if start <= len(lines) else (None, False)
+    last = len(lines) - len(old_lines)
+    candidates = sorted(range(start, last + 1), key=lambda position: abs(position - expected))
+    for exact in (True, False):
+        for position in candidates:
+            window = lines[position:position + len(old_lines)]
+            if exact and window == old_lines:
+                return position, False
+            if not exact and [line.rstrip() for line in window] == [line.rstrip() for line in old_lines]:
+                return position, True
+    return None, False
+
+
+def check_file_diff(file_diff: FileDiff, content: Optional[str]) -> Tuple[FileDiff, List[HunkFailure]]:
+    """Dry-run a file diff against the current content of the file, like `git apply --check` but per hunk.
+
+    Hunks are matched at their stated position or, like `patch`, at the nearest offset where their context and
+    removed lines appear, tolerating differences in trailing whitespace. Hunks that apply are rewritten with their
+    actual positions and the file's own context lines, so the result applies cleanly with `git apply`.
+
+    Args:
+        file_diff (FileDiff): The changes to the file.
+        content (Optional[str]): The current content of the file, or None if it does not exist.
+
+    Returns:
+        Tuple[FileDiff, List[HunkFailure]]: The file diff with only the hunks that apply, and the hunks that do not.
+    """
+    def fail(hunk: Optional[Hunk], reason: str) -> HunkFailure:
+        return HunkFailure(
+            file_diff.path, hunk.chunk_index if hunk else None, hunk.header if hunk else None, reason
+        )
+
+    checked = replace(file_diff, hunks=[])
+    if file_diff.old_path is None and content:
+        return checked, [fail(hunk, "the file already exists") for hunk in file_diff.hunks]
+    if file_diff.old_path is not None and content is None:
+        return checked, [fail(hunk, "the file does not exist") for hunk in file_diff.hunks]
+
+    lines = (content or "").splitlines()
+    failures = []
+    next_free = 0  # hunks must not overlap
+    offset = 0  # lines added minus lines removed by the hunks applied so far
+    for hunk in sorted(file_diff.hunks, key=lambda hunk: hunk.old_start):
+        old_lines = hunk.old_lines
+        expected = hunk.old_start - 1 if old_lines else hunk.old_start
+        position, fuzzy = _find_hunk(lines, old_lines, expected, next_free)
+        if position is None:
+            overlapping, _ = _find_hunk(lines, old_lines, expected, 0)
+            reason = "overlaps an earlier hunk" if overlapping is not None else "context or removed lines not found"
+            failures.append(fail(hunk, reason))
+            continue
+
+        hunk_lines = hunk.lines
+        if fuzzy:  # use the file's own lines, so the context matches exactly
+            actual = iter(lines[position:position + len(old_lines)])
+            hunk_lines = [line[0] + next(actual) if line[:1] in (" ", "-") else line for line in hunk.lines]
+        end = position + len(old_lines)
+        if end < len(lines) and not [line for line in hunk_lines if line[:1] != "\\"][-1].startswith(" "):
+            # git apply anchors hunks without trailing context to the end of the file
+            hunk_lines = [*hunk_lines, " " + lines[end]]
+        old_count = sum(line[:1] in (" ", "-") for line in hunk_lines)
+        new_count = sum(line[:1] in (" ", "+") for line in hunk_lines)
+        old_start = position + 1 if old_count else position
+        new_start = position + offset + 1 if new_count else position + offset
+        checked.hunks.append(replace(hunk, old_start=old_start, new_start=new_start, lines=hunk_lines))
+        next_free = end
+        offset += new_count - old_count
+    return checked, failures
+
+
+def validate_chunk_diffs(
+        chunk_diffs: List[Optional[str]],
+        read_file: Callable[[str], Optional[str]]
+) -> DiffValidation:
+    """Merge the code diffs generated for each content chunk into one diff per file, and dry-run it.
+
+    Hunks for the same file from different chunks are merged under a single header, in file order, and identical
+    hunks are dropped. A chunk whose output is not empty but contains no diff is reported as a failure.
+
+    Args:
+        chunk_diffs (List[Optional[str]]): The code diff of each chunk, in chunk order, or None where the worker
+            failed.
+        read_file (Callable[[str], Optional[str]]): Returns the current content of a repository-relative path, or
+            None if the file does not exist.
+
+    Returns:
+        DiffValidation: The merged file diffs that apply, and the failures of those that do not.
+    """
+    merged: Dict[str, FileDiff] = {}
+    failures: List[HunkFailure] = []
+    for chunk_index, chunk_diff in enumerate(chunk_diffs):
+        if not chunk_diff or not chunk_diff.strip():
+            continue
+        file_diffs = parse_diff(chunk_diff, chunk_index)
+        if not file_diffs:
+            failures.append(HunkFailure(None, chunk_index, None, "the output is not a unified diff"))
+        for file_diff in file_diffs:
+            target = merged.setdefault(file_diff.path, FileDiff(file_diff.old_path, file_diff.new_path))
+            seen = {(hunk.old_start, tuple(hunk.lines)) for hunk in target.hunks}
+            target.hunks += [hunk for hunk in file_diff.hunks if (hunk.old_start, tuple(hunk.lines)) not in seen]
+
+    files = []
+    for path, file_diff in merged.items():
+        checked, file_failures = check_file_diff(file_diff, read_file(file_diff.old_path or path))
+        files.append(checked)
+        failures += file_failures
+    return DiffValidation(files, failures)
+
+
+def checkout_reader(repo_dir: str, files: List[FileRecord]) -> Callable[[str], Optional[str]]:
+    """Return a function that reads files of a checkout for validate_chunk_diffs.
+
+    Files already fetched for the workers are served from memory, so the diff is checked against exactly what the
+    workers saw. Other files are read from the checkout, and paths outside of it are treated as missing.
+
+    Args:
+        repo_dir (str): The path of the repository checkout.
+        files (List[FileRecord]): The fetched files, as returned by fetch_files.
+
+    Returns:
+        Callable[[str], Optional[str]]: Returns the content of a repository-relative path, or None if the file does
+            not exist.
+    """
+    fetched = {file.path: file.content if file.sha is not None else None for file in files}
+    root = os.path.realpath(repo_dir)
+
+    def read_file(path: str) -> Optional[str]:
+        if path in fetched:
+            return fetched[path]
+        full_path = os.path.realpath(os.path.join(root, path))
+        if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+            return None
+        with open(full_path, encoding="utf-8", errors="ignore") as file:
+            return file.read()
+
+    return read_file
@@ -0,0 +1,128 @@
+import contextvars
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.common.exceptions import ApiError
+from app.lib.codegen.llm_backends import llm_backend
+from app.lib.codegen.llm_cache import generate_llm_cache_key, llm_cache
+from app.lib.codegen.llm_scheduler import LLM_EXPECTED_COMPLETION_TOKENS, LLMPriority, llm_scheduler
+from app.lib.codegen.utils.tokens import count_tokens
+from app.lib.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CALLS = metrics.counter(
+    "llm_calls_total", "LLM function calls by function and where the response came from: cache or backend.",
+    ["function", "source"]
+)
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Tokens sent to (in) and generated by (out) the LLM backend.", ["function", "direction"]
+)
+
+
+@dataclass
+class LLMUsage:
+    """The LLM backend calls made on behalf of a code generation run, excluding responses served from the cache.
+
+    Attributes:
+        calls (int): The number of calls made.
+        tokens (int): The number of prompt and completion tokens used, as reported by the backend.
+    """
+
+    calls: int = 0
+    tokens: int = 0
+
+
+# The usage of the run the current task belongs to, if it is tracked, e.g. to keep within a budget
+current_llm_usage: "contextvars.ContextVar[Optional[LLMUsage]]" = contextvars.ContextVar(
+    "current_llm_usage", default=None
+)
+
+
+def estimate_request_tokens(model: str, messages: List[dict], functions: List[dict]) -> int:
+    """Estimate the number of tokens an LLM request will use, including the expected completion.
+
+    Args:
+        model (str): The model to use.
+        messages (List[dict]): The chat messages to send.
+        functions (List[dict]): The function schemas offered to the model.
+
+    Returns:
+        int: The estimated number of prompt and completion tokens.
+    """
+    prompt = "".join(message.get("content") or "" for message in messages) + json.dumps(functions)
+    return count_tokens(prompt, model) + LLM_EXPECTED_COMPLETION_TOKENS
+
+
+async def create_function_call(
+        model: str,
+        messages: List[dict],
+        function: dict,
+        use_cache: bool = True,
+        priority: LLMPriority = LLMPriority.WORKER,
+        timeout: Optional[float] = None
+) -> Optional[str]:
+    """Ask the model to call a function and return the arguments of the call.
+
+    Responses are served from and stored in the LLM response cache. Only arguments that decode as JSON are
+    cached, so malformed responses are retried on the next request. Calls to the LLM backend go through the shared
+    LLM scheduler, which enforces the rate limits and retries rate limit and server errors.
+
+    Args:
+        model (str): The model to use.
+        messages (List[dict]): The chat messages to send.
+        function (dict): The schema of the function the model must call.
+        use_cache (bool, optional): Whether to use the LLM response cache. Defaults to True.
+        priority (LLMPriority, optional): The scheduling priority of the call. Defaults to LLMPriority.WORKER.
+        timeout (Optional[float], optional): The number of seconds after which a dispatched backend call is
+            abandoned, see LLMScheduler.run. Defaults to None, for no timeout.
+
+    Returns:
+        Optional[str]: The JSON-encoded function call arguments, or None if the API returned no choices.
+
+    Raises:
+        ApiError: Raised when the cache is offline and the response is not cached.
+        asyncio.TimeoutError: Raised when the backend call took longer than the timeout.
+    """
+    functions = [function]
+    function_call = {"name": function["name"]}
+    cache_key = generate_llm_cache_key(model, messages, functions, function_call) if use_cache else None
+
+    if cache_key:
+        cached_arguments = await llm_cache.get(cache_key)
+        if cached_arguments is not None:
+            logger.debug("LLM cache hit for %s", function["name"])
+            LLM_CALLS.inc(function=function["name"], source="cache")
+            return cached_arguments
+        if llm_cache.offline:
+            raise ApiError(f"LLM response for {function['name']} not found in offline cache")
+
+    response = await llm_scheduler.run(
+        lambda: llm_backend.create_function_call(model, messages, functions, function_call),
+        priority,
+        estimate_request_tokens(model, messages, functions),
+        lambda response: response.total_tokens if response else None,
+        timeout
+    )
+    LLM_CALLS.inc(function=function["name"], source="backend")
+    usage = current_llm_usage.get()
+    if usage is not None:
+        usage.calls += 1
+        usage.tokens += (response.total_tokens or 0) if response else 0
+    if response is None:
+        return None
+    if response.prompt_tokens is not None:
+        LLM_TOKENS.inc(response.prompt_tokens, function=function["name"], direction="in")
+    if response.completion_tokens is not None:
+        LLM_TOKENS.inc(response.completion_tokens, function=function["name"], direction="out")
+
+    arguments = response.arguments
+    if cache_key:
+        try:
+            json.loads(arguments)
+        except json.JSONDecodeError:
+            return arguments
+        await llm_cache.set(cache_key, arguments)
+    return arguments
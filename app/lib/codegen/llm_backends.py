@@ -0,0 +1,242 @@
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+import aiohttp
+import openai
+from decouple import config
+
+from app.common.exceptions import ApiError
+from app.lib.codegen.utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = config("LLM_BACKEND", "openai")
+LLM_HTTP_POOL_SIZE = config("LLM_HTTP_POOL_SIZE", 100, cast=int)
+LLM_HTTP_TIMEOUT = config("LLM_HTTP_TIMEOUT", 600, cast=float)  # seconds
+LLM_FAKE_LATENCY = config("LLM_FAKE_LATENCY", 1.0, cast=float)  # seconds before the first completion token
+LLM_FAKE_LATENCY_JITTER = config("LLM_FAKE_LATENCY_JITTER", 0.2, cast=float)  # fraction of the latency
+LLM_FAKE_TOKENS_PER_SECOND = config("LLM_FAKE_TOKENS_PER_SECOND", 50, cast=float)  # 0 for instant completions
+
+FakeResponse = Union[dict, Callable[[List[dict]], dict]]
+
+
+@dataclass
+class FunctionCallResponse:
+    """The result of asking a model to call a function.
+
+    Attributes:
+        arguments (str): The JSON-encoded function call arguments.
+        prompt_tokens (Optional[int]): The number of prompt tokens used, if reported.
+        completion_tokens (Optional[int]): The number of completion tokens used, if reported.
+    """
+
+    arguments: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+    @property
+    def total_tokens(self) -> Optional[int]:
+        """The number of prompt and completion tokens used, if reported."""
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return self.prompt_tokens + self.completion_tokens
+
+
+class LLMBackend(abc.ABC):
+    """A provider of chat completions with function calling."""
+
+    @abc.abstractmethod
+    async def create_function_call(
+            self,
+            model: str,
+            messages: List[dict],
+            functions: List[dict],
+            function_call: dict
+    ) -> Optional[FunctionCallResponse]:
+        """Ask the model to call a function, returning None if the model returned no choices."""
+
+    async def close(self) -> None:
+        """Release the connections held by the backend."""
+
+
+class OpenAIBackend(LLMBackend):
+    """An LLM backend that calls the OpenAI chat completion API over a pooled HTTP session.
+
+    The API key is read when the first call is made, so importing and constructing the backend does not require it.
+
+    Attributes:
+        pool_size (int): The maximum number of connections kept open to the API.
+        timeout (float): The number of seconds after which a call is abandoned.
+    """
+
+    def __init__(
+            self,
+            api_key: Optional[str] = None,
+            pool_size: int = LLM_HTTP_POOL_SIZE,
+            timeout: float = LLM_HTTP_TIMEOUT
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._api_key = api_key
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def api_key(self) -> Optional[str]:
+        """The OpenAI API key, read from the OPENAI_API_KEY setting on first use."""
+        if self._api_key is None:
+            self._api_key = config("OPENAI_API_KEY", default=None)
+        return self._api_key
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            await self.close()  # a session is bound to the event loop it was created in
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def create_function_call(
+            self,
+            model: str,
+            messages: List[dict],
+            functions: List[dict],
+            function_call: dict
+    ) -> Optional[FunctionCallResponse]:
+        session_token = openai.aiosession.set(await self._get_session())
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                functions=functions,
+                function_call=function_call,
+                api_key=self.api_key
+            )
+        finally:
+            openai.aiosession.reset(session_token)
+        if not len(response.choices):
+            return None
+
+        usage = (response.get("usage") if isinstance(response, dict) else None) or {}
+        return FunctionCallResponse(
+            response.choices[0]["message"]["function_call"]["arguments"],
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens")
+        )
+
+    async def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            try:
+                await session.close()
+            except RuntimeError as e:  # its connections belong to an event loop that is already closed
+                logger.debug("Could not close the HTTP session of a closed event loop cleanly: %r", e)
+
+
+_CODE_BLOCK_PATTERN = r"{title}[^\n]*:\s*```\n(.*?)```"
+_CHUNK_FIRST_LINE_PATTERN = re.compile(r"^--- File: (.+?)(?: \(lines (\d+)-\d+\))? ---\n([^\n]*)", re.MULTILINE)
+
+
+def _prompt_section(messages: List[dict], title: str) -> str:
+    content = "\n".join(message.get("content") or "" for message in messages)
+    match = re.search(_CODE_BLOCK_PATTERN.format(title=re.escape(title)), content, re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def fake_review_and_plan(messages: List[dict]) -> dict:
+    """Plan the first attempt using the top candidate files, and accept any generated code diff."""
+    if _prompt_section(messages, "Previously Generated Code Diff") not in ("", "None"):
+        return {"review": {"score": 8, "comment": "The code diff implements the prompt."}, "plan": None}
+    candidate_files = _prompt_section(messages, "Candidate Files").splitlines()
+    return {
+        "review": {"score": 0, "comment": "No code diff has been generated yet."},
+        "plan": {"steps": ["Implement the user prompt"], "file_paths": [path.strip() for path in candidate_files[:3]]},
+    }
+
+
+def fake_code_diff(messages: List[dict]) -> dict:
+    """Insert a comment above the first line of the first file in the code chunk."""
+    match = _CHUNK_FIRST_LINE_PATTERN.search(_prompt_section(messages, "Code Chunk"))
+    if match is None:
+        return {"code_diff": ""}
+    path, start, first_line = match.group(1), int(match.group(2) or 1), match.group(3)
+    return {"code_diff": (
+        f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n"
+        f"@@ -{start},1 +{start},2 @@\n+# Generated change\n {first_line}\n"
+    )}
+
+
+DEFAULT_FAKE_RESPONSES: Dict[str, FakeResponse] = {
+    "get_codegen_review_and_plan": fake_review_and_plan,
+    "get_codegen_code_diff": fake_code_diff,
+}
+
+
+class FakeLLMBackend(LLMBackend):
+    """A local LLM backend that returns canned function call arguments after a simulated delay, for load testing and
+    profiling without network access.
+
+    Each call waits for the latency plus the time to generate its completion at the configured throughput. The
+    latency jitter is seeded by the request, so identical requests always take the same time.
+
+    Attributes:
+        latency (float): The number of seconds before the first completion token.
+        latency_jitter (float): The maximum deviation from the latency, as a fraction of it.
+        tokens_per_second (float): The completion throughput, 0 for instant completions.
+        responses (Dict[str, FakeResponse]): The arguments returned per function name, either as a value or as a
+            function of the chat messages.
+        calls (int): The number of calls made.
+    """
+
+    def __init__(
+            self,
+            latency: float = LLM_FAKE_LATENCY,
+            latency_jitter: float = LLM_FAKE_LATENCY_JITTER,
+            tokens_per_second: float = LLM_FAKE_TOKENS_PER_SECOND,
+            responses: Optional[Dict[str, FakeResponse]] = None
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.responses = {**DEFAULT_FAKE_RESPONSES, **(responses or {})}
+        self.calls = 0
+
+    async def create_function_call(
+            self,
+            model: str,
+            messages: List[dict],
+            functions: List[dict],
+            function_call: dict
+    ) -> Optional[FunctionCallResponse]:
+        response = self.responses.get(function_call["name"])
+        if response is None:
+            raise ApiError(f"No fake LLM response for {function_call['name']}")
+        self.calls += 1
+        arguments = json.dumps(response(messages) if callable(response) else response)
+
+        request = json.dumps([model, messages, functions], sort_keys=True)
+        jitter = random.Random(hashlib.sha256(request.encode()).digest()).uniform(-1, 1) * self.latency_jitter
+        completion_tokens = count_tokens(arguments, model)
+        delay = self.latency * (1 + jitter)
+        if self.tokens_per_second > 0:
+            delay += completion_tokens / self.tokens_per_second
+        await asyncio.sleep(delay)
+        return FunctionCallResponse(arguments, count_tokens(request, model), completion_tokens)
+
+
+LLM_BACKENDS: Dict[str, Callable[[], LLMBackend]] = {
+    "openai": OpenAIBackend,
+    "fake": FakeLLMBackend,
+}
+
+llm_backend = LLM_BACKENDS[LLM_BACKEND]()
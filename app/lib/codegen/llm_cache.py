@@ -0,0 +1,53 @@
+import hashlib
+import json
+from typing import List
+
+from decouple import config
+
+from app.lib.cache import TieredCache
+
+LLM_CACHE_ENABLED = config("LLM_CACHE_ENABLED", True, cast=bool)
+LLM_CACHE_OFFLINE = config("LLM_CACHE_OFFLINE", False, cast=bool)
+LLM_CACHE_PATH = config("LLM_CACHE_PATH", "/tmp/llm_cache")
+LLM_CACHE_TTL = config("LLM_CACHE_TTL", 7 * 24 * 3600, cast=float)  # seconds
+LLM_CACHE_MEMORY_ENTRIES = config("LLM_CACHE_MEMORY_ENTRIES", 1024, cast=int)
+LLM_CACHE_DISK_MAX_BYTES = config("LLM_CACHE_DISK_MAX_BYTES", 512 * 1024 ** 2, cast=int)
+
+
+def generate_llm_cache_key(model: str, messages: List[dict], functions: List[dict], function_call: dict) -> str:
+    """Generate a content-addressed cache key for an LLM request.
+
+    Parameters:
+        model (str): The name of the model.
+        messages (List[dict]): The fully rendered chat messages.
+        functions (List[dict]): The function schemas offered to the model.
+        function_call (dict): The function the model is asked to call.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical JSON encoding of the request.
+    """
+    request = {"model": model, "messages": messages, "functions": functions, "function_call": function_call}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class LLMResponseCache(TieredCache):
+    """A two-tier cache of LLM responses, keyed by a hash of the full request.
+
+    Attributes:
+        offline (bool): Whether a cache miss is an error instead of a call to the LLM API.
+    """
+
+    def __init__(
+            self,
+            enabled: bool = LLM_CACHE_ENABLED,
+            offline: bool = LLM_CACHE_OFFLINE,
+            cache_path: str = LLM_CACHE_PATH,
+            ttl: float = LLM_CACHE_TTL,
+            memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+            disk_max_bytes: int = LLM_CACHE_DISK_MAX_BYTES
+    ):
+        super().__init__(cache_path, enabled, ttl, memory_entries, disk_max_bytes)
+        self.offline = offline
+
+
+llm_cache = LLMResponseCache()
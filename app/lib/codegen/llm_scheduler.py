@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import openai
+from decouple import config
+
+from app.common.context import current_job_id
+from app.lib.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS_PER_MINUTE = config("LLM_REQUESTS_PER_MINUTE", 500, cast=int)  # 0 disables the limit
+LLM_TOKENS_PER_MINUTE = config("LLM_TOKENS_PER_MINUTE", 150000, cast=int)  # 0 disables the limit
+LLM_MAX_CONCURRENCY = config("LLM_MAX_CONCURRENCY", 16, cast=int)
+LLM_MAX_RETRIES = config("LLM_MAX_RETRIES", 4, cast=int)
+LLM_RETRY_BASE_DELAY = config("LLM_RETRY_BASE_DELAY", 1.0, cast=float)  # seconds, doubled per retry
+LLM_RETRY_MAX_DELAY = config("LLM_RETRY_MAX_DELAY", 30.0, cast=float)  # seconds
+LLM_EXPECTED_COMPLETION_TOKENS = config("LLM_EXPECTED_COMPLETION_TOKENS", 1000, cast=int)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+LLM_QUEUE_WAIT = metrics.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for the rate limits and a concurrency slot.", ["priority"]
+)
+LLM_RETRIES = metrics.counter("llm_retries_total", "Retried LLM calls, by reason: rate_limit or error.", ["reason"])
+
+DEFAULT_FLOW = "default"  # calls made outside of a job share one queue
+
+T = TypeVar("T")
+
+
+class LLMPriority(IntEnum):
+    """The priority of an LLM call. Lower values are dispatched first."""
+
+    PLANNER = 0
+    WORKER = 1
+
+
+class TokenBucket:
+    """A token bucket that refills continuously up to its per-minute capacity.
+
+    Consuming more than is available is allowed once the bucket is full enough, and consumption can be corrected
+    after the fact, so the level may go negative (a debt that is paid back by refilling).
+
+    Attributes:
+        capacity (float): The maximum level, i.e. the number of units allowed per minute.
+        level (float): The number of units currently available.
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._clock = clock
+        self._updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated_at) * self.capacity / 60)
+        self._updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Return the number of seconds until `amount` units are available, 0 if they are available now."""
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed * 60 / self.capacity)
+
+    def consume(self, amount: float) -> None:
+        """Remove units from the bucket, or return them if `amount` is negative."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+@dataclass
+class _Waiter:
+    priority: LLMPriority
+    flow: str
+    tokens: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class WaitStats:
+    """Queue wait time statistics for one priority.
+
+    Attributes:
+        count (int): The number of calls dispatched.
+        total (float): The total number of seconds calls waited in the queue.
+        max (float): The longest number of seconds a call waited in the queue.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+
+class LLMScheduler:
+    """Coordinates every LLM call made by the process, so concurrent jobs share the provider's rate limits.
+
+    Calls are admitted when a concurrency slot is free and the requests-per-minute and tokens-per-minute buckets
+    allow them. Waiting calls are dispatched by priority, and within a priority round-robin across jobs, so a job
+    with many worker chunks cannot starve the others. Calls that fail with a rate limit or server error are retried
+    with jittered exponential backoff; a rate limit response also holds back every other call until it has passed.
+
+    Attributes:
+        requests_per_minute (int): The maximum number of calls started per minute, 0 for no limit.
+        tokens_per_minute (int): The maximum number of tokens used per minute, 0 for no limit.
+        max_concurrency (int): The maximum number of calls in flight.
+        max_retries (int): The number of times a failed call is retried.
+        retry_base_delay (float): The upper bound of the first retry delay, doubled for each further retry.
+        retry_max_delay (float): The upper bound of any retry delay.
+        retries (int): The number of retried calls.
+        rate_limited (int): The number of calls that failed with a rate limit response.
+        wait_stats (Dict[LLMPriority, WaitStats]): The queue wait times per priority.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+            max_concurrency: int = LLM_MAX_CONCURRENCY,
+            max_retries: int = LLM_MAX_RETRIES,
+            retry_base_delay: float = LLM_RETRY_BASE_DELAY,
+            retry_max_delay: float = LLM_RETRY_MAX_DELAY
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retries = 0
+        self.rate_limited = 0
+        self.wait_stats: Dict[LLMPriority, WaitStats] = {priority: WaitStats() for priority in LLMPriority}
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._queues: Dict[LLMPriority, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in LLMPriority
+        }
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def queued(self) -> int:
+        """Return the number of calls waiting to be dispatched."""
+        return sum(len(waiters) for flows in self._queues.values() for waiters in flows.values())
+
+    def stats(self) -> dict:
+        """Return the scheduler counters and queue wait times, in seconds."""
+        return {
+            "in_flight": self._in_flight,
+            "queued": self.queued(),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "wait": {
+                priority.name.lower(): {
+                    "count": stats.count,
+                    "mean": stats.total / stats.count if stats.count else 0.0,
+                    "max": stats.max,
+                }
+                for priority, stats in self.wait_stats.items()
+            },
+        }
+
+    async def run(
+            self,
+            call: Callable[[], Awaitable[T]],
+            priority: LLMPriority = LLMPriority.WORKER,
+            estimated_tokens: int = 0,
+            used_tokens: Optional[Callable[[T], Optional[int]]] = None,
+            timeout: Optional[float] = None
+    ) -> T:
+        """Run an LLM call once the rate limits allow it, retrying it on rate limit and server errors.
+
+        Parameters:
+            call (Callable[[], Awaitable[T]]): Makes the LLM call. Called again for each retry.
+            priority (LLMPriority, optional): The priority of the call. Defaults to LLMPriority.WORKER.
+            estimated_tokens (int, optional): The number of tokens the call is expected to use. Defaults to 0.
+            used_tokens (Callable[[T], Optional[int]], optional): Returns the number of tokens a result actually
+                used, to correct the estimate. Defaults to None.
+            timeout (Optional[float], optional): The number of seconds after which an attempt is abandoned, counted
+                from when it is dispatched, so time spent queued or backing off does not count. Timed out attempts
+                are not retried. Defaults to None, for no timeout.
+
+        Returns:
+            T: The result of the call.
+
+        Raises:
+            asyncio.TimeoutError: Raised when an attempt took longer than the timeout.
+            Exception: The error of the last attempt, if the call could not be completed.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, estimated_tokens)
+            try:
+                result = await (asyncio.wait_for(call(), timeout) if timeout else call())
+            except Exception as e:
+                self._release()
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.retries += 1
+                LLM_RETRIES.inc(reason="rate_limit" if is_rate_limit(e) else "error")
+                logger.warning("LLM call failed, retrying in %.1fs (attempt %d): %s", delay, attempt + 1, e)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release()
+                raise
+            actual_tokens = used_tokens(result) if used_tokens else None
+            self._release(actual_tokens - estimated_tokens if actual_tokens is not None else 0)
+            return result
+
+    async def _acquire(self, priority: LLMPriority, tokens: int) -> None:
+        flow = current_job_id.get() or DEFAULT_FLOW
+        waiter = _Waiter(priority, flow, tokens, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(waiter.flow, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # dispatched just before the cancellation arrived
+            else:
+                self._remove(waiter)
+            raise
+        wait = time.monotonic() - waiter.enqueued_at
+        self.wait_stats[priority].record(wait)
+        LLM_QUEUE_WAIT.observe(wait, priority=priority.name.lower())
+
+    def _release(self, token_correction: int = 0) -> None:
+        self._in_flight -= 1
+        if self._token_bucket and token_correction:
+            self._token_bucket.consume(token_correction)
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        flows = self._queues[waiter.priority]
+        waiters = flows.get(waiter.flow)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del flows[waiter.flow]
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in LLMPriority:
+            flows = self._queues[priority]
+            if flows:
+                return next(iter(flows.values()))[0]
+        return None
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            wait = max(
+                self._blocked_until - time.monotonic(),
+                self._request_bucket.wait_time(1) if self._request_bucket else 0.0,
+                self._token_bucket.wait_time(waiter.tokens) if self._token_bucket else 0.0,
+            )
+            if wait > 0:
+                self._schedule_dispatch(wait)
+                return
+            # Take the waiter and move its job to the back of the round-robin
+            flows = self._queues[waiter.priority]
+            waiters = flows.pop(waiter.flow)
+            waiters.popleft()
+            if waiters:
+                flows[waiter.flow] = waiters
+            if waiter.future.done():
+                continue
+            if self._request_bucket:
+                self._request_bucket.consume(1)
+            if self._token_bucket:
+                self._token_bucket.consume(waiter.tokens)
+            self._in_flight += 1
+            waiter.future.set_result(None)
+
+    def _schedule_dispatch(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        if is_rate_limit(error):
+            self.rate_limited += 1
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.retry_max_delay))
+            # Hold back every other call too, instead of letting them all hit the rate limit
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Return whether an LLM call failed with `error` because of the provider's rate limits."""
+    return isinstance(error, openai.error.RateLimitError) or getattr(error, "http_status", None) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return whether an LLM call that failed with `error` should be retried."""
+    return isinstance(error, RETRYABLE_ERRORS) or getattr(error, "http_status", None) in RETRYABLE_STATUS_CODES
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+llm_scheduler = LLMScheduler()
+metrics.register_callback(
+    "llm_in_flight", "LLM calls currently in flight.", "gauge", lambda: [({}, llm_scheduler.stats()["in_flight"])]
+)
+metrics.register_callback(
+    "llm_queued", "LLM calls waiting to be dispatched.", "gauge", lambda: [({}, llm_scheduler.queued())]
+)
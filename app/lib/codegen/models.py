@@ -82,6 +82,18 @@ class CodeGenResult(BaseModel):
     history: List[CodeGenHistoryItem]
 
 
+class CodeGenEvent(BaseModel):
+    """Data model for representing a progress event emitted while generating code.
+
+    Attributes:
+        event (str): The event type: "plan", "code_diff_chunk", "code_diff" or "result".
+        data (dict): The event payload, e.g. the review and plan, or a generated code diff.
+    """
+
+    event: str
+    data: dict
+
+
 class CodeGenPlannerAIResponse(BaseModel):
     """Data model for representing the response from the Planner AI for code generation.
 
@@ -1,26 +1,147 @@
+import asyncio
+import contextvars
+import hashlib
+import json
 import logging
-from typing import List
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-import openai
 from decouple import config
 
-from app.lib.codegen.models import CodeGenHistoryItem, CodeGenPlan, CodeGenReview, CodeGenResult
+from app.common.exceptions import ApiError
+from app.common.logger import Payload
+from app.lib.codegen.checkpoints import checkpoint_store
+from app.lib.codegen.diff import DiffValidation, checkout_reader, validate_chunk_diffs
+from app.lib.codegen.llm import LLMUsage, current_llm_usage
+from app.lib.codegen.models import CodeGenEvent, CodeGenHistoryItem, CodeGenPlan, CodeGenResult
 from app.lib.codegen.planner import CodeGenPlanner
-from app.lib.codegen.utils import MAX_PLANNING_ATTEMPTS, SUCCESS_SCORE_THRESHOLD, chunk_file_contents
+from app.lib.codegen.result_cache import generate_result_cache_key, result_cache
+from app.lib.codegen.utils import (
+    CODEGEN_CANDIDATE_TOKEN_BUDGET,
+    CODEGEN_CANDIDATES,
+    DIFF_REPAIR_ATTEMPTS,
+    MAX_PLANNING_ATTEMPTS,
+    RELATED_DEFINITIONS_MAX_TOKENS,
+    SUCCESS_SCORE_THRESHOLD,
+    WORKER_CHUNK_DEADLINE,
+    WORKER_CHUNK_TIMEOUT,
+    WORKER_CONCURRENCY,
+    chunk_files,
+    parse_chunk_paths,
+    relevant_steps,
+    render_related_definitions,
+)
 from app.lib.codegen.worker import CodeGenWorker
+from app.lib.file_index import build_file_index
 from app.lib.filesystem import (
-    fetch_file_map,
+    FileRecord,
     fetch_files,
     generate_hash_for_repo_and_prompt,
     prepare_temp_dir,
     remove_temp_dir,
 )
-from app.lib.github import fetch_github_repo_contents
+from app.lib.git import sparse_checkout_add
+from app.lib.github import (
+    FETCH_MODE_SPARSE,
+    REPO_FETCH_MODE,
+    fetch_github_repo_contents,
+    resolve_github_repo_head,
+)
+from app.lib.metrics import metrics
+from app.lib.retrieval import RETRIEVAL_FETCH_TOP_K, RETRIEVAL_TOP_K, load_retrieval_index
+from app.lib.symbols import SymbolIndex, load_symbol_index
+from app.lib.tracing import span
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_OPENAI_MODEL = config("OPENAI_MODEL", "gpt-4")
 
-# Load API key from .env file
-openai.api_key = config("OPENAI_API_KEY")
+CODEGEN_REQUESTS = metrics.counter(
+    "codegen_requests_total", "Code generation runs by outcome: cached, succeeded, exceeded_max_attempts or failed.",
+    ["outcome"]
+)
+CODEGEN_ATTEMPTS = metrics.counter("codegen_planning_attempts_total", "Planning attempts made by code generation runs.")
+WORKER_CHUNKS = metrics.counter(
+    "codegen_worker_chunks_total",
+    "Content chunk diffs by where they came from: worker, or memo when reused from an earlier planning attempt.",
+    ["source"]
+)
+DIFF_HUNKS = metrics.counter(
+    "codegen_diff_hunks_total", "Hunks of merged code diffs by whether they apply to the checkout: applied or failed.",
+    ["outcome"]
+)
+DIFF_REPAIRS = metrics.counter(
+    "codegen_diff_repairs_total", "Content chunks regenerated because their code diff did not apply."
+)
+CHECKPOINT_RESUMES = metrics.counter(
+    "codegen_checkpoint_resumes_total", "Code generation runs that continued from the checkpoints of an earlier run."
+)
+
+# The index of the candidate the current task works on, to tag its progress events
+_current_candidate: contextvars.ContextVar[int] = contextvars.ContextVar("current_candidate", default=0)
+
+
+@dataclass
+class CodeGenCandidate:
+    """A sequence of planning attempts, each reviewing the code diff of the one before.
+
+    Attributes:
+        index (int): The number of the candidate, 0 for the primary candidate.
+        history (List[CodeGenHistoryItem]): The planning attempts, newest first.
+        code_diff (Optional[str]): The code diff of the latest attempt, if any.
+        attempts (int): The number of planning attempts made.
+        finished (bool): Whether the planner accepted the code diff or found nothing to do within the maximum
+            number of attempts.
+        pending (Optional[CodeGenHistoryItem]): The review and plan of the latest attempt while its code diff is
+            being generated.
+    """
+
+    index: int
+    history: List[CodeGenHistoryItem] = field(default_factory=list)
+    code_diff: Optional[str] = None
+    attempts: int = 0
+    finished: bool = False
+    pending: Optional[CodeGenHistoryItem] = None
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """Return the state of the candidate as JSON-serializable values, see from_checkpoint."""
+        return {
+            "history": [item.model_dump() for item in self.history],
+            "code_diff": self.code_diff,
+            "attempts": self.attempts,
+            "pending": self.pending.model_dump() if self.pending else None,
+        }
+
+    @classmethod
+    def from_checkpoint(cls, index: int, state: Dict[str, Any]) -> "CodeGenCandidate":
+        """Restore an unfinished candidate from its checkpoint."""
+        return cls(
+            index=index,
+            history=[CodeGenHistoryItem.model_validate(item) for item in state["history"]],
+            code_diff=state["code_diff"],
+            attempts=state["attempts"],
+            pending=CodeGenHistoryItem.model_validate(state["pending"]) if state["pending"] else None,
+        )
+
+
+def best_reviewed_code_diff(history: List[CodeGenHistoryItem]) -> Tuple[int, Optional[str]]:
+    """Find the code diff with the highest review score.
+
+    Each history item holds the review of the code diff of the item after it, the previous attempt.
+
+    Args:
+        history (List[CodeGenHistoryItem]): The planning attempts, newest first.
+
+    Returns:
+        Tuple[int, Optional[str]]: The highest score, counting missing reviews as 0, and the code diff it was given
+            to, the newest one on ties. (-1, None) if no code diff was reviewed.
+    """
+    best_score, best_code_diff = -1, None
+    for item, reviewed in zip(history, history[1:]):
+        score = item.review.score if item.review else 0
+        if score > best_score:
+            best_score, best_code_diff = score, reviewed.code_diff
+    return best_score, best_code_diff
 
 
 class CodeGenOrchestrator:
@@ -30,81 +151,553 @@ class CodeGenOrchestrator:
         openai_model (str): The model to be used for OpenAI API calls.
         repo_url (str): The URL of the GitHub repository.
         prompt (str): The prompt describing what code should be generated.
+        fetch_mode (str): How the repository is fetched, either "full" or "sparse".
+        worker_concurrency (int): The maximum number of worker calls in flight at once.
+        worker_timeout (float): The number of seconds after which a single worker call is abandoned, counted from
+            when the LLM scheduler dispatches it, so waiting for the rate limits does not count.
+        worker_deadline (float): The number of seconds after which a worker is abandoned altogether, including the
+            time its calls wait in the LLM scheduler and back off before retries, or 0 for no deadline.
+        retrieval_top_k (int): The number of candidate files retrieved for the planner, or 0 to skip retrieval.
+        related_definitions_max_tokens (int): The token budget for the signatures of imported and called definitions
+            attached to each worker chunk, or 0 to attach none.
+        diff_repair_attempts (int): The number of times the chunks whose diffs do not apply to the checkout are
+            regenerated.
+        candidates (int): The number of candidates run concurrently, each planning and reviewing on its own. The
+            first to be accepted by the planner is returned, trading LLM tokens for latency. 1 runs a single one.
+        candidate_token_budget (int): The number of LLM tokens a run may use before candidates other than the
+            primary one stop, or 0 for no limit.
+        event_handler (Optional[Callable[[CodeGenEvent], Awaitable[None]]]): A coroutine function called with each
+            progress event ("plan", "code_diff_chunk", "code_diff" and "result") as it is produced.
+        chunk_diff_memo (Dict[str, str]): The code diffs that applied, by the content, steps and related definitions
+            of their chunk, reused by later planning attempts.
+        run_key (Optional[str]): The key under which the run is checkpointed, set once the repository's HEAD commit
+            is resolved. Runs of the same repository commit, prompt and model share a key, so a retried request
+            continues from the stages an interrupted one completed.
     """
 
-    def __init__(self, repo_url: str, prompt: str, openai_model=DEFAULT_OPENAI_MODEL):
+    def __init__(
+            self,
+            repo_url: str,
+            prompt: str,
+            openai_model=DEFAULT_OPENAI_MODEL,
+            fetch_mode=REPO_FETCH_MODE,
+            worker_concurrency=WORKER_CONCURRENCY,
+            worker_timeout=WORKER_CHUNK_TIMEOUT,
+            worker_deadline=WORKER_CHUNK_DEADLINE,
+            retrieval_top_k=RETRIEVAL_TOP_K,
+            related_definitions_max_tokens=RELATED_DEFINITIONS_MAX_TOKENS,
+            diff_repair_attempts=DIFF_REPAIR_ATTEMPTS,
+            candidates=CODEGEN_CANDIDATES,
+            candidate_token_budget=CODEGEN_CANDIDATE_TOKEN_BUDGET,
+            event_handler: Optional[Callable[[CodeGenEvent], Awaitable[None]]] = None
+    ):
         self.openai_model = openai_model
         self.repo_url = repo_url
         self.prompt = prompt
+        self.fetch_mode = fetch_mode
+        self.worker_concurrency = worker_concurrency
+        self.worker_timeout = worker_timeout
+        self.worker_deadline = worker_deadline
+        self.retrieval_top_k = retrieval_top_k
+        self.related_definitions_max_tokens = related_definitions_max_tokens
+        self.diff_repair_attempts = diff_repair_attempts
+        self.candidates = candidates
+        self.candidate_token_budget = candidate_token_budget
+        self.event_handler = event_handler
+        self.chunk_diff_memo: Dict[str, str] = {}
+        self.run_key: Optional[str] = None
+        self._checkpoints: Dict[str, Any] = {}
+        self._checkout_lock = asyncio.Lock()
+
+    async def _emit(self, event: str, **data) -> None:
+        if self.event_handler is not None:
+            if self.candidates > 1 and event != "result":
+                data["candidate"] = _current_candidate.get()
+            await self.event_handler(CodeGenEvent(event=event, data=data))
+
+    async def _checkpoint(self, values: Dict[str, Any]) -> None:
+        if self.run_key is not None:
+            await checkpoint_store.save(self.run_key, values)
+
+    async def retrieve_candidate_files(self, repo_dir: str, paths: List[str], commit: Optional[str]) -> List[str]:
+        """Rank the repository files by their relevance to the prompt with the retrieval index.
+
+        Args:
+            repo_dir (str): The path of the repository checkout.
+            paths (List[str]): The repository-relative paths of the indexed files.
+            commit (Optional[str]): The commit the checkout is at, if known.
+
+        Returns:
+            List[str]: The paths of up to retrieval_top_k files, most relevant first.
+        """
+        if self.retrieval_top_k <= 0:
+            return []
+        read_files = self.fetch_mode != FETCH_MODE_SPARSE
+        retrieval_index = await load_retrieval_index(repo_dir, paths, commit, read_files)
+        candidates = retrieval_index.search(self.prompt, self.retrieval_top_k)
+        logger.info("Retrieved candidate files: %s", Payload(candidates))
+        return [path for path, _ in candidates]
+
+    async def find_related_definitions(
+            self,
+            symbol_index: Optional[SymbolIndex],
+            chunked_contents: List[str]
+    ) -> List[Optional[str]]:
+        """Render the signatures of the definitions each content chunk imports or calls from other files.
+
+        Args:
+            symbol_index (Optional[SymbolIndex]): The symbol index of the checkout, if there is one.
+            chunked_contents (List[str]): The content chunks.
+
+        Returns:
+            List[Optional[str]]: The rendered related definitions of each chunk, or None where there are none.
+        """
+        if symbol_index is None or self.related_definitions_max_tokens <= 0:
+            return [None] * len(chunked_contents)
+
+        related_definitions = []
+        for content_chunk in chunked_contents:
+            symbols = await symbol_index.related_definitions(parse_chunk_paths(content_chunk))
+            rendered = render_related_definitions(symbols, self.related_definitions_max_tokens, self.openai_model)
+            related_definitions.append(rendered or None)
+        return related_definitions
+
+    @staticmethod
+    def chunk_steps(chunked_contents: List[str], steps: List[str]) -> List[List[str]]:
+        """Select the steps of the plan that apply to each content chunk, see relevant_steps."""
+        chunk_paths = [parse_chunk_paths(content_chunk) for content_chunk in chunked_contents]
+        all_paths = list(dict.fromkeys(path for paths in chunk_paths for path in paths))
+        return [relevant_steps(steps, paths, all_paths) for paths in chunk_paths]
+
+    def chunk_memo_key(self, content_chunk: str, steps: List[str], related_definitions: Optional[str]) -> str:
+        """Return the key of a chunk's code diff in chunk_diff_memo, a hash of everything the worker is given."""
+        worker_input = json.dumps([self.openai_model, content_chunk, steps, related_definitions])
+        return hashlib.sha256(worker_input.encode()).hexdigest()
+
+    async def generate_chunk_diffs(
+            self,
+            chunked_contents: List[str],
+            steps: List[str],
+            attempt: int = 1,
+            related_definitions: Optional[List[Optional[str]]] = None,
+            chunk_indices: Optional[List[int]] = None,
+            feedback: Optional[List[Optional[str]]] = None
+    ) -> List[Optional[str]]:
+        """Generate code diffs for all content chunks concurrently, with bounded parallelism.
+
+        Each worker is given only the steps that apply to its chunk. Chunks whose content, steps and related
+        definitions are unchanged since an earlier planning attempt reuse their code diff from chunk_diff_memo
+        instead of running a worker. A "code_diff_chunk" event is emitted as soon as each chunk's diff is generated.
+
+        Args:
+            chunked_contents (List[str]): The content chunks to generate code diffs for.
+            steps (List[str]): The steps to apply to each chunk.
+            attempt (int, optional): The planning attempt the chunks belong to. Defaults to 1.
+            related_definitions (Optional[List[Optional[str]]], optional): The rendered related definitions of each
+                chunk. Defaults to None.
+            chunk_indices (Optional[List[int]], optional): The indices of the chunks to generate code diffs for,
+                e.g. to regenerate only some of them. Defaults to all chunks.
+            feedback (Optional[List[Optional[str]]], optional): An additional step for each chunk, e.g. why its
+                previous code diff did not apply. Defaults to None.
+
+        Returns:
+            List[Optional[str]]: The code diff for each chunk, in chunk order, or None where the worker failed,
+                                 timed out, missed its deadline or was not run.
+
+        Raises:
+            ApiError: Raised when the workers failed for every chunk.
+        """
+        semaphore = asyncio.Semaphore(self.worker_concurrency)
+        related_definitions = related_definitions or [None] * len(chunked_contents)
+        feedback = feedback or [None] * len(chunked_contents)
+        chunk_indices = list(range(len(chunked_contents))) if chunk_indices is None else chunk_indices
+        chunk_steps = self.chunk_steps(chunked_contents, steps)
+
+        async def generate(chunk_index: int, content_chunk: str) -> str:
+            worker_steps = chunk_steps[chunk_index]
+            if feedback[chunk_index]:
+                worker_steps = worker_steps + [feedback[chunk_index]]
+            memo_key = self.chunk_memo_key(content_chunk, worker_steps, related_definitions[chunk_index])
+            code_diff_chunk = self.chunk_diff_memo.get(memo_key)
+            if code_diff_chunk is not None:
+                WORKER_CHUNKS.inc(source="memo")
+            else:
+                async with semaphore:
+                    with span("worker", attempt=attempt, chunk_index=chunk_index):
+                        worker = CodeGenWorker(
+                            content_chunk,
+                            worker_steps,
+                            self.openai_model,
+                            related_definitions[chunk_index],
+                            timeout=self.worker_timeout
+                        )
+                        if self.worker_deadline:
+                            code_diff_chunk = await asyncio.wait_for(worker.generate_code_diff(), self.worker_deadline)
+                        else:
+                            code_diff_chunk = await worker.generate_code_diff()
+                WORKER_CHUNKS.inc(source="worker")
+            await self._emit(
+                "code_diff_chunk",
+                attempt=attempt,
+                chunk_index=chunk_index,
+                chunk_count=len(chunked_contents),
+                code_diff=code_diff_chunk
+            )
+            return code_diff_chunk
 
-    def generate_code_diff(self) -> CodeGenResult:
+        results = await asyncio.gather(
+            *(generate(index, chunked_contents[index]) for index in chunk_indices),
+            return_exceptions=True
+        )
+
+        code_diff_chunks: List[Optional[str]] = [None] * len(chunked_contents)
+        for index, result in zip(chunk_indices, results):
+            if isinstance(result, BaseException):
+                logger.warning("Worker failed for content chunk %d of %d: %r", index + 1, len(chunked_contents), result)
+            else:
+                code_diff_chunks[index] = result
+
+        if results and all(not isinstance(result, str) for result in results):
+            raise ApiError(f"Code generation failed for all {len(results)} content chunks")
+        return code_diff_chunks
+
+    async def merge_chunk_diffs(
+            self,
+            repo_dir: str,
+            file_records: List[FileRecord],
+            chunked_contents: List[str],
+            steps: List[str],
+            code_diff_chunks: List[Optional[str]],
+            attempt: int = 1,
+            related_definitions: Optional[List[Optional[str]]] = None
+    ) -> DiffValidation:
+        """Merge the code diffs of all content chunks into one diff per file and dry-run it against the checkout.
+
+        Only the chunks with hunks that do not apply are regenerated, up to diff_repair_attempts times, with the
+        failures given to the worker as an additional step. Hunks that still do not apply are left out. The diffs of
+        the chunks that apply are added to chunk_diff_memo and checkpointed.
+
+        Args:
+            repo_dir (str): The path of the repository checkout.
+            file_records (List[FileRecord]): The files the chunks were made from.
+            chunked_contents (List[str]): The content chunks.
+            steps (List[str]): The steps applied to each chunk.
+            code_diff_chunks (List[Optional[str]]): The code diff for each chunk, or None where the worker failed.
+            attempt (int, optional): The planning attempt the chunks belong to. Defaults to 1.
+            related_definitions (Optional[List[Optional[str]]], optional): The rendered related definitions of each
+                chunk. Defaults to None.
+
+        Returns:
+            DiffValidation: The merged file diffs that apply, and the failures of the hunks that do not.
+        """
+        read_file = checkout_reader(repo_dir, file_records)
+        code_diff_chunks = list(code_diff_chunks)
+        validation = await asyncio.to_thread(validate_chunk_diffs, code_diff_chunks, read_file)
+
+        for _ in range(self.diff_repair_attempts):
+            failed_chunks = validation.failed_chunks
+            if not failed_chunks:
+                break
+            feedback: List[Optional[str]] = [None] * len(chunked_contents)
+            for failure in validation.failures:
+                if failure.chunk_index is not None:
+                    feedback[failure.chunk_index] = (feedback[failure.chunk_index] or (
+                        "Your previous code diff for this chunk did not apply to the files as shown. Regenerate it "
+                        "with hunk headers, context and removed lines that match the files exactly. Failed hunks:"
+                    )) + f"\n- {failure.describe()}"
+            logger.info("Regenerating %d content chunks whose diffs do not apply", len(failed_chunks))
+            DIFF_REPAIRS.inc(len(failed_chunks))
+            try:
+                repaired = await self.generate_chunk_diffs(
+                    chunked_contents, steps, attempt, related_definitions, failed_chunks, feedback
+                )
+            except ApiError:
+                break
+            for index in failed_chunks:
+                if repaired[index] is not None:
+                    code_diff_chunks[index] = repaired[index]
+            validation = await asyncio.to_thread(validate_chunk_diffs, code_diff_chunks, read_file)
+
+        related_definitions = related_definitions or [None] * len(chunked_contents)
+        failed_chunks = set(validation.failed_chunks)
+        chunk_steps = self.chunk_steps(chunked_contents, steps)
+        chunk_diff_checkpoints = {}
+        for index, content_chunk in enumerate(chunked_contents):
+            if index not in failed_chunks and code_diff_chunks[index] is not None:
+                memo_key = self.chunk_memo_key(content_chunk, chunk_steps[index], related_definitions[index])
+                self.chunk_diff_memo[memo_key] = code_diff_chunks[index]
+                chunk_diff_checkpoints[f"chunk_diff/{memo_key}"] = code_diff_chunks[index]
+        await self._checkpoint(chunk_diff_checkpoints)
+        for failure in validation.failures:
+            logger.warning("Leaving out code diff of chunk %s: %s", failure.chunk_index, failure.describe())
+        DIFF_HUNKS.inc(sum(len(file_diff.hunks) for file_diff in validation.files), outcome="applied")
+        DIFF_HUNKS.inc(len(validation.failures), outcome="failed")
+        return validation
+
+    async def work_on_plan(
+            self,
+            repo_dir: str,
+            plan: CodeGenPlan,
+            candidate_files: List[str],
+            symbol_index: Optional[SymbolIndex],
+            attempt: int = 1
+    ) -> str:
+        """Generate the code diff of a plan: fetch and chunk its files, run the workers and merge their diffs.
+
+        Args:
+            repo_dir (str): The path of the repository checkout.
+            plan (CodeGenPlan): The plan to carry out.
+            candidate_files (List[str]): The retrieval candidates, best first. The best RETRIEVAL_FETCH_TOP_K are
+                worked on even if the plan does not list them.
+            symbol_index (Optional[SymbolIndex]): The symbol index of the checkout, if there is one.
+            attempt (int, optional): The planning attempt the plan belongs to. Defaults to 1.
+
+        Returns:
+            str: The merged code diff.
+        """
+        file_paths = plan.file_paths + [
+            path for path in candidate_files[:RETRIEVAL_FETCH_TOP_K] if path not in plan.file_paths
+        ]
+        with span("chunk"):
+            if self.fetch_mode == FETCH_MODE_SPARSE:
+                async with self._checkout_lock:  # concurrent candidates share the checkout
+                    await sparse_checkout_add(repo_dir, file_paths)
+            file_records = await asyncio.to_thread(fetch_files, repo_dir, file_paths)
+            chunked_contents = chunk_files(file_records, model=self.openai_model)
+        logger.info(
+            "Created %d content chunks for the following files: %s.", len(chunked_contents), Payload(file_paths)
+        )
+
+        with span("work"):
+            related_definitions = await self.find_related_definitions(symbol_index, chunked_contents)
+            code_diff_chunks = await self.generate_chunk_diffs(
+                chunked_contents, plan.steps, attempt, related_definitions
+            )
+        with span("validate", attempt=attempt):
+            validation = await self.merge_chunk_diffs(
+                repo_dir, file_records, chunked_contents, plan.steps, code_diff_chunks, attempt, related_definitions
+            )
+        return validation.render()
+
+    def _over_budget(self) -> bool:
+        usage = current_llm_usage.get()
+        return self.candidate_token_budget > 0 and usage is not None and usage.tokens >= self.candidate_token_budget
+
+    async def run_candidate(
+            self,
+            candidate: CodeGenCandidate,
+            repo_dir: str,
+            repo_file_map: str,
+            candidate_files: List[str],
+            symbol_index: Optional[SymbolIndex],
+            pruned_file_map: Optional[str] = None
+    ) -> CodeGenCandidate:
+        """Plan, work and review until the planner accepts the code diff or the planning attempts run out.
+
+        Candidates other than the primary one bypass the LLM cache, so they get plans of their own, and stop early
+        once the run has used its candidate token budget. The candidate is checkpointed after each plan and code
+        diff, and a candidate restored from its checkpoint continues with the attempt it was interrupted in.
+
+        Args:
+            candidate (CodeGenCandidate): The candidate to run, updated in place.
+            repo_dir (str): The path of the repository checkout.
+            repo_file_map (str): The rendered file index of the checkout.
+            candidate_files (List[str]): The retrieval candidates, best first.
+            symbol_index (Optional[SymbolIndex]): The symbol index of the checkout, if there is one.
+            pruned_file_map (Optional[str], optional): The file index rendered with only the directories of the
+                retrieval candidates listed in full, for planner prompts the full file map does not fit in. Defaults
+                to None.
+
+        Returns:
+            CodeGenCandidate: The candidate.
+        """
+        _current_candidate.set(candidate.index)
+        checkpoint_name = f"candidate/{candidate.index}"
+        previous_steps = candidate.history[0].plan.steps if candidate.history and candidate.history[0].plan else None
+
+        while candidate.attempts <= MAX_PLANNING_ATTEMPTS:
+            if candidate.pending is not None:
+                review, plan = candidate.pending.review, candidate.pending.plan
+                attempt = candidate.attempts
+                logger.info("Resuming planning attempt %d from its checkpoint", attempt)
+            else:
+                if candidate.index > 0 and self._over_budget():
+                    logger.info("Stopping candidate %d, the run has used its LLM token budget", candidate.index)
+                    break
+                candidate.attempts += 1
+                attempt = candidate.attempts
+                CODEGEN_ATTEMPTS.inc()
+                logger.info("Planning attempt %d of %d", attempt, MAX_PLANNING_ATTEMPTS)
+
+                planner = CodeGenPlanner(
+                    self.prompt,
+                    repo_file_map,
+                    candidate.code_diff,
+                    previous_steps,
+                    self.openai_model,
+                    candidate_files,
+                    pruned_file_map
+                )
+                with span("plan", attempt=attempt, candidate=candidate.index):
+                    review, plan = await planner.review_and_plan(use_cache=candidate.index == 0)
+                logger.info("Review: %s", Payload(review))
+                logger.info("Plan: %s", Payload(plan))
+                await self._emit("plan", attempt=attempt, review=review, plan=plan)
+
+                if (review and review.score >= SUCCESS_SCORE_THRESHOLD) or \
+                        (plan and len(plan.steps) == 0) or \
+                        (attempt > MAX_PLANNING_ATTEMPTS):
+                    candidate.history.insert(0, CodeGenHistoryItem(plan=plan, review=review, code_diff=None))
+                    candidate.finished = attempt <= MAX_PLANNING_ATTEMPTS
+                    break
+
+                candidate.pending = CodeGenHistoryItem(plan=plan, review=review, code_diff=None)
+                await self._checkpoint({checkpoint_name: candidate.checkpoint()})
+
+            candidate.code_diff = await self.work_on_plan(repo_dir, plan, candidate_files, symbol_index, attempt)
+            candidate.history.insert(0, CodeGenHistoryItem(plan=plan, review=review, code_diff=candidate.code_diff))
+            candidate.pending = None
+            await self._checkpoint({checkpoint_name: candidate.checkpoint()})
+            previous_steps = plan.steps
+            await self._emit("code_diff", attempt=attempt, code_diff=candidate.code_diff)
+        return candidate
+
+    def _restore_candidate(self, index: int) -> CodeGenCandidate:
+        state = self._checkpoints.get(f"candidate/{index}")
+        return CodeGenCandidate.from_checkpoint(index, state) if state else CodeGenCandidate(index)
+
+    async def run_candidates(self, *args) -> CodeGenCandidate:
+        """Run `candidates` candidates concurrently, see run_candidate for the arguments.
+
+        Returns as soon as a candidate finishes, cancelling the others. If none finishes, the candidate with the
+        best reviewed code diff is returned.
+
+        Returns:
+            CodeGenCandidate: The chosen candidate.
+
+        Raises:
+            Exception: The error of the primary candidate, if every candidate failed.
+        """
+        if self.candidates <= 1:
+            return await self.run_candidate(self._restore_candidate(0), *args)
+
+        tasks = [
+            asyncio.create_task(self.run_candidate(self._restore_candidate(index), *args))
+            for index in range(self.candidates)
+        ]
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is None and task.result().finished:
+                        logger.info("Candidate %d finished first", task.result().index)
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        completed = [task.result() for task in tasks if task.exception() is None]
+        if not completed:
+            raise tasks[0].exception()
+        return max(completed, key=lambda candidate: best_reviewed_code_diff(candidate.history)[0])
+
+    async def generate_code_diff(self) -> CodeGenResult:
         """Generate a code difference based on the GitHub repository and a given prompt.
 
+        Results are cached by repository HEAD commit, prompt and model. On a cache hit the stored result is
+        returned without cloning the repository or calling the LLM. Unless checkpoints are disabled, the file map,
+        every plan and code diff, and the diffs of the content chunks are checkpointed as the run progresses, and a
+        run of the same commit, prompt and model continues from them, e.g. when a failed or timed out request is
+        retried. The run is traced as a "codegen" span, with a child span for each stage.
+
         Returns:
             CodeGenResult: An object containing the generated code diff, whether max attempts were exceeded,
                            and the history of code generation steps.
         """
-        review: CodeGenReview
-        plan: CodeGenPlan
-        code_diff: str = None
-        previous_steps: List[str] = None
-        attempts = 0
-        history: List[CodeGenHistoryItem] = []
+        with span("codegen", model=self.openai_model, fetch_mode=self.fetch_mode, candidates=self.candidates):
+            usage_token = current_llm_usage.set(LLMUsage())
+            try:
+                return await self._generate_code_diff()
+            except Exception:
+                CODEGEN_REQUESTS.inc(outcome="failed")
+                raise
+            finally:
+                current_llm_usage.reset(usage_token)
+
+    async def _generate_code_diff(self) -> CodeGenResult:
+        logger.info("Generating code diff for repo: %s and prompt: %s", self.repo_url, Payload(self.prompt))
 
-        logging.info(f"Generating code diff for repo: {self.repo_url} and prompt: {self.prompt}")
+        commit = None
+        result_cache_key = None
+        if result_cache.enabled or checkpoint_store.enabled:
+            commit = await resolve_github_repo_head(self.repo_url)
+            run_key = generate_result_cache_key(self.repo_url, commit, self.prompt, self.openai_model)
+        if result_cache.enabled:
+            result_cache_key = run_key
+            cached_result = await result_cache.get(result_cache_key)
+            if cached_result is not None:
+                logger.info("Returning cached result for repo: %s at commit %s", self.repo_url, commit)
+                result = CodeGenResult.model_validate_json(cached_result)
+                CODEGEN_REQUESTS.inc(outcome="cached")
+                await self._emit("result", result=result)
+                return result
+        if checkpoint_store.enabled:
+            self.run_key = run_key
+            self._checkpoints = await checkpoint_store.load(run_key)
+            if self._checkpoints:
+                logger.info("Resuming run %s from %d checkpoints", run_key, len(self._checkpoints))
+                CHECKPOINT_RESUMES.inc()
+            self.chunk_diff_memo.update({
+                name.split("/", 1)[1]: code_diff_chunk
+                for name, code_diff_chunk in self._checkpoints.items() if name.startswith("chunk_diff/")
+            })
 
         repo_hash = generate_hash_for_repo_and_prompt(self.repo_url, self.prompt)
-        repo_dir = prepare_temp_dir(repo_hash)
-        fetch_github_repo_contents(self.repo_url, repo_dir)
-        repo_file_map = fetch_file_map(repo_dir)
-
-        while attempts <= MAX_PLANNING_ATTEMPTS:
-            attempts += 1
-            logging.info(f"Planning attempt {attempts} of {MAX_PLANNING_ATTEMPTS}")
-
-            planner = CodeGenPlanner(self.prompt, repo_file_map, code_diff, previous_steps, self.openai_model)
-            review, plan = planner.review_and_plan()
-            logging.info(f"Review: {review}")
-            logging.info(f"Plan: {plan}")
-
-            if (review and review.score >= SUCCESS_SCORE_THRESHOLD) or \
-                    (plan and len(plan.steps) == 0) or \
-                    (attempts > MAX_PLANNING_ATTEMPTS):
-                history.insert(0, CodeGenHistoryItem(plan=plan, review=review, code_diff=None))
-                logging.debug("breaking out of while loop")
-                break
+        repo_dir = await asyncio.to_thread(prepare_temp_dir, repo_hash)
+        try:
+            with span("clone"):
+                await fetch_github_repo_contents(self.repo_url, repo_dir, self.fetch_mode, commit)
+            file_map = self._checkpoints.get("file_map")
+            if file_map is None:
+                # Built once per checkout and reused by every planning attempt. Sparse checkouts have only fetched
+                # trees, so their files cannot be read until the plan pulls them in.
+                with span("file_map"):
+                    read_files = self.fetch_mode != FETCH_MODE_SPARSE
+                    repo_file_index = await build_file_index(repo_dir, read_files=read_files)
+            with span("retrieval"):
+                if file_map is None:
+                    candidate_files = await self.retrieve_candidate_files(repo_dir, repo_file_index.paths, commit)
+                    file_map = {
+                        "rendered": repo_file_index.rendered,
+                        "pruned": repo_file_index.render(keep_paths=candidate_files),
+                        "candidate_files": candidate_files,
+                    }
+                    await self._checkpoint({"file_map": file_map})
+                symbol_index = await load_symbol_index(repo_dir)
 
-            file_contents = fetch_files(repo_dir, plan.file_paths)
-            chunked_contents = chunk_file_contents(file_contents)
-            logging.info(f"Created {len(chunked_contents)} content chunks for the following files: {plan.file_paths}.")
+            candidate = await self.run_candidates(
+                repo_dir, file_map["rendered"], file_map["candidate_files"], symbol_index, file_map.get("pruned")
+            )
+        finally:
+            await asyncio.to_thread(remove_temp_dir, repo_dir)  # cleanup
 
-            code_diff_chunks: List[str] = []
-            for content_chunk in chunked_contents:
-                worker = CodeGenWorker(content_chunk, plan.steps, self.openai_model)
-                code_diff_chunk = worker.generate_code_diff()
-                code_diff_chunks.append(code_diff_chunk)
+        code_diff = candidate.code_diff
+        if not candidate.finished:
+            code_diff = best_reviewed_code_diff(candidate.history)[1] or code_diff
 
-            code_diff = "\n".join(code_diff_chunks)
-            history.insert(0, CodeGenHistoryItem(plan=plan, review=review, code_diff=code_diff))
-            previous_steps = plan.steps
+        logger.info("Returning code diff: %s", Payload(code_diff))
 
-        remove_temp_dir(repo_dir)  # cleanup
-
-        if attempts > MAX_PLANNING_ATTEMPTS:
-            # Find the index of the history item with the highest score
-            max_score_index = max(
-                range(len(history)), 
-                key=lambda i: getattr(getattr(history[i], 'review', None), 'score', 0)
-            )     
-            # Use the code_diff from the history item referred to by the item with the highest review score
-            next_index = max_score_index + 1
-            if next_index < len(history):
-                code_diff = history[next_index].code_diff
-
-        logging.info(f"Returning code diff: {code_diff}")
-
-        return CodeGenResult(
-            code_diff=code_diff,
-            exceeded_max_attempts=(attempts > MAX_PLANNING_ATTEMPTS),
-            history=history
+        result = CodeGenResult(
+            code_diff=code_diff or "",
+            exceeded_max_attempts=not candidate.finished,
+            history=candidate.history
         )
+        CODEGEN_REQUESTS.inc(outcome="exceeded_max_attempts" if result.exceeded_max_attempts else "succeeded")
+        if result_cache_key is not None and not result.exceeded_max_attempts:
+            await result_cache.set(result_cache_key, result.model_dump_json())
+        if self.run_key is not None:
+            await checkpoint_store.delete(self.run_key)
+        await self._emit("result", result=result)
+        return result
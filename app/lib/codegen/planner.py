@@ -1,9 +1,9 @@
 import json
-from typing import Dict, List, Tuple
-
-import openai
+from typing import List, Optional, Tuple
 
 from app.common.exceptions import ApiError
+from app.lib.codegen.llm import create_function_call
+from app.lib.codegen.llm_scheduler import LLMPriority
 from app.lib.codegen.models import CodeGenPlan, CodeGenPlannerAIResponse, CodeGenReview
 from app.lib.codegen.utils import SUCCESS_SCORE_THRESHOLD
 from app.lib.codegen.utils.prompts import generate_review_and_plan_prompt
@@ -14,51 +14,72 @@ class CodeGenPlanner:
 
     Attributes:
         prompt (str): The prompt describing what code should be generated.
-        repo_file_map (Dict): A dictionary mapping file names to their content.
+        repo_file_map (str): The repository file map, rendered as a tree of repository-relative paths.
         code_diff (str): The existing code difference.
         steps (List[str]): The previous steps that have been taken.
         openai_model: The OpenAI model to be used for generating plans.
+        candidate_files (Optional[List[str]]): The files most relevant to the prompt according to the retrieval
+            index, best first.
+        pruned_file_map (Optional[str]): The repository file map with only the directories of the candidate files
+            listed in full, used instead of the full map when that would take up too much of the prompt.
     """
 
-    def __init__(self, prompt: str, repo_file_map: Dict, code_diff: str, steps: List[str], openai_model):
+    def __init__(
+            self,
+            prompt: str,
+            repo_file_map: str,
+            code_diff: str,
+            steps: List[str],
+            openai_model,
+            candidate_files: Optional[List[str]] = None,
+            pruned_file_map: Optional[str] = None
+    ):
         self.prompt = prompt
         self.repo_file_map = repo_file_map
         self.code_diff = code_diff
         self.steps = steps
         self.openai_model = openai_model
+        self.candidate_files = candidate_files
+        self.pruned_file_map = pruned_file_map
 
-    def review_and_plan(self) -> Tuple[CodeGenReview, CodeGenPlan]:
+    async def review_and_plan(self, use_cache: bool = True) -> Tuple[CodeGenReview, CodeGenPlan]:
         """Generate a review of the previous execution and a new plan for future execution.
 
+        Args:
+            use_cache (bool, optional): Whether to use the LLM response cache, e.g. False to get another plan for
+                the same inputs. Defaults to True.
+
         Returns:
             Tuple[CodeGenReview, CodeGenPlan]: A tuple containing a review object and a plan object.
         """
-        response = openai.ChatCompletion.create(
-            model=self.openai_model,
-            messages=[
+        arguments = await create_function_call(
+            self.openai_model,
+            [
                 {
                     "role": "user",
                     "content": generate_review_and_plan_prompt(
                         self.prompt,
                         self.repo_file_map,
                         self.code_diff,
-                        self.steps
+                        self.steps,
+                        self.candidate_files,
+                        model=self.openai_model,
+                        pruned_file_map=self.pruned_file_map
                     )
                 }
             ],
-            functions=[
-                {
-                    "name": "get_codegen_review_and_plan",
-                    "description": "Generate a review and plan for implementing a code diff based on the provided fields.",
-                    "parameters": CodeGenPlannerAIResponse.schema()
-                }
-            ],
-            function_call={"name": "get_codegen_review_and_plan"}
+            {
+                "name": "get_codegen_review_and_plan",
+                "description": "Generate a review and plan for implementing a code diff based on the provided fields.",
+                "parameters": CodeGenPlannerAIResponse.model_json_schema()
+            },
+            use_cache=use_cache,
+            priority=LLMPriority.PLANNER
         )
 
-        if len(response.choices):
+        if arguments is not None:
             try:
-                output = json.loads(response.choices[0]["message"]["function_call"]["arguments"])
+                output = json.loads(arguments)
             except json.JSONDecodeError:
                 raise ApiError("Failed to decode codegen planner JSON response from API")
 
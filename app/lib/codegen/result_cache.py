@@ -0,0 +1,45 @@
+import hashlib
+import json
+
+from decouple import config
+
+from app.lib.cache import TieredCache
+
+RESULT_CACHE_ENABLED = config("RESULT_CACHE_ENABLED", True, cast=bool)
+RESULT_CACHE_PATH = config("RESULT_CACHE_PATH", "/tmp/result_cache")
+RESULT_CACHE_TTL = config("RESULT_CACHE_TTL", 7 * 24 * 3600, cast=float)  # seconds
+RESULT_CACHE_MEMORY_ENTRIES = config("RESULT_CACHE_MEMORY_ENTRIES", 256, cast=int)
+RESULT_CACHE_DISK_MAX_BYTES = config("RESULT_CACHE_DISK_MAX_BYTES", 256 * 1024 ** 2, cast=int)
+
+
+def generate_result_cache_key(repo_url: str, commit: str, prompt: str, model: str) -> str:
+    """Generate the cache key of a code generation result.
+
+    Parameters:
+        repo_url (str): The URL of the repository.
+        commit (str): The commit the repository's HEAD resolved to.
+        prompt (str): The code generation prompt.
+        model (str): The name of the model.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical JSON encoding of the inputs.
+    """
+    inputs = {"repo_url": repo_url, "commit": commit, "prompt": prompt, "model": model}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache(TieredCache):
+    """A two-tier cache of serialized CodeGenResult objects, keyed by repository commit, prompt and model."""
+
+    def __init__(
+            self,
+            enabled: bool = RESULT_CACHE_ENABLED,
+            cache_path: str = RESULT_CACHE_PATH,
+            ttl: float = RESULT_CACHE_TTL,
+            memory_entries: int = RESULT_CACHE_MEMORY_ENTRIES,
+            disk_max_bytes: int = RESULT_CACHE_DISK_MAX_BYTES
+    ):
+        super().__init__(cache_path, enabled, ttl, memory_entries, disk_max_bytes)
+
+
+result_cache = ResultCache()
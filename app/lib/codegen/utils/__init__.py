@@ -1,60 +1,214 @@
-from typing import List
+from typing import Dict, List, Tuple
 import re
 from decouple import config
 
+from app.lib.codegen.utils.tokens import DEFAULT_TOKENIZER_MODEL, count_tokens, count_tokens_cached
+from app.lib.filesystem import FileRecord
+from app.lib.symbols import Symbol
+
 MAX_PLANNING_ATTEMPTS = config("MAX_PLANNING_ATTEMPTS", 2, cast=int)
 SUCCESS_SCORE_THRESHOLD = config("SUCCESS_SCORE_THRESHOLD", 7, cast=int)  # out of 10
-MAX_CHARACTERS_PER_CHUNK = config("MAX_CHARACTERS_PER_CHUNK", 10000, cast=int)
+MAX_TOKENS_PER_CHUNK = config("MAX_TOKENS_PER_CHUNK", 3000, cast=int)
+PLANNER_PROMPT_MAX_TOKENS = config("PLANNER_PROMPT_MAX_TOKENS", 6000, cast=int)  # 0 for no limit
+WORKER_CONCURRENCY = config("WORKER_CONCURRENCY", 4, cast=int)
+WORKER_CHUNK_TIMEOUT = config("WORKER_CHUNK_TIMEOUT", 120, cast=float)  # seconds
+WORKER_CHUNK_DEADLINE = config("WORKER_CHUNK_DEADLINE", 300, cast=float)  # seconds per chunk overall, 0 for none
+RELATED_DEFINITIONS_MAX_TOKENS = config("RELATED_DEFINITIONS_MAX_TOKENS", 800, cast=int)
+DIFF_REPAIR_ATTEMPTS = config("DIFF_REPAIR_ATTEMPTS", 1, cast=int)  # regenerations of chunks whose hunks do not apply
+CODEGEN_CANDIDATES = config("CODEGEN_CANDIDATES", 1, cast=int)  # over 1 runs that many candidates concurrently
+CODEGEN_CANDIDATE_TOKEN_BUDGET = config("CODEGEN_CANDIDATE_TOKEN_BUDGET", 0, cast=int)  # per run, 0 for no limit
+
+FILE_HEADER = "\n--- File: {path} ---\n"
+FILE_PART_HEADER = "\n--- File: {path} (lines {start}-{end}) ---\n"
+CHUNK_SEPARATOR = "\n---\n"
+CHUNK_FILE_HEADER_PATTERN = re.compile(r"^--- File: (.+?)(?: \(lines \d+-\d+\))? ---$", re.MULTILINE)
+
+# Unindented lines that open a top-level definition, where an oversize file can be split without cutting a block
+TOP_LEVEL_BOUNDARY_PATTERN = re.compile(
+    r"(?:@|(?:async\s+)?def\s|class\s|(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:async\s+)?(?:function|class)\b|"
+    r"func\s|(?:pub\s+)?(?:fn|struct|enum|impl|trait|mod)\s|interface\s|type\s|module\s)"
+)
+
+
+def parse_chunk_paths(content_chunk: str) -> List[str]:
+    """List the paths of the files in a content chunk, in order and without duplicates.
+
+    Args:
+        content_chunk (str): The content chunk.
+
+    Returns:
+        List[str]: The repository-relative paths of the files in the chunk.
+    """
+    return list(dict.fromkeys(CHUNK_FILE_HEADER_PATTERN.findall(content_chunk)))
+
+
+def _mentions(step: str, path: str) -> bool:
+    # By its path, or by its file name where not part of another path
+    return any(
+        re.search(rf"(?<![\w/.-]){re.escape(name)}(?![\w/-])", step) for name in (path, path.rsplit("/", 1)[-1])
+    )
 
 
-def chunk_file_contents(repo_contents: str) -> List[str]:
-    
-    # break up repo_contents into chunks of MAX_CHARACTERS_PER_CHUNK
-    # do not split up files into multiple chunks unless the entire file is larger than MAX_CHARACTERS_PER_CHUNK
+def relevant_steps(steps: List[str], chunk_paths: List[str], all_paths: List[str]) -> List[str]:
+    """Select the steps that apply to a content chunk.
 
-    current_chunk = ""
-    all_chunks = []
-    
-    for file_content in repo_contents.split("\n--- File: "):
+    A step applies to a chunk if it mentions one of the chunk's files by path or file name, or if it mentions none
+    of the files being worked on, e.g. "Add type hints to all functions".
 
-        if file_content == "":
+    Args:
+        steps (List[str]): The steps of the plan.
+        chunk_paths (List[str]): The paths of the files in the chunk.
+        all_paths (List[str]): The paths of the files in all chunks.
+
+    Returns:
+        List[str]: The steps that apply to the chunk, in plan order.
+    """
+    selected = []
+    for step in steps:
+        mentioned = [path for path in all_paths if _mentions(step, path)]
+        if not mentioned or any(path in chunk_paths for path in mentioned):
+            selected.append(step)
+    return selected
+
+
+def render_related_definitions(
+        symbols: List[Symbol],
+        max_tokens: int = RELATED_DEFINITIONS_MAX_TOKENS,
+        model: str = DEFAULT_TOKENIZER_MODEL
+) -> str:
+    """Render definitions as signatures grouped by file, keeping within a token budget.
+
+    Args:
+        symbols (List[Symbol]): The definitions, most relevant first. Definitions that do not fit are left out.
+        max_tokens (int, optional): The maximum number of tokens. Defaults to RELATED_DEFINITIONS_MAX_TOKENS.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-4".
+
+    Returns:
+        str: The rendered definitions, or an empty string if there are none.
+    """
+    by_path: Dict[str, List[str]] = {}
+    tokens = 0
+    for symbol in symbols:
+        header_tokens = 0 if symbol.path in by_path else count_tokens(f"# {symbol.path}\n", model)
+        symbol_tokens = header_tokens + count_tokens(symbol.signature + "\n\n", model)
+        if tokens + symbol_tokens > max_tokens:
             continue
-        else:
-            file_content = f"\n--- File: {file_content}"
-
-        # Check if the file is empty using regex pattern
-        # An empty file will have its own dedicated chunk
-        empty_file_match = re.fullmatch(r"\n--- File: .+ ---\n", file_content)
-        if empty_file_match:
-            # If there's a current chunk, save it first
-            if current_chunk:
-                all_chunks.append(current_chunk)
-                current_chunk = ""
-                
-            all_chunks.append(file_content)
+        tokens += symbol_tokens
+        by_path.setdefault(symbol.path, []).append(symbol.signature)
+    return "\n\n".join(f"# {path}\n" + "\n\n".join(signatures) for path, signatures in by_path.items())
+
+
+def _find_split_points(lines: List[str]) -> List[int]:
+    split_points = [0]
+    for index in range(1, len(lines)):
+        if TOP_LEVEL_BOUNDARY_PATTERN.match(lines[index]) and not lines[index - 1].startswith("@"):
+            split_points.append(index)
+    return split_points
+
+
+def split_file_content(
+        content: str,
+        max_tokens: int,
+        model: str = DEFAULT_TOKENIZER_MODEL
+) -> List[Tuple[int, int, str]]:
+    """Split the content of a file into parts of at most max_tokens tokens each.
+
+    Parts are cut on top-level definitions (functions, classes and the like) where possible. Definitions that are
+    too large on their own are cut into windows of whole lines.
+
+    Args:
+        content (str): The content of the file.
+        max_tokens (int): The maximum number of tokens per part.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-4".
+
+    Returns:
+        List[Tuple[int, int, str]]: The first line, last line (1-based, inclusive) and content of each part.
+    """
+    lines = content.splitlines(keepends=True)
+    line_tokens = [count_tokens(line, model) for line in lines]
+    split_points = _find_split_points(lines) + [len(lines)]
+
+    parts = []
+    part_start = 0
+    part_tokens = 0
+
+    def flush(end: int) -> None:
+        nonlocal part_start, part_tokens
+        if end > part_start:
+            parts.append((part_start + 1, end, "".join(lines[part_start:end])))
+        part_start = end
+        part_tokens = 0
+
+    for block_start, block_end in zip(split_points, split_points[1:]):
+        block_tokens = sum(line_tokens[block_start:block_end])
+        if part_tokens + block_tokens <= max_tokens:
+            part_tokens += block_tokens
+            continue
+        flush(block_start)
+        if block_tokens <= max_tokens:
+            part_tokens = block_tokens
+            continue
+        # The definition alone is over budget, so fall back to windows of whole lines
+        for index in range(block_start, block_end):
+            if part_tokens + line_tokens[index] > max_tokens:
+                flush(index)
+            part_tokens += line_tokens[index]
+    flush(len(lines))
+    return parts
+
+
+def chunk_files(
+        files: List[FileRecord],
+        max_tokens: int = MAX_TOKENS_PER_CHUNK,
+        model: str = DEFAULT_TOKENIZER_MODEL
+) -> List[str]:
+    """Pack files into as few chunks of at most max_tokens tokens as possible.
+
+    Each file keeps its "--- File: path ---" header. Files that do not fit into a single chunk are split on
+    top-level definitions into parts headed "--- File: path (lines start-end) ---". Parts are packed first-fit
+    decreasing, and within a chunk they keep the order in which the files were given.
+
+    Args:
+        files (List[FileRecord]): The files, as returned by fetch_files. Files with no content, e.g. new files to be
+            added by the code diff, are included with just their header.
+        max_tokens (int, optional): The maximum number of tokens per chunk. Defaults to MAX_TOKENS_PER_CHUNK.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-4".
+
+    Returns:
+        List[str]: The chunks, ordered by the first file they contain.
+    """
+    separator_tokens = count_tokens(CHUNK_SEPARATOR, model)
+    pieces: List[Tuple[str, int]] = []
+
+    for file in files:
+        path, content = file.path, file.content
+        header = FILE_HEADER.format(path=path)
+        header_tokens = count_tokens(header, model)
+        content_tokens = count_tokens_cached(content, model, file.sha)
+        if header_tokens + content_tokens <= max_tokens:
+            pieces.append((header + content, header_tokens + content_tokens))
             continue
-        
-        # If adding this file content exceeds the max chunk size, add current chunk to all_chunks
-        if len(current_chunk) + len(file_content) > MAX_CHARACTERS_PER_CHUNK:
-            all_chunks.append(current_chunk)
-            current_chunk = ""
-        
-        # If the file itself is larger than the max chunk size, it needs to be its own chunk
-        if len(file_content) > MAX_CHARACTERS_PER_CHUNK:
-            # If there's a current chunk, save it first
-            if current_chunk:
-                all_chunks.append(current_chunk)
-                current_chunk = ""
-            
-            all_chunks.append(file_content)
+
+        line_count = content.count("\n") + 1
+        part_header_tokens = count_tokens(FILE_PART_HEADER.format(path=path, start=line_count, end=line_count), model)
+        for start, end, part in split_file_content(content, max(max_tokens - part_header_tokens, 1), model):
+            part_tokens = part_header_tokens + count_tokens(part, model)
+            pieces.append((FILE_PART_HEADER.format(path=path, start=start, end=end) + part, part_tokens))
+
+    bins: List[List[int]] = []  # piece indices per chunk
+    remaining: List[int] = []  # token budget left per chunk
+    for index in sorted(range(len(pieces)), key=lambda i: pieces[i][1], reverse=True):
+        tokens = pieces[index][1]
+        for bin_index, bin_remaining in enumerate(remaining):
+            if tokens + separator_tokens <= bin_remaining:
+                bins[bin_index].append(index)
+                remaining[bin_index] -= tokens + separator_tokens
+                break
         else:
-            # Otherwise, append this file's content to the current chunk
-            if current_chunk:
-                current_chunk += "\n---\n"
-            current_chunk += file_content
-    
-    # Add any remaining content as a chunk
-    if current_chunk:
-        all_chunks.append(current_chunk)
-        
-    return all_chunks
\ No newline at end of file
+            bins.append([index])
+            remaining.append(max_tokens - tokens)
+
+    for piece_indices in bins:
+        piece_indices.sort()
+    bins.sort(key=lambda piece_indices: piece_indices[0])
+    return [CHUNK_SEPARATOR.join(pieces[index][0] for index in piece_indices) for piece_indices in bins]
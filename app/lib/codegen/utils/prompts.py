@@ -1,6 +1,14 @@
-from typing import List, Dict
+import logging
+from typing import List, Optional
 
-from app.lib.codegen.utils import SUCCESS_SCORE_THRESHOLD
+from app.lib.codegen.diff import parse_diff
+from app.lib.codegen.utils import PLANNER_PROMPT_MAX_TOKENS, SUCCESS_SCORE_THRESHOLD
+from app.lib.codegen.utils.tokens import DEFAULT_TOKENIZER_MODEL, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Context lines kept around each change when the previous code diff is too large to include in full
+REVIEW_DIFF_CONTEXT_LINES = 1
 
 EXAMPLE_CODE_DIFF = '''
 diff --git a/src/main.py b/src/main.py
@@ -19,71 +27,167 @@ index 58d38b6..23b0827 100644
      os.remove('temp.sh')
 '''
 
+# Identical in every planner call, and therefore first, so that provider-side prompt caching applies
+REVIEW_AND_PLAN_INSTRUCTIONS = f"""Generate a review and plan for implementing a code diff based on the provided user prompt.
+
+    Call the get_codegen_review_and_plan function with the following parameters:
+    - review: None if the previously generated code diff is an empty string, or a CodeGenReview object with the following fields:
+        - score: an integer between 0 and 10 (inclusive) representing the quality of the code diff. A score of 7 indicates the code diff is an acceptable implementation of the provided prompt.
+        - comment: a string with more detailed feedback describing the quality of the code diff and why the score was given.
+    - plan: None if the generated review score is at least {SUCCESS_SCORE_THRESHOLD}, or a CodeGenPlan object with the following fields:
+        - steps: a list of strings describing the steps needed to implement the code diff to best satisfy the provided prompt. Return an empty list if no steps are needed or if unable to determine the steps needed.
+        - file_paths: a list of strings representing file paths from the Repository File Map that need to be modified to implement a code diff satisfying the provided prompt. The file paths should be relative to the root of the repository, and include any files if unsure if they should be included so they can be further examined. If the plan requires new files to be created, include the paths and filenames of the new files to be created. Return an empty list if no files need to be modified or if unable to determine the files needed.
+
+    If the previously generated code diff is an empty string or the previously generated steps are an empty array, the "review" value should be None.
+
+    If the generated review score is at least {SUCCESS_SCORE_THRESHOLD}, the "plan" value should be None.
+
+    The Repository File Map may list directories with only their number of files, and the previously generated code diff may leave out unchanged lines or summarize the changes to some files, to keep this prompt short.
+"""  # noqa: E501
+
+
+def compress_code_diff(code_diff: str, max_tokens: int, model: str = DEFAULT_TOKENIZER_MODEL) -> str:
+    """Fit a code diff into a token budget, keeping as much of it as possible.
+
+    The diff is returned as is if it fits. Otherwise unchanged context lines further than REVIEW_DIFF_CONTEXT_LINES
+    from a change are left out, and if it still does not fit, the diffs of the largest files are summarized in one
+    line each until it does.
+
+    Args:
+        code_diff (str): The unified diff.
+        max_tokens (int): The maximum number of tokens.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-4".
+
+    Returns:
+        str: The diff, possibly compressed. Text that is not a unified diff is returned as is.
+    """
+    if count_tokens(code_diff, model) <= max_tokens:
+        return code_diff
+    file_diffs = parse_diff(code_diff)
+    if not file_diffs:
+        return code_diff
+
+    rendered = [file_diff.render(REVIEW_DIFF_CONTEXT_LINES) for file_diff in file_diffs]
+    tokens = [count_tokens(text + "\n", model) for text in rendered]
+    for index in sorted(range(len(rendered)), key=lambda i: tokens[i], reverse=True):
+        if sum(tokens) <= max_tokens:
+            break
+        rendered[index] = f"# Summary: {file_diffs[index].summarize()}"
+        tokens[index] = count_tokens(rendered[index] + "\n", model)
+    return "\n".join(rendered)
+
 
 def generate_review_and_plan_prompt(
         prompt: str,
-        repo_file_map: Dict,
+        repo_file_map: str,
         code_diff: str,
-        steps: List[str]
+        steps: List[str],
+        candidate_files: Optional[List[str]] = None,
+        max_tokens: int = PLANNER_PROMPT_MAX_TOKENS,
+        model: str = DEFAULT_TOKENIZER_MODEL,
+        pruned_file_map: Optional[str] = None
 ) -> str:
-    """Generate a review and plan prompt based on various input parameters.
+    """Generate a review and plan prompt based on various input parameters, within a token budget.
+
+    The prompt starts with the parts that are the same in every planning attempt of a run (the instructions, the
+    file map, the candidate files and the user prompt), followed by the previous code diff and steps. If the file
+    map makes the first part take more than half of the budget, it is replaced by the pruned file map, which only
+    lists the directories of the candidate files in full and only depends on the run, so the first part stays the
+    same across attempts. The previous code diff
+    is then compressed to fit the rest of the budget, see compress_code_diff.
 
     Args:
         prompt (str): The user prompt.
-        repo_file_map (Dict): The repository file map.
+        repo_file_map (str): The rendered repository file map.
         code_diff (str): The previously generated code difference.
         steps (List[str]): The previously generated steps.
+        candidate_files (Optional[List[str]], optional): The files most relevant to the prompt, best first.
+            Defaults to None.
+        max_tokens (int, optional): The token budget of the prompt, or 0 for no limit. Defaults to
+            PLANNER_PROMPT_MAX_TOKENS.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-4".
+        pruned_file_map (Optional[str], optional): The file map rendered with only the directories of the candidate
+            files listed in full, see FileIndex.render. Defaults to None, which keeps the full file map.
 
     Returns:
         str: The generated review and plan prompt.
     """
-    return f"""Generate a review and plan for implementing a code diff based on the provided user prompt.
-
-    Call the get_codegen_review_and_plan function with the following parameters:
-    - review: None if the previously generated code diff is an empty string, or a CodeGenReview object with the following fields:
-        - score: an integer between 0 and 10 (inclusive) representing the quality of the code diff. A score of 7 indicates the code diff is an acceptable implementation of the provided prompt. 
-        - comment: a string with more detailed feedback describing the quality of the code diff and why the score was given. 
-    - plan: None if the generated review score is at least {SUCCESS_SCORE_THRESHOLD}, or a CodeGenPlan object with the following fields:
-        - steps: a list of strings describing the steps needed to implement the code diff to best satisfy the provided prompt. Return an empty list if no steps are needed or if unable to determine the steps needed.
-        - file_paths: a list of strings representing file paths from the Repository File Map that need to be modified to implement a code diff satisfying the provided prompt. The file paths should be relative to the root of the repository, and include any files if unsure if they should be included so they can be further examined. If the plan requires new files to be created, include the paths and filenames of the new files to be created. Return an empty list if no files need to be modified or if unable to determine the files needed.
+    candidate_files_section = ""
+    if candidate_files:
+        candidate_files_list = "\n".join(candidate_files)
+        candidate_files_section = f"""
+    Candidate Files (the files from the Repository File Map that best match the user prompt, most relevant first):
+    ```
+    {candidate_files_list}
+    ```
+"""
 
+    def static_part(file_map: str) -> str:
+        return f"""{REVIEW_AND_PLAN_INSTRUCTIONS}
+    Repository File Map:
+    ```
+    {file_map}
+    ```
+{candidate_files_section}
     User Prompt:
     ```
     {prompt}
     ```
+"""
 
+    def variable_part(previous_code_diff: str) -> str:
+        return f"""
     Previously Generated Code Diff:
     ```
-    {code_diff}
+    {previous_code_diff}
     ```
 
     Previously Generated Steps:
     ```
     {steps}
     ```
+    """
 
-    Repository File Map:
-    ```
-    {repo_file_map}
-    ```
+    prefix = static_part(repo_file_map)
+    if max_tokens <= 0:
+        return prefix + variable_part(code_diff)
 
-    If the code diff above is an empty string or steps is an empty array, the "review" value should be None.
+    prefix_tokens = count_tokens(prefix, model)
+    if prefix_tokens > max_tokens // 2 and pruned_file_map is not None:
+        prefix = static_part(pruned_file_map)
+        prefix_tokens = count_tokens(prefix, model)
+    if code_diff:
+        diff_budget = max_tokens - prefix_tokens - count_tokens(variable_part(""), model)
+        code_diff = compress_code_diff(code_diff, max(diff_budget, 0), model)
+    review_and_plan_prompt = prefix + variable_part(code_diff)
 
-    If the generated review score is at least {SUCCESS_SCORE_THRESHOLD}, the "plan" value should be None.
+    prompt_tokens = count_tokens(review_and_plan_prompt, model)
+    if prompt_tokens > max_tokens:
+        logger.warning("The planner prompt has %d tokens, over its budget of %d", prompt_tokens, max_tokens)
+    return review_and_plan_prompt
 
-    """  # noqa: E501
 
-
-def generate_code_diff_prompt(content_chunk: str, steps: List[str]) -> str:
+def generate_code_diff_prompt(content_chunk: str, steps: List[str], related_definitions: Optional[str] = None) -> str:
     """Generate a code diff prompt based on a code chunk and steps.
 
     Args:
         content_chunk (str): The content chunk.
         steps (List[str]): The list of steps.
+        related_definitions (Optional[str], optional): The signatures of definitions in other files that the code
+            chunk imports or calls. Defaults to None.
 
     Returns:
         str: The generated code diff prompt.
     """
+    related_definitions_section = ""
+    if related_definitions:
+        related_definitions_section = f"""
+Related Definitions (signatures from other files the code chunk depends on, for reference only; do not include them in the code diff):
+```
+{related_definitions}
+```
+"""  # noqa: E501
+
     return f"""Generate a code diff for the provided code chunk based on the provided steps. Return an empty string if no code diff is needed.
 
 The code diff should use the same format as this example code diff:
@@ -95,7 +199,7 @@ Code Chunk:
 ```
 {content_chunk}
 ```
-
+{related_definitions_section}
 Steps:
 ```
 {steps}
@@ -0,0 +1,52 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+DEFAULT_TOKENIZER_MODEL = "gpt-4"
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+# Word pieces of up to four characters, single symbols and runs of whitespace, roughly what a BPE tokenizer emits
+# for code. Counting matches never undercounts a concatenation, so the counts of split parts add up safely.
+_APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]|\s+")
+
+_token_count_cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+
+def count_tokens(text: str, model: str = DEFAULT_TOKENIZER_MODEL) -> int:
+    """Estimate the number of tokens in a text for a model from its word pieces, symbols and whitespace.
+
+    Args:
+        text (str): The text to count.
+        model (str, optional): The model the text is for. The estimate is currently the same for every model.
+            Defaults to "gpt-4".
+
+    Returns:
+        int: The number of tokens.
+    """
+    if not text:
+        return 0
+    return len(_APPROXIMATE_TOKEN_PATTERN.findall(text))
+
+
+def count_tokens_cached(text: str, model: str = DEFAULT_TOKENIZER_MODEL, content_hash: Optional[str] = None) -> int:
+    """Count the number of tokens in a text, caching the count by the hash of the text.
+
+    Args:
+        text (str): The text to count.
+        model (str, optional): The model the text is for. Defaults to "gpt-4".
+        content_hash (str, optional): A precomputed hash of the text. Defaults to None, which hashes the text.
+
+    Returns:
+        int: The number of tokens.
+    """
+    key = (model, content_hash or hashlib.sha1(text.encode()).hexdigest())
+    count = _token_count_cache.get(key)
+    if count is None:
+        count = count_tokens(text, model)
+        _token_count_cache[key] = count
+        if len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _token_count_cache.popitem(last=False)
+    else:
+        _token_count_cache.move_to_end(key)
+    return count
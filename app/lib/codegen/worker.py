@@ -1,9 +1,8 @@
 import json
-from typing import Dict, List
-
-import openai
+from typing import Dict, List, Optional
 
 from app.common.exceptions import ApiError, InputValidationError
+from app.lib.codegen.llm import create_function_call
 from app.lib.codegen.models import CodeGenPlan, CodeGenReview, CodeGenWorkerAIResponse
 from app.lib.codegen.utils.prompts import generate_code_diff_prompt
 
@@ -16,12 +15,22 @@ class CodeGenWorker:
         content_chunk (str): The piece of content to process.
         steps (List[str]): The steps to apply to the content.
         openai_model (str): The OpenAI model to use for code generation.
+        related_definitions (Optional[str]): The signatures of definitions in other files that the content depends on.
+        timeout (Optional[float]): The number of seconds after which the LLM call is abandoned, counted from when the
+            LLM scheduler dispatches it.
 
     Methods:
         generate_code_diff: Generates a code diff based on steps applied to a content chunk.
     """
 
-    def __init__(self, content_chunk: str, steps: List[str], openai_model: str):
+    def __init__(
+            self,
+            content_chunk: str,
+            steps: List[str],
+            openai_model: str,
+            related_definitions: Optional[str] = None,
+            timeout: Optional[float] = None
+    ):
         """
         Initialize a CodeGenWorker instance.
 
@@ -29,13 +38,19 @@ class CodeGenWorker:
             content_chunk (str): The piece of content to process.
             steps (List[str]): The steps to apply to the content.
             openai_model (str): The OpenAI model to use for code generation.
+            related_definitions (Optional[str], optional): The signatures of definitions in other files that the
+                content depends on. Defaults to None.
+            timeout (Optional[float], optional): The number of seconds after which the dispatched LLM call is
+                abandoned. Defaults to None, for no timeout.
         """
         self.content_chunk = content_chunk
         self.steps = steps
         self.openai_model = openai_model
+        self.related_definitions = related_definitions
+        self.timeout = timeout
 
 
-    def generate_code_diff(self) -> str:
+    async def generate_code_diff(self) -> str:
         """
         Generate a code diff based on the provided steps for the provided content chunk (if applicable).
 
@@ -44,34 +59,34 @@ class CodeGenWorker:
         
         Raises:
             ApiError: Raised when an API call or response processing fails.
+            asyncio.TimeoutError: Raised when the LLM call took longer than the timeout.
         """
-        response = openai.ChatCompletion.create(
-            model=self.openai_model,
-            messages=[
+        arguments = await create_function_call(
+            self.openai_model,
+            [
                 {
                     "role": "user",
                     "content": generate_code_diff_prompt(
                         self.content_chunk,
-                        self.steps
+                        self.steps,
+                        self.related_definitions
                     )
                 }
             ],
-            functions=[
-                {
-                    "name": "get_codegen_code_diff",
-                    "description": (
-                        "Generate a code diff for the provided code chunk "
-                        "based on the provided steps. Return an empty string if no code diff is needed."
-                    ),
-                    "parameters": CodeGenWorkerAIResponse.schema()
-                }
-            ],
-            function_call={"name": "get_codegen_code_diff"}
+            {
+                "name": "get_codegen_code_diff",
+                "description": (
+                    "Generate a code diff for the provided code chunk "
+                    "based on the provided steps. Return an empty string if no code diff is needed."
+                ),
+                "parameters": CodeGenWorkerAIResponse.model_json_schema()
+            },
+            timeout=self.timeout
         )
 
-        if len(response.choices):
+        if arguments is not None:
             try:
-                output = json.loads(response.choices[0]["message"]["function_call"]["arguments"])
+                output = json.loads(arguments)
             except json.decoder.JSONDecodeError:
                 raise ApiError("Failed to decode codegen worker JSON response from API")
             return output["code_diff"]
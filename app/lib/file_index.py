@@ -0,0 +1,276 @@
+import asyncio
+import fnmatch
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional
+
+from decouple import Csv, config
+
+from app.common.exceptions import GitCommandError
+from app.lib.git import list_tracked_files
+
+logger = logging.getLogger(__name__)
+
+FILE_INDEX_IGNORE = config(
+    "FILE_INDEX_IGNORE",
+    ".git,node_modules,bower_components,vendor,third_party,__pycache__,.venv,venv,.tox,.mypy_cache,.pytest_cache,"
+    "dist,build,target,coverage,.next",
+    cast=Csv()
+)
+FILE_INDEX_MAX_FILE_BYTES = config("FILE_INDEX_MAX_FILE_BYTES", 1024 ** 2, cast=int)
+
+GENERATED_FILE_PATTERNS = [
+    "*.min.js", "*.min.css", "*.map", "*.lock", "package-lock.json", "pnpm-lock.yaml", "go.sum",
+    "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*",
+]
+GENERATED_FILE_MARKERS = [b"@generated", b"DO NOT EDIT"]
+
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z",
+    ".tar", ".jar", ".war", ".class", ".so", ".dylib", ".dll", ".exe", ".o", ".a", ".pyc", ".whl", ".woff", ".woff2",
+    ".ttf", ".otf", ".eot", ".mp3", ".mp4", ".mov", ".avi", ".wav", ".sqlite", ".db", ".bin",
+}
+
+LANGUAGES_BY_EXTENSION = {
+    ".py": "Python", ".pyi": "Python", ".js": "JavaScript", ".jsx": "JavaScript", ".mjs": "JavaScript",
+    ".ts": "TypeScript", ".tsx": "TypeScript", ".go": "Go", ".rs": "Rust", ".java": "Java", ".kt": "Kotlin",
+    ".rb": "Ruby", ".php": "PHP", ".c": "C", ".h": "C", ".cc": "C++", ".cpp": "C++", ".hpp": "C++", ".cs": "C#",
+    ".swift": "Swift", ".scala": "Scala", ".sh": "Shell", ".sql": "SQL", ".html": "HTML", ".css": "CSS",
+    ".scss": "SCSS", ".vue": "Vue", ".svelte": "Svelte", ".md": "Markdown", ".rst": "reStructuredText",
+    ".json": "JSON", ".yml": "YAML", ".yaml": "YAML", ".toml": "TOML", ".ini": "INI", ".cfg": "INI", ".xml": "XML",
+}
+LANGUAGES_BY_FILENAME = {"Dockerfile": "Dockerfile", "Makefile": "Makefile"}
+
+SNIFF_BYTES = 8192
+
+
+@dataclass
+class FileIndexEntry:
+    """A file in the repository file index.
+
+    Attributes:
+        path (str): The repository-relative path of the file.
+        size (Optional[int]): The size of the file in bytes, or None if its content has not been fetched.
+        language (Optional[str]): The language of the file, if recognised.
+    """
+    path: str
+    size: Optional[int]
+    language: Optional[str]
+
+
+def detect_language(path: str) -> Optional[str]:
+    """Detect the language of a file from its name.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        Optional[str]: The name of the language, or None if it is not recognised.
+    """
+    file_name = os.path.basename(path)
+    return LANGUAGES_BY_FILENAME.get(file_name) or LANGUAGES_BY_EXTENSION.get(os.path.splitext(file_name)[1].lower())
+
+
+def is_ignored_path(path: str, ignore_patterns: List[str]) -> bool:
+    """Check whether a repository-relative path matches an ignore pattern.
+
+    A pattern matches if it matches any directory or file name along the path, or the whole path.
+
+    Parameters:
+        path (str): The repository-relative path.
+        ignore_patterns (List[str]): The glob patterns to ignore.
+
+    Returns:
+        bool: Whether the path is ignored.
+    """
+    for pattern in ignore_patterns:
+        pattern = pattern.strip("/")
+        if not pattern:
+            continue
+        if fnmatch.fnmatch(path, pattern) or any(fnmatch.fnmatch(part, pattern) for part in path.split("/")):
+            return True
+    return False
+
+
+def _read_gitignore(root: str) -> List[str]:
+    try:
+        with open(os.path.join(root, ".gitignore"), encoding="utf-8", errors="ignore") as file:
+            lines = [line.strip() for line in file]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith(("#", "!"))]
+
+
+def walk_files(root: str, ignore_patterns: List[str] = FILE_INDEX_IGNORE) -> List[str]:
+    """List the files in a directory that is not a git checkout, honouring its top-level .gitignore.
+
+    Parameters:
+        root (str): The root directory.
+        ignore_patterns (List[str], optional): The glob patterns to ignore. Defaults to FILE_INDEX_IGNORE.
+
+    Returns:
+        List[str]: The repository-relative file paths.
+    """
+    ignore_patterns = list(ignore_patterns) + _read_gitignore(root)
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        relative_dir = os.path.relpath(dir_path, root)
+        relative_dir = "" if relative_dir == "." else relative_dir.replace(os.sep, "/") + "/"
+        dir_names[:] = sorted(name for name in dir_names if not is_ignored_path(relative_dir + name, ignore_patterns))
+        paths.extend(relative_dir + name for name in sorted(file_names))
+    return paths
+
+
+def _is_generated_name(path: str) -> bool:
+    file_name = os.path.basename(path)
+    return any(fnmatch.fnmatch(file_name, pattern) for pattern in GENERATED_FILE_PATTERNS)
+
+
+def _index_file(root: str, path: str, read_files: bool) -> Optional[FileIndexEntry]:
+    if os.path.splitext(path)[1].lower() in BINARY_EXTENSIONS or _is_generated_name(path):
+        return None
+    if not read_files:
+        return FileIndexEntry(path=path, size=None, language=detect_language(path))
+
+    full_path = os.path.join(root, path)
+    try:
+        if not os.path.isfile(full_path):
+            return None
+        size = os.path.getsize(full_path)
+        if size > FILE_INDEX_MAX_FILE_BYTES:
+            return None
+        with open(full_path, "rb") as file:
+            head = file.read(SNIFF_BYTES)
+    except OSError as e:
+        logger.debug("Skipping unreadable file %s: %s", full_path, e)
+        return None
+    if b"\0" in head or any(marker in head[:1024] for marker in GENERATED_FILE_MARKERS):
+        return None
+    return FileIndexEntry(path=path, size=size, language=detect_language(path))
+
+
+def _count_files(node: Dict) -> int:
+    return sum(1 if isinstance(child, FileIndexEntry) else _count_files(child) for child in node.values())
+
+
+def _format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size}B"
+    if size < 1024 ** 2:
+        return f"{size / 1024:.1f}K"
+    return f"{size / 1024 ** 2:.1f}M"
+
+
+class FileIndex:
+    """An index of the source files in a repository checkout, for the planner to pick files from.
+
+    Attributes:
+        entries (List[FileIndexEntry]): The indexed files, sorted by path.
+    """
+
+    def __init__(self, entries: List[FileIndexEntry]):
+        self.entries = sorted(entries, key=lambda entry: entry.path)
+
+    @property
+    def paths(self) -> List[str]:
+        return [entry.path for entry in self.entries]
+
+    def _build_tree(self) -> Dict:
+        tree: Dict = {}
+        for entry in self.entries:
+            *dir_names, file_name = entry.path.split("/")
+            node = tree
+            for dir_name in dir_names:
+                node = node.setdefault(dir_name + "/", {})
+            node[file_name] = entry
+        return tree
+
+    def _render_node(
+            self,
+            node: Dict,
+            depth: int,
+            lines: List[str],
+            dir_path: str = "",
+            keep_paths: Optional[List[str]] = None
+    ) -> None:
+        for name, child in node.items():
+            indent = "  " * depth
+            if isinstance(child, FileIndexEntry):
+                lines.append(f"{indent}{name} {_format_size(child.size)}" if child.size is not None else indent + name)
+                continue
+            # Collapse chains of directories with a single subdirectory, e.g. "src/main/java/"
+            while len(child) == 1 and not isinstance(next(iter(child.values())), FileIndexEntry):
+                sub_name, child = next(iter(child.items()))
+                name += sub_name
+            if keep_paths is not None and not any(path.startswith(dir_path + name) for path in keep_paths):
+                file_count = _count_files(child)
+                lines.append(f"{indent}{name} ({file_count} file{'' if file_count == 1 else 's'})")
+                continue
+            lines.append(indent + name)
+            self._render_node(child, depth + 1, lines, dir_path + name, keep_paths)
+
+    def render(self, keep_paths: Optional[List[str]] = None) -> str:
+        """Render the index as an indented tree of repository-relative paths, with file sizes where known, preceded
+        by a summary of the languages in the repository.
+
+        Parameters:
+            keep_paths (List[str], optional): If given, only the directories that contain one of these paths are
+                listed in full, and all other directories are collapsed into one line with the number of files in
+                them. Top-level files are always listed. Defaults to None, which lists every file.
+
+        Returns:
+            str: The rendered index.
+        """
+        languages = Counter(entry.language for entry in self.entries if entry.language)
+        summary = ", ".join(f"{language} {count}" for language, count in languages.most_common())
+        lines = [f"{len(self.entries)} files" + (f" ({summary})" if summary else "")]
+        self._render_node(self._build_tree(), 0, lines, keep_paths=keep_paths)
+        return "\n".join(lines)
+
+    @cached_property
+    def rendered(self) -> str:
+        """The index rendered in full, see render."""
+        return self.render()
+
+    def __str__(self) -> str:
+        return self.rendered
+
+
+async def build_file_index(
+        repo_dir: str,
+        read_files: bool = True,
+        ignore_patterns: List[str] = FILE_INDEX_IGNORE
+) -> FileIndex:
+    """Build the file index of a repository checkout.
+
+    Files are listed from the git tree, so anything covered by .gitignore is left out, falling back to walking
+    the directory when it is not a git checkout. Ignored directories, binaries and generated files are skipped.
+
+    Parameters:
+        repo_dir (str): The path of the repository checkout.
+        read_files (bool, optional): Whether file contents are present and may be read to record sizes and detect
+            binary and generated files. Pass False for blobless clones. Defaults to True.
+        ignore_patterns (List[str], optional): The glob patterns to ignore. Defaults to FILE_INDEX_IGNORE.
+
+    Returns:
+        FileIndex: The file index.
+    """
+    try:
+        paths = await list_tracked_files(repo_dir)
+    except GitCommandError:
+        paths = await asyncio.to_thread(walk_files, repo_dir, ignore_patterns)
+
+    def index_files() -> List[FileIndexEntry]:
+        entries = []
+        for path in paths:
+            if is_ignored_path(path, ignore_patterns):
+                continue
+            entry = _index_file(repo_dir, path, read_files)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    return FileIndex(await asyncio.to_thread(index_files))
@@ -1,10 +1,21 @@
 import hashlib
 import logging
+import mmap
 import os
 import shutil
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
 
 BASE_CODE_PATH = '/tmp/repo'
+FETCH_MAX_FILE_BYTES = config("FETCH_MAX_FILE_BYTES", 1024 ** 2, cast=int)
+FETCH_MAX_TOTAL_BYTES = config("FETCH_MAX_TOTAL_BYTES", 8 * 1024 ** 2, cast=int)
+FETCH_WORKERS = config("FETCH_WORKERS", 8, cast=int)
+BINARY_SNIFF_BYTES = 8192
 
 
 def generate_hash_for_repo_and_prompt(repo_url: str, prompt: str) -> str:
@@ -23,47 +34,90 @@ def generate_hash_for_repo_and_prompt(repo_url: str, prompt: str) -> str:
     return sha256.hexdigest()
 
 
-def fetch_files(root: str, paths: List[str]) -> str:
+@dataclass
+class FileRecord:
+    """A file loaded from a repository checkout.
+
+    Attributes:
+        path (str): The repository-relative path of the file.
+        content (str): The decoded content of the file, or an empty string if the file does not exist yet.
+        size (int): The size of the file in bytes.
+        sha (Optional[str]): The SHA-256 hex digest of the file's bytes, or None if the file does not exist yet.
+    """
+    path: str
+    content: str
+    size: int
+    sha: Optional[str]
+
+
+def _read_file(root: str, path: str, size: int) -> Optional[FileRecord]:
+    full_path = os.path.join(root, path)
+    if size == 0:  # empty files cannot be memory-mapped
+        return FileRecord(path=path, content="", size=0, sha=hashlib.sha256(b"").hexdigest())
+    with open(full_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if b"\0" in mapped[:BINARY_SNIFF_BYTES]:
+            logger.info("Skipping binary file: %s", full_path)
+            return None
+        # Decoded and hashed straight from the mapping, without reading the file into an intermediate buffer
+        return FileRecord(
+            path=path, content=str(mapped, 'utf-8', 'ignore'), size=len(mapped), sha=hashlib.sha256(mapped).hexdigest()
+        )
+
+
+def fetch_files(
+        root: str,
+        paths: List[str],
+        max_file_bytes: int = FETCH_MAX_FILE_BYTES,
+        max_total_bytes: int = FETCH_MAX_TOTAL_BYTES,
+        workers: int = FETCH_WORKERS
+) -> List[FileRecord]:
     """Fetch the contents of specified files.
 
+    Files are read in parallel through memory maps. Binary files and files over max_file_bytes are skipped, and
+    once max_total_bytes have been admitted the remaining files are skipped, in the order they were requested.
+    Files that do not exist are returned with empty content, since they are likely new files to be added.
+
     Parameters:
         root (str): The root directory where the files are located.
         paths (List[str]): The paths of the files to fetch.
+        max_file_bytes (int, optional): The maximum size of a single file. Defaults to FETCH_MAX_FILE_BYTES.
+        max_total_bytes (int, optional): The maximum size of all files together. Defaults to FETCH_MAX_TOTAL_BYTES.
+        workers (int, optional): The maximum number of files read at once. Defaults to FETCH_WORKERS.
 
     Returns:
-        str: The concatenated content of all files.
+        List[FileRecord]: The fetched files, in the order they were requested.
     """
-    contents_list = []
-    for item_path in paths:
+    admitted: List[Tuple[str, Optional[int]]] = []  # (path, size), with no size for missing files
+    total_bytes = 0
+    for item_path in dict.fromkeys(paths):
         full_item_path = os.path.join(root, item_path)
-        contents_list.append(f"\n--- File: {item_path} ---\n")
         try:
-            with open(full_item_path, 'r', encoding='utf-8', errors='ignore') as file:
-                contents_list.append(file.read())
-        except FileNotFoundError:
-            logging.info(f"File not found: {full_item_path}. This is likely a new file to be added in the code diff.")
-    return "".join(contents_list)
-
-
-def fetch_file_map(root: str, path: str = "") -> Dict:
-    """Fetch a file map of the specified directory.
-
-    Parameters:
-        root (str): The root directory to start from.
-        path (str, optional): The relative path to start from. Defaults to an empty string.
-
-    Returns:
-        Dict: A map of filenames to their full paths.
-    """
-    file_map = {}
-    for item in os.listdir(os.path.join(root, path)):
-        item_path = os.path.join(path, item) if path else item
-        full_item_path = os.path.join(root, item_path)
-        if os.path.isdir(full_item_path):
-            file_map[item] = fetch_file_map(root, item_path)
-        else:
-            file_map[item] = full_item_path  # type: ignore
-    return file_map
+            size = os.path.getsize(full_item_path)
+        except (FileNotFoundError, NotADirectoryError):
+            logger.info("File not found: %s. This is likely a new file to be added in the code diff.", full_item_path)
+            admitted.append((item_path, None))
+            continue
+        if size > max_file_bytes:
+            logger.warning("Skipping file over %d bytes: %s (%d bytes)", max_file_bytes, full_item_path, size)
+            continue
+        if total_bytes + size > max_total_bytes:
+            logger.warning("Skipping file over the total budget of %d bytes: %s", max_total_bytes, full_item_path)
+            continue
+        total_bytes += size
+        admitted.append((item_path, size))
+
+    def load(item_path: str, size: Optional[int]) -> Optional[FileRecord]:
+        if size is None:
+            return FileRecord(path=item_path, content="", size=0, sha=None)
+        try:
+            return _read_file(root, item_path, size)
+        except (ValueError, OSError) as e:
+            logger.warning("Skipping unreadable file %s: %s", os.path.join(root, item_path), e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(admitted)))) as executor:
+        records = list(executor.map(lambda item: load(*item), admitted))
+    return [record for record in records if record is not None]
 
 
 def prepare_temp_dir(hash: str) -> str:
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import re
+from typing import Dict, List, Optional
+
+from app.common.exceptions import GitCommandError
+
+logger = logging.getLogger(__name__)
+
+
+async def run_git(args: List[str], cwd: Optional[str] = None) -> str:
+    """Run a git command in a subprocess without blocking the event loop and return its standard output.
+
+    Parameters:
+        args (List[str]): The arguments to pass to git, excluding the `git` executable itself.
+        cwd (str, optional): The working directory to run the command in. Defaults to None.
+
+    Returns:
+        str: The standard output of the command.
+
+    Raises:
+        GitCommandError: If the git command exits with a non-zero status.
+    """
+    logger.debug("Running git command: %s", args)
+    process = await asyncio.create_subprocess_exec(
+        "git", *args, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise GitCommandError(
+            f"git {' '.join(args)} failed with exit code {process.returncode}: {stderr.decode().strip()}"
+        )
+    return stdout.decode()
+
+
+async def list_tracked_files(repo_dir: str, ref: str = "HEAD") -> List[str]:
+    """List the paths of all files in a commit's tree.
+
+    Only tree objects are read, so this works on blobless clones without downloading any file contents.
+
+    Parameters:
+        repo_dir (str): The path of the repository.
+        ref (str, optional): The commit to list. Defaults to "HEAD".
+
+    Returns:
+        List[str]: The repository-relative file paths.
+    """
+    output = await run_git(["ls-tree", "-r", "--name-only", "-z", ref], cwd=repo_dir)
+    return [path for path in output.split("\0") if path]
+
+
+def to_sparse_checkout_pattern(path: str) -> str:
+    """Convert a repository-relative path to a non-cone sparse-checkout pattern matching only that path.
+
+    Parameters:
+        path (str): The repository-relative path.
+
+    Returns:
+        str: The anchored pattern with gitignore special characters escaped.
+    """
+    escaped = re.sub(r"([\\*?\[\]!#])", r"\\\1", path.strip("/"))
+    return f"/{escaped}"
+
+
+async def sparse_checkout_add(repo_dir: str, paths: List[str]) -> None:
+    """Add paths to the sparse checkout of a repository, fetching their blobs on demand.
+
+    Parameters:
+        repo_dir (str): The path of the repository.
+        paths (List[str]): The repository-relative paths to check out.
+    """
+    patterns = [to_sparse_checkout_pattern(path) for path in paths if path.strip("/")]
+    if patterns:
+        await run_git(["sparse-checkout", "add", *patterns], cwd=repo_dir)
+
+
+async def resolve_remote_head(repo_url: str) -> str:
+    """Resolve the commit a remote repository's HEAD points to, without cloning it.
+
+    Parameters:
+        repo_url (str): The URL of the repository.
+
+    Returns:
+        str: The commit SHA of the remote HEAD.
+
+    Raises:
+        GitCommandError: If the remote could not be queried or has no HEAD.
+    """
+    output = await run_git(["ls-remote", repo_url, "HEAD"])
+    if not output.strip():
+        raise GitCommandError(f"Repository {repo_url} has no HEAD")
+    return output.split()[0]
+
+
+async def has_commit(repo_dir: str, commit: str) -> bool:
+    """Check whether a repository contains a commit.
+
+    Parameters:
+        repo_dir (str): The path of the repository, or of its git directory for bare repositories.
+        commit (str): The commit SHA to look for.
+
+    Returns:
+        bool: True if the commit exists in the repository.
+    """
+    try:
+        await run_git(["cat-file", "-e", f"{commit}^{{commit}}"], cwd=repo_dir)
+    except GitCommandError:
+        return False
+    return True
+
+
+async def list_tree_blobs(repo_dir: str, ref: str = "HEAD") -> Dict[str, str]:
+    """List the blob SHA of every file in a commit's tree.
+
+    Only tree objects are read, so this works on blobless clones without downloading any file contents.
+
+    Parameters:
+        repo_dir (str): The path of the repository.
+        ref (str, optional): The commit to list. Defaults to "HEAD".
+
+    Returns:
+        Dict[str, str]: The blob SHA of each repository-relative file path.
+    """
+    output = await run_git(["ls-tree", "-r", "-z", ref], cwd=repo_dir)
+    blobs = {}
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        _, object_type, sha = info.split()
+        if object_type == "blob":
+            blobs[path] = sha
+    return blobs
+
+
+async def read_blobs(repo_dir: str, shas: List[str]) -> Dict[str, bytes]:
+    """Read the contents of blobs in a single git process.
+
+    Blobs missing from a partial clone are fetched on demand.
+
+    Parameters:
+        repo_dir (str): The path of the repository.
+        shas (List[str]): The blob SHAs to read.
+
+    Returns:
+        Dict[str, bytes]: The contents of each blob that exists.
+
+    Raises:
+        GitCommandError: If the git command exits with a non-zero status.
+    """
+    if not shas:
+        return {}
+    process = await asyncio.create_subprocess_exec(
+        "git", "cat-file", "--batch", cwd=repo_dir,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate("".join(f"{sha}\n" for sha in shas).encode())
+    if process.returncode != 0:
+        raise GitCommandError(f"git cat-file --batch failed with exit code {process.returncode}: {stderr.decode()}")
+
+    blobs = {}
+    offset = 0
+    while offset < len(stdout):
+        header_end = stdout.index(b"\n", offset)
+        header = stdout[offset:header_end].decode().split()
+        offset = header_end + 1
+        if len(header) < 3 or header[1] == "missing":
+            continue
+        size = int(header[2])
+        blobs[header[0]] = stdout[offset:offset + size]
+        offset += size + 1  # the contents are followed by a newline
+    return blobs
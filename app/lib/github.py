@@ -1,5 +1,15 @@
-import os
 import re
+from typing import Optional
+
+from decouple import config
+
+from app.lib.git import has_commit, resolve_remote_head, run_git
+from app.lib.repo_cache import repo_cache
+
+FETCH_MODE_FULL = "full"
+FETCH_MODE_SPARSE = "sparse"
+REPO_FETCH_MODE = config("REPO_FETCH_MODE", FETCH_MODE_FULL)
+ALLOW_LOCAL_REPOS = config("ALLOW_LOCAL_REPOS", False, cast=bool)  # accept file:// URLs, e.g. for benchmarks
 
 
 def is_valid_github_url(repo_url: str) -> bool:
@@ -15,17 +25,74 @@ def is_valid_github_url(repo_url: str) -> bool:
     return re.match(github_url_pattern, repo_url) is not None
 
 
-def fetch_github_repo_contents(repo_url: str, temp_dir: str) -> None:
+def is_allowed_repo_url(repo_url: str) -> bool:
+    """Check if code can be generated for the repository at the given URL.
+
+    GitHub repository URLs are always allowed, and local file:// URLs only if ALLOW_LOCAL_REPOS is set.
+
+    Parameters:
+        repo_url (str): The URL of the repository to check.
+
+    Returns:
+        bool: True if the URL is allowed, False otherwise.
+    """
+    return is_valid_github_url(repo_url) or (ALLOW_LOCAL_REPOS and repo_url.startswith("file://"))
+
+
+async def resolve_github_repo_head(repo_url: str) -> str:
+    """Resolve the commit the default branch of a GitHub repository points to, without cloning it.
+
+    Parameters:
+        repo_url (str): The URL of the GitHub repository.
+
+    Returns:
+        str: The commit SHA of the repository's HEAD.
+
+    Raises:
+        ValueError: If the GitHub repository URL is invalid.
+        GitCommandError: If the repository could not be queried.
+    """
+    if not is_allowed_repo_url(repo_url):
+        raise ValueError("Invalid GitHub repository URL")
+
+    return await resolve_remote_head(repo_url)
+
+
+async def fetch_github_repo_contents(
+        repo_url: str,
+        temp_dir: str,
+        mode: str = REPO_FETCH_MODE,
+        commit: Optional[str] = None
+) -> None:
     """Clone a GitHub repository to a temporary directory.
 
+    In full mode the clone is served from the local mirror cache, so repeated requests for the same repository
+    only fetch new objects instead of cloning the whole repository again.
+
+    In sparse mode only the latest commit's trees are fetched (depth 1, no blobs) and nothing is checked out.
+    Files must be checked out with `sparse_checkout_add`, which downloads their blobs on demand.
+
     Parameters:
         repo_url (str): The URL of the GitHub repository to clone.
         temp_dir (str): The path of the temporary directory where the repository will be cloned.
+        mode (str, optional): Either "full" or "sparse". Defaults to the REPO_FETCH_MODE setting.
+        commit (str, optional): The commit to check out. Defaults to None, which checks out the default branch.
 
     Raises:
-        ValueError: If the GitHub repository URL is invalid.
+        ValueError: If the GitHub repository URL or the fetch mode is invalid.
+        GitCommandError: If the repository could not be cloned.
     """
-    if not is_valid_github_url(repo_url):
+    if not is_allowed_repo_url(repo_url):
         raise ValueError("Invalid GitHub repository URL")
 
-    os.system(f'git clone {repo_url} {temp_dir}')
+    if mode == FETCH_MODE_FULL:
+        await repo_cache.checkout(repo_url, temp_dir, commit)
+    elif mode == FETCH_MODE_SPARSE:
+        blobless_args = ["--depth", "1", "--filter=blob:none", "--quiet"]
+        await run_git(["clone", *blobless_args, "--no-checkout", repo_url, temp_dir])
+        if commit is not None and not await has_commit(temp_dir, commit):
+            await run_git(["fetch", *blobless_args, "origin", commit], cwd=temp_dir)
+        await run_git(["sparse-checkout", "set", "--no-cone", "!/*"], cwd=temp_dir)
+        await run_git(["checkout", "--quiet", *(["--detach", commit] if commit else [])], cwd=temp_dir)
+    else:
+        raise ValueError(f"Invalid repository fetch mode: {mode}")
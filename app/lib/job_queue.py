@@ -0,0 +1,199 @@
+import abc
+import asyncio
+import logging
+import time
+import uuid
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from decouple import config
+from pydantic import BaseModel
+
+from app.common.context import current_job_id
+from app.common.exceptions import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = config("JOB_WORKERS", 4, cast=int)
+JOB_QUEUE_MAX_DEPTH = config("JOB_QUEUE_MAX_DEPTH", 100, cast=int)
+JOB_RESULT_TTL = config("JOB_RESULT_TTL", 3600, cast=float)  # seconds
+JOB_BACKEND = config("JOB_BACKEND", "memory")
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    """Data model for representing a background job.
+
+    Attributes:
+        job_id (str): The unique identifier of the job.
+        status (JobStatus): The current status of the job.
+        payload (dict): The arguments the job was submitted with.
+        result (Optional[dict]): The serialized result of the job once it has succeeded.
+        error (Optional[str]): The error message if the job has failed.
+        created_at (float): The UNIX timestamp at which the job was submitted.
+        finished_at (Optional[float]): The UNIX timestamp at which the job succeeded or failed.
+    """
+
+    job_id: str
+    status: JobStatus
+    payload: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+
+class JobBackend(abc.ABC):
+    """Storage and queueing backend for background jobs."""
+
+    @abc.abstractmethod
+    async def enqueue(self, job: Job) -> None:
+        """Store a new job and add it to the end of the queue."""
+
+    @abc.abstractmethod
+    async def dequeue(self) -> Job:
+        """Wait for and remove the job at the front of the queue."""
+
+    @abc.abstractmethod
+    async def save(self, job: Job) -> None:
+        """Store the current state of a job."""
+
+    @abc.abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Return a job by its identifier, or None if it does not exist."""
+
+    @abc.abstractmethod
+    async def depth(self) -> int:
+        """Return the number of jobs waiting in the queue."""
+
+
+class InMemoryJobBackend(JobBackend):
+    """A job backend that keeps the queue and job states in process memory.
+
+    Finished jobs are discarded once they are older than the result TTL.
+
+    Attributes:
+        result_ttl (float): The number of seconds finished jobs are retained for.
+    """
+
+    def __init__(self, result_ttl: float = JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._jobs: Dict[str, Job] = {}
+
+    async def enqueue(self, job: Job) -> None:
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job.job_id)
+
+    async def dequeue(self) -> Job:
+        return self._jobs[await self._queue.get()]
+
+    async def save(self, job: Job) -> None:
+        self._jobs[job.job_id] = job
+        self._prune()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _prune(self) -> None:
+        expiry = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if (job.finished_at or expiry) < expiry]:
+            del self._jobs[job_id]
+
+
+JOB_BACKENDS: Dict[str, Callable[[], JobBackend]] = {
+    "memory": InMemoryJobBackend,
+}
+
+
+class JobQueue:
+    """A queue of background jobs processed by a bounded pool of worker tasks.
+
+    Attributes:
+        handler (Callable[[dict], Awaitable[BaseModel]]): The coroutine function that runs a job's payload.
+        backend (JobBackend): The backend that stores and queues jobs.
+        workers (int): The number of jobs processed concurrently.
+        max_depth (int): The maximum number of jobs waiting in the queue before submissions are rejected.
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[dict], Awaitable[BaseModel]],
+            backend: Optional[JobBackend] = None,
+            workers: int = JOB_WORKERS,
+            max_depth: int = JOB_QUEUE_MAX_DEPTH
+    ):
+        self.handler = handler
+        self.backend = backend or JOB_BACKENDS[JOB_BACKEND]()
+        self.workers = workers
+        self.max_depth = max_depth
+        self._tasks: List[asyncio.Task] = []
+        self._submit_lock = asyncio.Lock()
+
+    def start(self) -> None:
+        """Start the worker tasks. Must be called from within a running event loop."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks and wait for them to exit."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: Dict[str, Any]) -> Job:
+        """Submit a new job to the queue.
+
+        Args:
+            payload (Dict[str, Any]): The arguments passed to the handler.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            QueueFullError: Raised when the queue already holds the maximum number of waiting jobs.
+        """
+        async with self._submit_lock:
+            depth = await self.backend.depth()
+            if depth >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({depth} jobs waiting)")
+            job = Job(job_id=uuid.uuid4().hex, status=JobStatus.QUEUED, payload=payload, created_at=time.time())
+            await self.backend.enqueue(job)
+        logger.info("Queued job %s (%d jobs waiting)", job.job_id, depth + 1)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Return a job by its identifier, or None if it does not exist."""
+        return await self.backend.get(job_id)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.backend.dequeue()
+            job.status = JobStatus.RUNNING
+            await self.backend.save(job)
+            current_job_id.set(job.job_id)
+            try:
+                result = await self.handler(job.payload)
+                job.result = result.model_dump()
+                job.status = JobStatus.SUCCEEDED
+            except asyncio.CancelledError:
+                job.status = JobStatus.FAILED
+                job.error = "Job was cancelled"
+                raise
+            except Exception as e:
+                logger.exception("Job %s failed", job.job_id)
+                job.status = JobStatus.FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                await self.backend.save(job)
@@ -0,0 +1,173 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    rendered_labels = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+    rendered_value = "+Inf" if value == math.inf else repr(float(value))
+    return f"{name}{{{rendered_labels}}} {rendered_value}" if rendered_labels else f"{name} {rendered_value}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self._render_samples()]
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. of requests or tokens."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the count of the given label values by `amount`."""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the count of the given label values."""
+        return self._values.get(self._label_values(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            _format_sample(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """A distribution of observed values, e.g. durations, counted in cumulative buckets.
+
+    Attributes:
+        buckets (Tuple[float, ...]): The upper bounds of the buckets, in ascending order.
+    """
+
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}  # per bucket, plus a final +Inf bucket
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observed value for the given label values."""
+        key = self._label_values(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        """Return the number of values observed for the given label values."""
+        return sum(self._counts.get(self._label_values(labels), []))
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": "+Inf" if bound == math.inf else repr(float(bound))}
+                lines.append(_format_sample(f"{self.name}_bucket", bucket_labels, cumulative))
+            lines.append(_format_sample(f"{self.name}_sum", labels, self._sums[key]))
+            lines.append(_format_sample(f"{self.name}_count", labels, cumulative))
+        return lines
+
+
+class _CallbackMetric(_Metric):
+    def __init__(self, name: str, documentation: str, type: str, callback: Callable[[], Iterable[Sample]]):
+        super().__init__(name, documentation)
+        self.type = type
+        self.callback = callback
+
+    def _render_samples(self) -> List[str]:
+        return [_format_sample(self.name, labels, value) for labels, value in self.callback()]
+
+
+class MetricsRegistry:
+    """The metrics of the process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Create and register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Create and register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_callback(
+            self,
+            name: str,
+            documentation: str,
+            type: str,
+            callback: Callable[[], Iterable[Sample]]
+    ) -> None:
+        """Register a metric whose samples are read from `callback` on every scrape, e.g. existing stats counters.
+
+        Parameters:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            type (str): The Prometheus metric type, "counter" or "gauge".
+            callback (Callable[[], Iterable[Sample]]): Returns the (labels, value) samples of the metric.
+        """
+        self._register(_CallbackMetric(name, documentation, type, callback))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,273 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from itertools import groupby
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from decouple import config
+
+from app.common.context import current_job_id
+from app.common.exceptions import ApiError
+from app.lib.supabase_client import SupabaseClient
+from app.lib.tracing import span
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_BACKEND = config("PERSISTENCE_BACKEND", "supabase")
+PERSISTENCE_SQLITE_PATH = config("PERSISTENCE_SQLITE_PATH", "/tmp/tinygen.sqlite3")
+PERSISTENCE_SPILL_PATH = config("PERSISTENCE_SPILL_PATH", "/tmp/tinygen_persistence_spill.jsonl")
+PERSISTENCE_BUFFER_SIZE = config("PERSISTENCE_BUFFER_SIZE", 1000, cast=int)
+PERSISTENCE_BATCH_SIZE = config("PERSISTENCE_BATCH_SIZE", 50, cast=int)
+PERSISTENCE_FLUSH_INTERVAL = config("PERSISTENCE_FLUSH_INTERVAL", 2, cast=float)  # seconds
+PERSISTENCE_MAX_RETRIES = config("PERSISTENCE_MAX_RETRIES", 3, cast=int)
+PERSISTENCE_RETRY_BACKOFF = config("PERSISTENCE_RETRY_BACKOFF", 0.5, cast=float)  # seconds, doubled per retry
+
+_TABLE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_Item = Tuple[str, dict, Optional[str]]  # the table, the record and the job ID it was enqueued under
+
+
+class PersistenceBackend(abc.ABC):
+    """Storage backend for persisted records."""
+
+    @abc.abstractmethod
+    async def insert_many(self, table: str, records: List[dict]) -> None:
+        """Insert records into a table, raising an exception if they could not all be inserted."""
+
+
+class SupabaseBackend(PersistenceBackend):
+    """A persistence backend that inserts records into Supabase tables.
+
+    Attributes:
+        client (SupabaseClient): The Supabase client, which connects on first use.
+    """
+
+    def __init__(self, client: Optional[SupabaseClient] = None):
+        self.client = client or SupabaseClient()
+
+    async def insert_many(self, table: str, records: List[dict]) -> None:
+        await self.client.insert_records(table, records)
+
+
+class SQLiteBackend(PersistenceBackend):
+    """A persistence backend that stores records as JSON rows in a local SQLite database, for offline use.
+
+    Each table is created on first use with an id, the insertion time and the JSON-encoded record.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str = PERSISTENCE_SQLITE_PATH):
+        self.path = path
+
+    def _insert_many(self, table: str, records: List[dict]) -> None:
+        if not _TABLE_NAME_PATTERN.match(table):
+            raise ApiError(f"Invalid table name: {table}")
+        with sqlite3.connect(self.path) as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            now = time.time()
+            connection.executemany(
+                f"INSERT INTO {table} (created_at, data) VALUES (?, ?)",
+                [(now, json.dumps(record)) for record in records]
+            )
+        connection.close()
+
+    async def insert_many(self, table: str, records: List[dict]) -> None:
+        await asyncio.to_thread(self._insert_many, table, records)
+
+    def fetch_all(self, table: str) -> List[dict]:
+        """Return all records in a table, oldest first.
+
+        Parameters:
+            table (str): The name of the table.
+
+        Returns:
+            List[dict]: The decoded records.
+        """
+        if not _TABLE_NAME_PATTERN.match(table):
+            raise ApiError(f"Invalid table name: {table}")
+        with sqlite3.connect(self.path) as connection:
+            rows = connection.execute(f"SELECT data FROM {table} ORDER BY id").fetchall()
+        connection.close()
+        return [json.loads(data) for data, in rows]
+
+
+PERSISTENCE_BACKENDS: Dict[str, Callable[[], PersistenceBackend]] = {
+    "supabase": SupabaseBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+class WriteBehindWriter:
+    """Persists records in the background, off the request path.
+
+    Records are buffered in memory and written in batched multi-row inserts, either once a batch is full or
+    every flush interval. Failed batches are retried with exponential backoff and then spilled to a local JSONL
+    file, which is replayed on the next flush. Records that arrive while the buffer is full are handed to a background
+    task that spills them, so the caller never waits on file I/O. Stopping the writer flushes everything that is still
+    buffered. Each record keeps the job ID it was enqueued under, which tags the spans of the batches it is written in.
+
+    Attributes:
+        backend (PersistenceBackend): The backend the records are written to.
+        buffer_size (int): The maximum number of records held in memory.
+        batch_size (int): The maximum number of records per insert.
+        flush_interval (float): The number of seconds between background flushes.
+        max_retries (int): The number of times a failed batch is retried before it is spilled.
+        retry_backoff (float): The number of seconds before the first retry, doubled for each further retry.
+        spill_path (str): The path of the JSONL file that holds records which could not be written.
+        written (int): The number of records written to the backend.
+        spilled (int): The number of records spilled to disk.
+    """
+
+    def __init__(
+            self,
+            backend: Optional[PersistenceBackend] = None,
+            buffer_size: int = PERSISTENCE_BUFFER_SIZE,
+            batch_size: int = PERSISTENCE_BATCH_SIZE,
+            flush_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+            max_retries: int = PERSISTENCE_MAX_RETRIES,
+            retry_backoff: float = PERSISTENCE_RETRY_BACKOFF,
+            spill_path: str = PERSISTENCE_SPILL_PATH
+    ):
+        self.backend = backend or PERSISTENCE_BACKENDS[PERSISTENCE_BACKEND]()
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spill_path = spill_path
+        self.written = 0
+        self.spilled = 0
+        self._buffer: Deque[_Item] = deque()
+        self._overflow: List[_Item] = []
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._spill_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._spill_task: Optional[asyncio.Task] = None
+
+    def enqueue(self, table: str, record: dict) -> None:
+        """Buffer a record to be written in the background. Never waits on the backend.
+
+        Parameters:
+            table (str): The name of the table the record belongs to.
+            record (dict): The record.
+        """
+        item = (table, record, current_job_id.get())
+        if len(self._buffer) >= self.buffer_size:
+            logger.warning("Persistence buffer is full, spilling a record for %s to %s", table, self.spill_path)
+            self._overflow.append(item)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:  # no loop to spill in, so the next flush writes the record instead
+                return
+            if self._spill_task is None or self._spill_task.done():
+                self._spill_task = loop.create_task(self._spill_overflow())
+            return
+        self._buffer.append(item)
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    def start(self) -> None:
+        """Start the background flush task. Must be called from within a running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flush task and flush all buffered records."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._spill_task is not None:
+            await asyncio.gather(self._spill_task, return_exceptions=True)
+            self._spill_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write all buffered and previously spilled records to the backend."""
+        async with self._flush_lock:
+            self._batch_ready.clear()
+            async with self._spill_lock:
+                spilled = await asyncio.to_thread(self._take_spilled)
+            pending = spilled + self._overflow + list(self._buffer)
+            self._overflow = []
+            self._buffer.clear()
+            for table, table_items in groupby(sorted(pending, key=lambda item: item[0]), key=lambda item: item[0]):
+                items = list(table_items)
+                for start in range(0, len(items), self.batch_size):
+                    await self._write_batch(table, items[start:start + self.batch_size])
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Background persistence flush failed")
+
+    async def _write_batch(self, table: str, items: List[_Item]) -> None:
+        records = [record for _, record, _ in items]
+        job_ids = sorted({job_id for _, _, job_id in items if job_id})
+        for attempt in range(self.max_retries + 1):
+            try:
+                with span("persist", table=table, records=len(records)) as persist_span:
+                    # The batch is written by the background task, outside of the jobs whose records it holds
+                    persist_span.job_id = ",".join(job_ids) or None
+                    await self.backend.insert_many(table, records)
+                self.written += len(records)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error("Giving up on writing %d records to %s, spilling them: %s", len(records), table, e)
+                    async with self._spill_lock:
+                        await asyncio.to_thread(self._spill, items)
+                    return
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning("Writing %d records to %s failed, retrying in %ss: %s", len(records), table, delay, e)
+                await asyncio.sleep(delay)
+
+    async def _spill_overflow(self) -> None:
+        async with self._spill_lock:
+            while self._overflow:
+                items, self._overflow = self._overflow, []
+                try:
+                    await asyncio.to_thread(self._spill, items)
+                except OSError:
+                    logger.exception("Could not spill %d records to %s", len(items), self.spill_path)
+                    self._overflow = items + self._overflow  # left for the next flush to write
+                    return
+
+    def _spill(self, items: List[_Item]) -> None:
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as file:
+            file.writelines(
+                json.dumps({"table": table, "record": record, "job_id": job_id}) + "\n"
+                for table, record, job_id in items
+            )
+        self.spilled += len(items)
+
+    def _take_spilled(self) -> List[_Item]:
+        replay_path = f"{self.spill_path}.replay"
+        try:
+            os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            return []
+        with open(replay_path, encoding="utf-8") as file:
+            items = [json.loads(line) for line in file if line.strip()]
+        os.remove(replay_path)
+        logger.info("Replaying %d spilled records from %s", len(items), self.spill_path)
+        return [(item["table"], item["record"], item.get("job_id")) for item in items]
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from decouple import config
+
+from app.lib.git import has_commit, run_git
+
+logger = logging.getLogger(__name__)
+
+REPO_CACHE_PATH = config("REPO_CACHE_PATH", "/tmp/repo_cache")
+REPO_CACHE_MAX_BYTES = config("REPO_CACHE_MAX_BYTES", 5 * 1024 ** 3, cast=int)
+REPO_CACHE_FETCH_TTL = config("REPO_CACHE_FETCH_TTL", 30, cast=float)  # seconds
+
+
+def get_dir_size(path: str) -> int:
+    """Compute the total size of all files within a directory.
+
+    Parameters:
+        path (str): The directory to measure.
+
+    Returns:
+        int: The total size in bytes.
+    """
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+class RepoCache:
+    """A local cache of bare repository mirrors used to avoid full network clones.
+
+    On a cache miss the repository is cloned with `--mirror`. On a cache hit the mirror is only fetched
+    incrementally, and the working copy is created with a local clone, which hardlinks the object files
+    instead of copying them. Mirrors are evicted least recently used first once the disk budget is exceeded.
+
+    Attributes:
+        cache_path (str): The directory where mirrors are stored.
+        max_bytes (int): The disk budget for all mirrors combined.
+        fetch_ttl (float): Seconds during which a fetched mirror is considered fresh and is not fetched again.
+        hits (int): The number of checkouts served from an existing mirror.
+        misses (int): The number of checkouts that required a fresh mirror clone.
+        evictions (int): The number of mirrors evicted to stay within the disk budget.
+    """
+
+    def __init__(
+            self,
+            cache_path: str = REPO_CACHE_PATH,
+            max_bytes: int = REPO_CACHE_MAX_BYTES,
+            fetch_ttl: float = REPO_CACHE_FETCH_TTL
+    ):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.fetch_ttl = fetch_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last_fetched: Dict[str, float] = {}
+
+    def mirror_path(self, repo_url: str) -> str:
+        """Return the path of the bare mirror for a repository.
+
+        Parameters:
+            repo_url (str): The URL of the repository.
+
+        Returns:
+            str: The path of the mirror within the cache directory.
+        """
+        return os.path.join(self.cache_path, f"{hashlib.sha256(repo_url.encode()).hexdigest()[:32]}.git")
+
+    def _lock_for(self, mirror_path: str) -> asyncio.Lock:
+        return self._locks.setdefault(mirror_path, asyncio.Lock())
+
+    async def _update_mirror(self, repo_url: str, mirror_path: str, commit: Optional[str] = None) -> None:
+        """Clone or incrementally fetch the mirror of a repository. Must be called with the mirror lock held."""
+        if os.path.isdir(mirror_path):
+            self.hits += 1
+            is_fresh = time.monotonic() - self._last_fetched.get(mirror_path, float("-inf")) < self.fetch_ttl
+            if is_fresh and (commit is None or await has_commit(mirror_path, commit)):
+                logger.debug("Mirror for %s is fresh, skipping fetch", repo_url)
+                return
+            await run_git(["--git-dir", mirror_path, "fetch", "--prune", "--quiet", "origin"])
+        else:
+            self.misses += 1
+            os.makedirs(self.cache_path, exist_ok=True)
+            staging_path = f"{mirror_path}.tmp-{os.getpid()}"
+            try:
+                await run_git(["clone", "--mirror", "--quiet", repo_url, staging_path])
+                os.rename(staging_path, mirror_path)
+            finally:
+                if os.path.exists(staging_path):
+                    await asyncio.to_thread(shutil.rmtree, staging_path)
+        self._last_fetched[mirror_path] = time.monotonic()
+
+    async def checkout(self, repo_url: str, dest_dir: str, commit: Optional[str] = None) -> None:
+        """Create a working copy of a repository, using the cached mirror where possible.
+
+        Parameters:
+            repo_url (str): The URL of the repository.
+            dest_dir (str): The directory where the working copy will be created.
+            commit (str, optional): The commit to check out. Defaults to None, which checks out the default branch.
+
+        Raises:
+            GitCommandError: If cloning or fetching the repository fails.
+        """
+        mirror_path = self.mirror_path(repo_url)
+        async with self._lock_for(mirror_path):
+            await self._update_mirror(repo_url, mirror_path, commit)
+            os.utime(mirror_path)  # the mirror's mtime marks its last use for LRU eviction
+            await run_git(["clone", "--local", "--quiet", mirror_path, dest_dir])
+        await run_git(["remote", "set-url", "origin", repo_url], cwd=dest_dir)
+        if commit is not None:
+            await run_git(["checkout", "--quiet", "--detach", commit], cwd=dest_dir)
+        await self.evict()
+
+    async def evict(self) -> None:
+        """Evict least recently used mirrors until the cache fits within its disk budget.
+
+        Mirrors that are currently being fetched or checked out are never evicted.
+        """
+        mirrors = await asyncio.to_thread(self._list_mirrors)
+
+        total_bytes = sum(size for _, _, size in mirrors)
+        for _, path, size in sorted(mirrors):
+            if total_bytes <= self.max_bytes:
+                break
+            lock = self._lock_for(path)
+            if lock.locked():
+                continue
+            async with lock:
+                logger.info("Evicting repository mirror %s (%d bytes)", path, size)
+                await asyncio.to_thread(shutil.rmtree, path, ignore_errors=True)
+                self._last_fetched.pop(path, None)
+                self.evictions += 1
+                total_bytes -= size
+
+    def _list_mirrors(self) -> List[Tuple[float, str, int]]:
+        """List the cached mirrors as (last used time, path, size in bytes) tuples."""
+        if not os.path.isdir(self.cache_path):
+            return []
+        mirrors = []
+        for name in os.listdir(self.cache_path):
+            path = os.path.join(self.cache_path, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                mirrors.append((os.stat(path).st_mtime, path, get_dir_size(path)))
+        return mirrors
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache hit, miss and eviction counters.
+
+        Returns:
+            Dict[str, int]: The counters keyed by name.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+repo_cache = RepoCache()
@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from decouple import config
+
+from app.common.exceptions import GitCommandError
+from app.lib.cache import TieredCache
+from app.lib.git import run_git
+from app.lib.repo_cache import REPO_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_TOP_K = config("RETRIEVAL_TOP_K", 20, cast=int)
+RETRIEVAL_FETCH_TOP_K = config("RETRIEVAL_FETCH_TOP_K", 3, cast=int)
+RETRIEVAL_INDEX_PATH = config("RETRIEVAL_INDEX_PATH", os.path.join(REPO_CACHE_PATH, "retrieval"))
+RETRIEVAL_INDEX_TTL = config("RETRIEVAL_INDEX_TTL", 7 * 24 * 3600, cast=float)  # seconds
+RETRIEVAL_INDEX_DISK_MAX_BYTES = config("RETRIEVAL_INDEX_DISK_MAX_BYTES", 512 * 1024 ** 2, cast=int)
+RETRIEVAL_INDEX_WORKERS = config("RETRIEVAL_INDEX_WORKERS", os.cpu_count() or 1, cast=int)
+RETRIEVAL_PARALLEL_MIN_FILES = config("RETRIEVAL_PARALLEL_MIN_FILES", 500, cast=int)
+
+RETRIEVAL_INDEX_VERSION = 1
+PATH_TERM_WEIGHT = 3  # path terms count as this many occurrences, since file names are strong signals
+MAX_INDEXED_BYTES = 256 * 1024  # only the head of very large files is indexed
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "if", "in", "into", "is", "it", "not", "of", "on",
+    "or", "that", "the", "this", "to", "with", "add", "new", "use", "make", "should", "def", "self", "return",
+    "import", "class", "function", "const", "let", "var", "none", "null", "true", "false",
+}
+
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms.
+
+    Identifiers are split on snake_case and camelCase boundaries, and compound identifiers are also kept whole,
+    so "fetchFileMap" yields "fetchfilemap", "fetch", "file" and "map".
+
+    Parameters:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The search terms, in order of occurrence.
+    """
+    terms = []
+    for identifier in _IDENTIFIER_PATTERN.findall(text):
+        parts = [part.lower() for part in _SUBWORD_PATTERN.findall(identifier)]
+        if len(parts) > 1:
+            terms.append(identifier.lower().strip("_"))
+        terms.extend(part for part in parts if len(part) > 1 and part not in STOPWORDS)
+    return terms
+
+
+def _count_terms(root: str, paths: List[str], read_files: bool) -> List[Dict[str, int]]:
+    term_counts = []
+    for path in paths:
+        counts = Counter(tokenize(path.replace("/", " ").replace(".", " ")) * PATH_TERM_WEIGHT)
+        if read_files:
+            try:
+                with open(os.path.join(root, path), "r", encoding="utf-8", errors="ignore") as file:
+                    counts.update(tokenize(file.read(MAX_INDEXED_BYTES)))
+            except OSError:
+                pass  # files missing from the checkout are indexed by their path only
+        term_counts.append(dict(counts))
+    return term_counts
+
+
+class BM25Index:
+    """An inverted index of repository files, scored with Okapi BM25.
+
+    Attributes:
+        paths (List[str]): The repository-relative path of each document.
+        lengths (List[int]): The number of terms in each document.
+        postings (Dict[str, List[Tuple[int, int]]]): The (document, term frequency) pairs of each term.
+        k1 (float): The term frequency saturation parameter.
+        b (float): The document length normalisation parameter.
+    """
+
+    def __init__(
+            self,
+            paths: List[str],
+            lengths: List[int],
+            postings: Dict[str, List[Tuple[int, int]]],
+            k1: float = 1.2,
+            b: float = 0.75
+    ):
+        self.paths = paths
+        self.lengths = lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def from_term_counts(cls, paths: List[str], term_counts: List[Dict[str, int]]) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for document, counts in enumerate(term_counts):
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((document, frequency))
+        return cls(paths, [sum(counts.values()) for counts in term_counts], postings)
+
+    @classmethod
+    def from_json(cls, data: str) -> "BM25Index":
+        index = json.loads(data)
+        postings = {term: [tuple(posting) for posting in postings] for term, postings in index["postings"].items()}
+        return cls(index["paths"], index["lengths"], postings)
+
+    def to_json(self) -> str:
+        return json.dumps({"paths": self.paths, "lengths": self.lengths, "postings": self.postings})
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Rank the documents matching a query.
+
+        Parameters:
+            query (str): The search query, e.g. the user prompt.
+            top_k (int): The maximum number of results.
+
+        Returns:
+            List[Tuple[str, float]]: The path and score of the best matching documents, best first.
+        """
+        document_count = len(self.paths)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (document_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for document, frequency in term_postings:
+                length_norm = 1 - self.b + self.b * self.lengths[document] / (self.average_length or 1)
+                scores[document] = scores.get(document, 0.0) + \
+                    idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.paths[item[0]]))
+        return [(self.paths[document], score) for document, score in ranked[:top_k]]
+
+
+_index_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_index_pool() -> ProcessPoolExecutor:
+    # Created on first use and kept for the lifetime of the app, so worker processes are only spawned once. Spawned
+    # rather than forked, since forking a process running threads is unsafe.
+    global _index_pool
+    if _index_pool is None:
+        _index_pool = ProcessPoolExecutor(
+            max_workers=max(RETRIEVAL_INDEX_WORKERS, 1), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _index_pool
+
+
+async def shutdown_index_pool() -> None:
+    """Stop the worker processes that build retrieval indexes, waiting for running builds in a background thread."""
+    global _index_pool
+    pool, _index_pool = _index_pool, None
+    if pool is not None:
+        await asyncio.to_thread(pool.shutdown)
+
+
+async def build_retrieval_index(
+        repo_dir: str,
+        paths: List[str],
+        read_files: bool = True,
+        workers: int = RETRIEVAL_INDEX_WORKERS
+) -> BM25Index:
+    """Build the retrieval index of a repository checkout.
+
+    Files are tokenized in the shared pool of worker processes when there are at least RETRIEVAL_PARALLEL_MIN_FILES of
+    them, and in a background thread otherwise.
+
+    Parameters:
+        repo_dir (str): The path of the repository checkout.
+        paths (List[str]): The repository-relative paths of the files to index.
+        read_files (bool, optional): Whether to index file contents as well as paths. Defaults to True.
+        workers (int, optional): The number of batches the files are split into for the worker processes. Defaults to
+            RETRIEVAL_INDEX_WORKERS.
+
+    Returns:
+        BM25Index: The retrieval index.
+    """
+    if workers <= 1 or len(paths) < RETRIEVAL_PARALLEL_MIN_FILES:
+        term_counts = await asyncio.to_thread(_count_terms, repo_dir, paths, read_files)
+        return BM25Index.from_term_counts(paths, term_counts)
+
+    batch_size = math.ceil(len(paths) / workers)
+    batches = [paths[start:start + batch_size] for start in range(0, len(paths), batch_size)]
+    loop = asyncio.get_running_loop()
+    pool = _get_index_pool()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(pool, _count_terms, repo_dir, batch, read_files) for batch in batches)
+    )
+    return BM25Index.from_term_counts(paths, [counts for batch_counts in results for counts in batch_counts])
+
+
+class RetrievalIndexCache(TieredCache):
+    """A two-tier cache of serialized retrieval indexes, keyed by repository commit, stored next to the clone cache."""
+
+    def __init__(
+            self,
+            enabled: bool = True,
+            cache_path: str = RETRIEVAL_INDEX_PATH,
+            ttl: float = RETRIEVAL_INDEX_TTL,
+            memory_entries: int = 8,
+            disk_max_bytes: int = RETRIEVAL_INDEX_DISK_MAX_BYTES
+    ):
+        super().__init__(cache_path, enabled, ttl, memory_entries, disk_max_bytes)
+
+
+retrieval_index_cache = RetrievalIndexCache()
+
+
+def generate_retrieval_index_key(commit: str, paths: List[str], read_files: bool) -> str:
+    """Generate the cache key of a retrieval index.
+
+    Parameters:
+        commit (str): The commit the checkout is at.
+        paths (List[str]): The repository-relative paths of the indexed files.
+        read_files (bool): Whether file contents are indexed.
+
+    Returns:
+        str: The SHA-256 hex digest of the inputs.
+    """
+    inputs = {"version": RETRIEVAL_INDEX_VERSION, "commit": commit, "paths": paths, "read_files": read_files}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+async def load_retrieval_index(
+        repo_dir: str,
+        paths: List[str],
+        commit: Optional[str] = None,
+        read_files: bool = True
+) -> BM25Index:
+    """Load the retrieval index of a repository checkout from the cache, building and caching it on a miss.
+
+    Parameters:
+        repo_dir (str): The path of the repository checkout.
+        paths (List[str]): The repository-relative paths of the files to index.
+        commit (str, optional): The commit the checkout is at. Defaults to None, which resolves the checkout's HEAD.
+            Indexes are only cached when the commit is known.
+        read_files (bool, optional): Whether to index file contents as well as paths. Defaults to True.
+
+    Returns:
+        BM25Index: The retrieval index.
+    """
+    if commit is None:
+        try:
+            commit = (await run_git(["rev-parse", "HEAD"], cwd=repo_dir)).strip()
+        except (GitCommandError, OSError):
+            logger.debug("Not caching the retrieval index of %s, which has no resolvable HEAD", repo_dir)
+
+    cache_key = generate_retrieval_index_key(commit, paths, read_files) if commit else None
+    if cache_key:
+        cached_index = await retrieval_index_cache.get(cache_key)
+        if cached_index is not None:
+            return BM25Index.from_json(cached_index)
+
+    retrieval_index = await build_retrieval_index(repo_dir, paths, read_files)
+    if cache_key:
+        await retrieval_index_cache.set(cache_key, retrieval_index.to_json())
+    return retrieval_index
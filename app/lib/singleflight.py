@@ -0,0 +1,60 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls with the same key into a single execution.
+
+    The first caller for a key (the leader) starts the call as a task. Callers arriving while it is in flight
+    (followers) wait on the same task and receive the same result or exception. The task is cancelled only once
+    every caller waiting on it has been cancelled.
+
+    Attributes:
+        coalesced (int): The number of calls that were served by a call already in flight.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: Dict[str, _Call[T]] = {}
+
+    def in_flight(self, key: str) -> bool:
+        """Return whether a call with the given key is currently in flight."""
+        return key in self._calls
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn`, unless a call with the same key is already in flight, in which case wait for that call instead.
+
+        Parameters:
+            key (str): The key identifying identical calls.
+            fn (Callable[[], Awaitable[T]]): The coroutine function to run if no identical call is in flight.
+
+        Returns:
+            T: The result of the call.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -1,24 +1,63 @@
-from decouple import config
-from supabase import create_client
+import asyncio
 import logging
+from typing import List, Optional
+
+from decouple import config
+from supabase import Client, create_client
+
+from app.common.exceptions import ApiError
+
+logger = logging.getLogger(__name__)
 
 
 class SupabaseClient:
     """A client class for interacting with Supabase.
 
+    The underlying Supabase client is created on first use, so constructing this class does not require
+    credentials or network access.
+
     Attributes:
         supabase_url (str): The URL of the Supabase instance.
         supabase_key (str): The API key for the Supabase instance.
-        supabase (SupabaseClient): The actual Supabase client instance.
     """
 
     def __init__(self):
         """Initialize the Supabase client with credentials."""
-        self.supabase_url = config('SUPABASE_URL')
-        self.supabase_key = config('SUPABASE_KEY')
-        self.supabase = create_client(self.supabase_url, self.supabase_key)
+        self.supabase_url = config('SUPABASE_URL', default=None)
+        self.supabase_key = config('SUPABASE_KEY', default=None)
+        self._supabase: Optional[Client] = None
+
+    @property
+    def supabase(self) -> Client:
+        """The actual Supabase client instance."""
+        if self._supabase is None:
+            self._supabase = create_client(self.supabase_url, self.supabase_key)
+        return self._supabase
+
+    async def insert_records(self, table: str, records: List[dict]) -> List[dict]:
+        """Insert records into a Supabase table with a single multi-row request.
+
+        The Supabase client is synchronous, so the request runs in a worker thread to keep the event loop free.
 
-    def insert_record(self, table: str, data: dict) -> dict:
+        Parameters:
+            table (str): The name of the table where the records will be inserted.
+            records (List[dict]): The records that will be inserted into the table.
+
+        Returns:
+            List[dict]: The data that was inserted.
+
+        Raises:
+            ApiError: If the records could not be inserted.
+        """
+        try:
+            response = await asyncio.to_thread(self.supabase.table(table).insert(records).execute)
+        except Exception as e:
+            raise ApiError(f"Failed to insert {len(records)} records into {table}: {e}") from e
+        if getattr(response, 'error', None):
+            raise ApiError(f"Supabase error while inserting into {table}: {response.error}")
+        return response.data
+
+    async def insert_record(self, table: str, data: dict) -> dict:
         """Insert a new record into a Supabase table.
 
         Parameters:
@@ -29,11 +68,7 @@ class SupabaseClient:
             dict: The data that was inserted, or None if an error occurred.
         """
         try:
-            response = self.supabase.table(table).insert([data]).execute()
-            if getattr(response, 'error', None):
-                logging.error(f"Supabase error: {response.error}")
-                return None
-            return response.data
-        except Exception as e:
-            logging.error(f"Exception occurred while inserting record into {table}: {e}")
+            return await self.insert_records(table, [data])
+        except ApiError as e:
+            logger.error("%s", e)
             return None
@@ -0,0 +1,337 @@
+import ast
+import asyncio
+import logging
+import posixpath
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+
+from decouple import config
+
+from app.common.exceptions import GitCommandError
+from app.lib.file_index import detect_language
+from app.lib.git import list_tree_blobs, read_blobs
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_CACHE_ENTRIES = config("SYMBOL_CACHE_ENTRIES", 50000, cast=int)
+SYMBOL_MAX_FILE_BYTES = config("SYMBOL_MAX_FILE_BYTES", 512 * 1024, cast=int)
+
+
+@dataclass
+class Symbol:
+    """A top-level definition in a source file.
+
+    Attributes:
+        name (str): The name of the definition.
+        kind (str): The kind of definition, e.g. "function" or "class".
+        path (str): The repository-relative path of the file defining it.
+        line (int): The line the definition starts on.
+        signature (str): The signature of the definition, without its body.
+    """
+    name: str
+    kind: str
+    path: str
+    line: int
+    signature: str
+
+
+@dataclass
+class ImportReference:
+    """A module imported by a source file.
+
+    Attributes:
+        candidates (List[str]): The repository-relative paths the module may resolve to, most likely first.
+        names (List[str]): The names imported from the module, if it is not imported as a whole.
+    """
+    candidates: List[str]
+    names: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FileSymbols:
+    """The definitions, imports and references of a source file.
+
+    Attributes:
+        path (str): The repository-relative path of the file.
+        definitions (List[Symbol]): The top-level definitions in the file.
+        imports (List[ImportReference]): The modules the file imports.
+        references (Set[str]): The names the file calls or otherwise refers to.
+    """
+    path: str
+    definitions: List[Symbol] = field(default_factory=list)
+    imports: List[ImportReference] = field(default_factory=list)
+    references: Set[str] = field(default_factory=set)
+
+
+def _python_module_candidates(module_path: str) -> List[str]:
+    candidates = [f"{module_path}.py", f"{module_path}/__init__.py"]
+    return candidates + [f"src/{candidate}" for candidate in candidates]
+
+
+def _python_signature(node: ast.AST, indent: str = "") -> str:
+    if isinstance(node, ast.ClassDef):
+        bases = ", ".join(ast.unparse(base) for base in node.bases + node.keywords)
+        lines = [f"{indent}class {node.name}({bases}):" if bases else f"{indent}class {node.name}:"]
+        body = [
+            child for child in node.body
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and (not child.name.startswith("_") or child.name == "__init__")
+        ]
+        lines.extend(_python_signature(child, indent + "    ") for child in body)
+    else:
+        prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+        returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+        lines = [f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){returns}:"]
+    docstring = ast.get_docstring(node)
+    if docstring:
+        lines.insert(1, f'{indent}    """{docstring.strip().splitlines()[0]}"""')
+    return "\n".join(lines)
+
+
+def extract_python_symbols(path: str, content: str) -> FileSymbols:
+    """Extract the symbols of a Python file with the ast module.
+
+    Parameters:
+        path (str): The repository-relative path of the file.
+        content (str): The content of the file.
+
+    Returns:
+        FileSymbols: The symbols of the file. Files that do not parse fall back to the regex extractor.
+    """
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return extract_regex_symbols(path, content)
+
+    file_symbols = FileSymbols(path=path)
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            file_symbols.definitions.append(Symbol(node.name, kind, path, node.lineno, _python_signature(node)))
+
+    package = posixpath.dirname(path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                file_symbols.imports.append(ImportReference(_python_module_candidates(alias.name.replace(".", "/"))))
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package
+                for _ in range(node.level - 1):
+                    base = posixpath.dirname(base)
+                module_path = posixpath.join(base, *(node.module or "").split(".")) if node.module else base
+                candidates = [f"{module_path}.py", f"{module_path}/__init__.py"]
+            else:
+                module_path = (node.module or "").replace(".", "/")
+                candidates = _python_module_candidates(module_path)
+            names = [alias.name for alias in node.names if alias.name != "*"]
+            file_symbols.imports.append(ImportReference(candidates, names))
+            for name in names:  # the imported names may be submodules
+                submodule_path = f"{module_path}/{name}" if module_path else name
+                file_symbols.imports.append(ImportReference([f"{submodule_path}.py", f"{submodule_path}/__init__.py"]))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name):
+                file_symbols.references.add(node.func.id)
+            elif isinstance(node.func, ast.Attribute):
+                file_symbols.references.add(node.func.attr)
+        elif isinstance(node, ast.ClassDef):
+            file_symbols.references.update(base.id for base in node.bases if isinstance(base, ast.Name))
+    return file_symbols
+
+
+_REGEX_DEFINITION_PATTERNS = [
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)\s*\(")),
+    ("class", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(\w+)")),
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:const|let)\s+(\w+)\s*=\s*(?:async\s+)?(?:\([^)]*\)|\w+)\s*=>")),
+    ("function", re.compile(r"^func\s+(?:\([^)]*\)\s*)?(\w+)\s*\(")),
+    ("function", re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+(\w+)")),
+    ("class", re.compile(r"^\s*(?:pub\s+)?(?:struct|enum|trait|interface|type)\s+(\w+)")),
+    ("function", re.compile(r"^\s*def\s+(\w+)")),
+]
+_REGEX_IMPORT_PATTERN = re.compile(r"""(?:from\s+|require\(\s*|import\s+)['"](\.{1,2}/[^'"]+)['"]""")
+_REGEX_CALL_PATTERN = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+_SCRIPT_EXTENSIONS = ["", ".ts", ".tsx", ".js", ".jsx", ".mjs", "/index.ts", "/index.js"]
+
+
+def extract_regex_symbols(path: str, content: str) -> FileSymbols:
+    """Extract the symbols of a source file with regular expressions, for languages without a dedicated extractor.
+
+    Definitions are recognised line by line, and only relative imports (e.g. JavaScript's "./util") are resolved.
+
+    Parameters:
+        path (str): The repository-relative path of the file.
+        content (str): The content of the file.
+
+    Returns:
+        FileSymbols: The symbols of the file.
+    """
+    file_symbols = FileSymbols(path=path)
+    for line_number, line in enumerate(content.splitlines(), start=1):
+        for kind, pattern in _REGEX_DEFINITION_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                signature = line.strip().rstrip("{").rstrip()
+                file_symbols.definitions.append(Symbol(match.group(1), kind, path, line_number, signature))
+                break
+
+    directory = posixpath.dirname(path)
+    for module in _REGEX_IMPORT_PATTERN.findall(content):
+        module_path = posixpath.normpath(posixpath.join(directory, module))
+        file_symbols.imports.append(ImportReference([module_path + extension for extension in _SCRIPT_EXTENSIONS]))
+    file_symbols.references.update(_REGEX_CALL_PATTERN.findall(content))
+    return file_symbols
+
+
+SYMBOL_EXTRACTORS: Dict[str, Callable[[str, str], FileSymbols]] = {
+    "Python": extract_python_symbols,
+}
+REGEX_SYMBOL_LANGUAGES = {
+    "JavaScript", "TypeScript", "Go", "Rust", "Java", "Kotlin", "Scala", "Swift", "C#", "PHP", "Ruby",
+}
+
+_file_symbols_cache: "OrderedDict[str, FileSymbols]" = OrderedDict()
+
+
+def get_symbol_extractor(path: str) -> Optional[Callable[[str, str], FileSymbols]]:
+    """Get the symbol extractor for a file, based on its language.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        Optional[Callable[[str, str], FileSymbols]]: The extractor, or None if the language is not supported.
+    """
+    language = detect_language(path)
+    if language in SYMBOL_EXTRACTORS:
+        return SYMBOL_EXTRACTORS[language]
+    if language in REGEX_SYMBOL_LANGUAGES:
+        return extract_regex_symbols
+    return None
+
+
+class SymbolIndex:
+    """A symbol and import index of a commit, built incrementally as files are needed.
+
+    Files are read from git by blob SHA, so only the files that are needed are fetched on blobless clones, and the
+    extracted symbols are cached by blob SHA across commits.
+
+    Attributes:
+        repo_dir (str): The path of the repository checkout.
+        blobs (Dict[str, str]): The blob SHA of each repository-relative file path in the commit.
+        files (Dict[str, FileSymbols]): The symbols of each file indexed so far.
+    """
+
+    def __init__(self, repo_dir: str, blobs: Dict[str, str]):
+        self.repo_dir = repo_dir
+        self.blobs = blobs
+        self.files: Dict[str, FileSymbols] = {}
+
+    async def ensure_indexed(self, paths: List[str]) -> None:
+        """Index the given files, unless they are already indexed, unsupported or not in the commit.
+
+        Parameters:
+            paths (List[str]): The repository-relative paths of the files.
+        """
+        pending = {}
+        for path in paths:
+            if path in self.files or path not in self.blobs or get_symbol_extractor(path) is None:
+                continue
+            cache_key = f"{self.blobs[path]}:{path}"
+            cached = _file_symbols_cache.get(cache_key)
+            if cached is not None:
+                _file_symbols_cache.move_to_end(cache_key)
+                self.files[path] = cached
+            else:
+                pending[path] = cache_key
+        if not pending:
+            return
+
+        contents = await read_blobs(self.repo_dir, [self.blobs[path] for path in pending])
+
+        def extract() -> Dict[str, FileSymbols]:
+            extracted = {}
+            for path in pending:
+                content = contents.get(self.blobs[path])
+                if content is not None and len(content) <= SYMBOL_MAX_FILE_BYTES:
+                    extracted[path] = get_symbol_extractor(path)(path, content.decode("utf-8", errors="ignore"))
+            return extracted
+
+        for path, file_symbols in (await asyncio.to_thread(extract)).items():
+            self.files[path] = file_symbols
+            _file_symbols_cache[pending[path]] = file_symbols
+            if len(_file_symbols_cache) > SYMBOL_CACHE_ENTRIES:
+                _file_symbols_cache.popitem(last=False)
+
+    def resolve_import(self, import_reference: ImportReference) -> Optional[str]:
+        """Resolve an import to a file in the commit.
+
+        Parameters:
+            import_reference (ImportReference): The import.
+
+        Returns:
+            Optional[str]: The repository-relative path of the imported file, or None if it is not in the repository.
+        """
+        return next((path for path in import_reference.candidates if path in self.blobs), None)
+
+    async def related_definitions(self, paths: List[str]) -> List[Symbol]:
+        """Find the definitions outside of the given files that those files import or call.
+
+        Parameters:
+            paths (List[str]): The repository-relative paths of the files.
+
+        Returns:
+            List[Symbol]: The related definitions, explicitly imported names first, then other referenced names.
+        """
+        await self.ensure_indexed(paths)
+        own_paths = set(paths)
+        imported_names: Set[str] = set()
+        references: Set[str] = set()
+        imported_paths: Dict[str, None] = {}
+        for path in paths:
+            file_symbols = self.files.get(path)
+            if file_symbols is None:
+                continue
+            references.update(file_symbols.references)
+            for import_reference in file_symbols.imports:
+                imported_path = self.resolve_import(import_reference)
+                if imported_path and imported_path not in own_paths:
+                    imported_paths[imported_path] = None
+                    imported_names.update(import_reference.names)
+        own_definitions = {
+            symbol.name for path in paths if path in self.files for symbol in self.files[path].definitions
+        }
+        await self.ensure_indexed(list(imported_paths))
+
+        explicit: List[Symbol] = []
+        referenced: List[Symbol] = []
+        for imported_path in imported_paths:
+            file_symbols = self.files.get(imported_path)
+            if file_symbols is None:
+                continue
+            for symbol in file_symbols.definitions:
+                if symbol.name in own_definitions:
+                    continue
+                if symbol.name in imported_names:
+                    explicit.append(symbol)
+                elif symbol.name in references:
+                    referenced.append(symbol)
+        return explicit + referenced
+
+
+async def load_symbol_index(repo_dir: str) -> Optional[SymbolIndex]:
+    """Create the symbol index of a repository checkout's HEAD commit.
+
+    Parameters:
+        repo_dir (str): The path of the repository checkout.
+
+    Returns:
+        Optional[SymbolIndex]: The symbol index, or None if the checkout is not a git repository.
+    """
+    try:
+        blobs = await list_tree_blobs(repo_dir)
+    except (GitCommandError, OSError) as e:
+        logger.debug("No symbol index for %s: %s", repo_dir, e)
+        return None
+    return SymbolIndex(repo_dir, blobs)
@@ -0,0 +1,219 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+from decouple import config
+
+from app.common.context import current_job_id
+from app.lib.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORT_PATH = config("TRACE_EXPORT_PATH", default=None)  # OTLP JSON lines file, unset to disable export
+TRACE_SERVICE_NAME = config("TRACE_SERVICE_NAME", "tinygen")
+
+STAGE_DURATION = metrics.histogram(
+    "codegen_stage_duration_seconds", "Time spent in each stage of the codegen pipeline.", ["stage"]
+)
+
+
+@dataclass
+class StageStats:
+    """Aggregated timings of one pipeline stage.
+
+    Attributes:
+        count (int): The number of times the stage ran.
+        total (float): The total number of seconds spent in the stage.
+        max (float): The longest number of seconds a single run of the stage took.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+class StageTimer:
+    """Records how long each stage of the codegen pipeline takes, aggregated across all requests in the process.
+
+    Stages may run concurrently and nest, so the stage totals can add up to more than the wall-clock time.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, StageStats] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record a run of a stage that took the given number of seconds."""
+        stats = self._stages.setdefault(name, StageStats())
+        stats.count += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+
+    def reset(self) -> None:
+        """Discard all recorded timings."""
+        self._stages.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return the count, total, mean and maximum duration in seconds of each stage."""
+        return {
+            name: {"count": stats.count, "total": stats.total, "mean": stats.total / stats.count, "max": stats.max}
+            for name, stats in self._stages.items()
+        }
+
+
+stage_timer = StageTimer()
+
+
+@dataclass
+class Span:
+    """A timed operation within a trace.
+
+    Attributes:
+        name (str): The name of the stage the span times, e.g. "clone" or "plan".
+        trace_id (str): The 32 hex digit identifier shared by all spans of a request.
+        span_id (str): The 16 hex digit identifier of the span.
+        parent_span_id (Optional[str]): The identifier of the enclosing span, None for the root span.
+        job_id (Optional[str]): The job or request the span belongs to.
+        start_time_ns (int): The UNIX time in nanoseconds at which the span started.
+        end_time_ns (int): The UNIX time in nanoseconds at which the span ended, 0 while it is running.
+        attributes (Dict[str, Any]): Details of the operation, e.g. the attempt number.
+        error (Optional[str]): The exception that ended the span, if any.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    job_id: Optional[str]
+    start_time_ns: int
+    end_time_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_otlp(self) -> dict:
+        """Return the span in the OTLP JSON encoding."""
+        attributes = {**self.attributes, **({"job.id": self.job_id} if self.job_id else {})}
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # internal
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanFileExporter:
+    """Writes finished spans to a file as OTLP JSON lines, one ExportTraceServiceRequest per line, in the format read
+    by the OpenTelemetry Collector's file receiver.
+
+    Spans are written by a background thread, so exporting never blocks the event loop.
+
+    Attributes:
+        path (str): The path of the file spans are appended to.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_spans, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        """Queue a finished span to be written."""
+        self._queue.put(span)
+
+    def close(self) -> None:
+        """Write all queued spans and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_spans(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]}
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                request = {"resourceSpans": [{
+                    "resource": resource,
+                    "scopeSpans": [{"scope": {"name": "tinygen"}, "spans": [span.to_otlp()]}],
+                }]}
+                try:
+                    file.write(json.dumps(request) + "\n")
+                    file.flush()
+                except (OSError, TypeError, ValueError):
+                    logger.exception("Failed to export span %s", span.name)
+
+
+span_exporter = SpanFileExporter(TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH else None
+if span_exporter is not None:
+    atexit.register(span_exporter.close)
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Time the enclosed block as a span of the current trace, whether it succeeds or raises.
+
+    The span is a child of the span enclosing it, including across tasks created within it, and is tagged with the
+    current job ID. Its duration is recorded in the stage timer and the stage duration histogram, and the span is
+    exported if TRACE_EXPORT_PATH is set.
+
+    Parameters:
+        name (str): The name of the stage, e.g. "clone" or "plan".
+        **attributes (Any): Details of the operation, e.g. the attempt number.
+
+    Yields:
+        Span: The running span, whose attributes may be added to.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_span_id=parent.span_id if parent else None,
+        job_id=current_job_id.get(),
+        start_time_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - start
+        current.end_time_ns = current.start_time_ns + int(duration * 1e9)
+        stage_timer.record(name, duration)
+        STAGE_DURATION.observe(duration, stage=name)
+        if span_exporter is not None:
+            span_exporter.export(current)
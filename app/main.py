@@ -1,10 +1,12 @@
-import logging
-import logging.config
-
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.api.router import api_router
+from app.common.logger import configure_logging
+from app.lib.metrics import metrics
+
+configure_logging()
 
 app = FastAPI()
 
@@ -18,32 +20,8 @@ app.add_middleware(
 
 app.include_router(api_router, prefix="/api/v1")
 
-logging_config = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "standard": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        }
-    },
-    "handlers": {
-        "console": {
-            "level": "INFO",
-            "formatter": "standard",
-            "class": "logging.StreamHandler",
-            "stream": "ext://sys.stdout",  
-        }
-    },
-    "root": {
-        "handlers": ["console"],
-        "level": "INFO", 
-    },
-    "loggers": {
-        "uvicorn": {
-            "handlers": ["console"],
-            "level": "INFO", 
-            "propagate": False,
-        },
-    },
-}
-logging.config.dictConfig(logging_config)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    """Expose the process metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
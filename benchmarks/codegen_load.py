@@ -0,0 +1,215 @@
+"""Load test the codegen API end to end against a synthetic repository and the fake LLM backend.
+
+Example:
+    python -m benchmarks.codegen_load --files 500 --requests 64 --concurrency 16 --output results.json
+
+Compare against the results of a previous version, failing if it got more than 20% slower:
+    python -m benchmarks.codegen_load --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.synthetic_repo import NOUNS, VERBS, create_synthetic_repo
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of the values, interpolating between the closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def peak_rss_bytes() -> int:
+    """Return the peak resident set size of this process."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, KiB elsewhere
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Point the app at the fake LLM backend and local storage. Must run before the app is imported, since settings
+    are read at import time."""
+    os.environ.update({
+        "LOG_LEVEL": args.log_level,  # the app logs every request at INFO
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY": str(args.llm_latency),
+        "LLM_FAKE_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "LLM_REQUESTS_PER_MINUTE": str(args.llm_requests_per_minute),
+        "LLM_TOKENS_PER_MINUTE": str(args.llm_tokens_per_minute),
+        "LLM_CACHE_ENABLED": "false",
+        "RESULT_CACHE_ENABLED": "false",
+        "CHECKPOINT_PATH": os.path.join(args.work_dir, "checkpoints.sqlite3"),
+        "ALLOW_LOCAL_REPOS": "true",
+        "REPO_CACHE_PATH": os.path.join(args.work_dir, "repo_cache"),
+        "PERSISTENCE_BACKEND": "sqlite",
+        "PERSISTENCE_SQLITE_PATH": os.path.join(args.work_dir, "benchmark.sqlite3"),
+        "PERSISTENCE_SPILL_PATH": os.path.join(args.work_dir, "persistence_spill.jsonl"),
+    })
+
+
+def generate_prompt(index: int) -> str:
+    # Distinct prompts, so identical requests are not coalesced
+    verb, noun = VERBS[index % len(VERBS)], NOUNS[index % len(NOUNS)]
+    return f"{verb.capitalize()} the {noun} records with audit logging #{index}"
+
+
+async def run_load(args: argparse.Namespace, repo_url: str) -> Dict:
+    import httpx
+
+    from app.lib.codegen.llm_backends import llm_backend
+    from app.lib.codegen.llm_scheduler import llm_scheduler
+    from app.lib.tracing import stage_timer
+    from app.main import app
+
+    async def request(client: httpx.AsyncClient, index: int) -> Optional[float]:
+        start = time.perf_counter()
+        response = await client.post("/api/v1/codegen/", json={"repoUrl": repo_url, "prompt": generate_prompt(index)})
+        if response.status_code != 200:
+            print(f"Request {index} failed with {response.status_code}: {response.text[:200]}", file=sys.stderr)
+            return None
+        return time.perf_counter() - start
+
+    await app.router.startup()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for index in range(args.warmup):  # fills the clone cache, so the measured requests only check it out
+            await request(client, -1 - index)
+        stage_timer.reset()
+        llm_calls = llm_backend.calls
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited_request(index: int) -> Optional[float]:
+            async with semaphore:
+                return await request(client, index)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(limited_request(index) for index in range(args.requests)))
+        duration = time.perf_counter() - start
+    await app.router.shutdown()  # flushes the persistence writer, so the persist stage is included
+
+    succeeded = [latency for latency in latencies if latency is not None]
+    return {
+        "requests": args.requests,
+        "errors": args.requests - len(succeeded),
+        "duration": duration,
+        "requests_per_second": len(succeeded) / duration if duration else 0.0,
+        "latency": {
+            "mean": sum(succeeded) / len(succeeded) if succeeded else 0.0,
+            "p50": percentile(succeeded, 50),
+            "p95": percentile(succeeded, 95),
+            "p99": percentile(succeeded, 99),
+            "max": max(succeeded, default=0.0),
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+        "llm_calls": llm_backend.calls - llm_calls,
+        "llm_scheduler": llm_scheduler.stats(),
+        "stages": stage_timer.summary(),
+    }
+
+
+def compare_to_baseline(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """List the metrics that regressed by more than `max_regression` (a fraction) compared to the baseline."""
+    regressions = []
+    for metric, current, previous in [
+        ("p95 latency", results["latency"]["p95"], baseline["results"]["latency"]["p95"]),
+        ("p99 latency", results["latency"]["p99"], baseline["results"]["latency"]["p99"]),
+        ("time per request", 1 / (results["requests_per_second"] or math.inf),
+         1 / (baseline["results"]["requests_per_second"] or math.inf)),
+    ]:
+        if previous and current > previous * (1 + max_regression):
+            regressions.append(f"{metric} regressed by {current / previous - 1:.0%}")
+    return regressions
+
+
+def print_report(results: Dict) -> None:
+    latency = results["latency"]
+    print(f"{results['requests'] - results['errors']}/{results['requests']} requests succeeded "
+          f"in {results['duration']:.2f}s ({results['requests_per_second']:.2f} requests/sec)")
+    print(f"latency p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s  "
+          f"max {latency['max']:.3f}s")
+    print(f"peak RSS {results['peak_rss_bytes'] / 1024 ** 2:.1f} MiB, {results['llm_calls']} LLM calls")
+    for name, stage in sorted(results["stages"].items(), key=lambda item: -item[1]["total"]):
+        print(f"  {name:<10} {stage['count']:>6} runs  total {stage['total']:8.3f}s  mean {stage['mean']:.4f}s  "
+              f"max {stage['max']:.4f}s")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="number of files in the synthetic repository")
+    parser.add_argument("--lines-per-file", type=int, default=120, help="approximate lines per synthetic file")
+    parser.add_argument("--requests", type=int, default=32, help="number of measured requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of requests in flight")
+    parser.add_argument("--warmup", type=int, default=1, help="number of unmeasured requests sent first")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM latency in seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200, help="fake LLM completion throughput")
+    parser.add_argument("--llm-requests-per-minute", type=int, default=0, help="LLM rate limit, 0 for none")
+    parser.add_argument("--llm-tokens-per-minute", type=int, default=0, help="LLM token rate limit, 0 for none")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic repository")
+    parser.add_argument("--log-level", default="WARNING", help="level of the app's log output")
+    parser.add_argument("--work-dir", help="directory for the repositories and caches (default: a temporary one)")
+    parser.add_argument("--output", help="path of the JSON results file")
+    parser.add_argument("--baseline", help="path of a previous JSON results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed slowdown against the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.work_dir is None:
+        args.work_dir = tempfile.mkdtemp(prefix="tinygen-benchmark-")
+    os.makedirs(args.work_dir, exist_ok=True)
+    configure_environment(args)
+
+    repo_url = create_synthetic_repo(args.work_dir, args.files, args.lines_per_file, args.seed)
+    results = asyncio.run(run_load(args, repo_url))
+    print_report(results)
+
+    report = {
+        "benchmark": "codegen_load",
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "baseline", "work_dir", "log_level")
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_to_baseline(results, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
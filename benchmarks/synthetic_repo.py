@@ -0,0 +1,88 @@
+import os
+import random
+import subprocess
+from typing import List
+
+PACKAGES = ["api", "core", "models", "services", "utils", "storage", "auth", "billing"]
+NOUNS = ["user", "order", "invoice", "session", "payment", "report", "account", "event", "profile", "token"]
+VERBS = ["load", "save", "validate", "render", "sync", "parse", "update", "delete", "fetch", "build"]
+
+
+def _git(args: List[str], cwd: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@example.com", *args],
+        cwd=cwd, check=True, capture_output=True
+    )
+
+
+def _module_source(rng: random.Random, module: str, imports: List[str], lines: int) -> str:
+    source = [f'"""The {module} module."""', ""]
+    source.extend(f"from {name} import {name.rsplit('.', 1)[-1]}_helper" for name in imports)
+    source.append("")
+    definition = 0
+    while len(source) < lines:
+        noun, verb = rng.choice(NOUNS), rng.choice(VERBS)
+        if definition % 3 == 2:
+            source.extend([
+                "", "",
+                f"class {noun.capitalize()}{verb.capitalize()}er{definition}:",
+                f'    """{verb.capitalize()}s {noun}s."""',
+                "",
+                "    def __init__(self, limit: int = 10):",
+                "        self.limit = limit",
+                "",
+                f"    def {verb}(self, {noun}_id: int) -> dict:",
+                f"        return {{'{noun}_id': {noun}_id, 'limit': self.limit}}",
+            ])
+        else:
+            source.extend([
+                "", "",
+                f"def {verb}_{noun}_{definition}({noun}_id: int, retries: int = 3) -> bool:",
+                f'    """{verb.capitalize()} a {noun} by its identifier."""',
+                "    for attempt in range(retries):",
+                f"        if {noun}_id % (attempt + 2) == 0:",
+                "            return True",
+                "    return False",
+            ])
+        definition += 1
+    source.extend(["", "", f"def {module}_helper(value):", "    return value", ""])
+    return "\n".join(source)
+
+
+def create_synthetic_repo(work_dir: str, files: int, lines_per_file: int = 120, seed: int = 0) -> str:
+    """Create a bare git repository of synthetic Python modules that import and call each other.
+
+    The same arguments always produce the same repository, which is reused if it already exists.
+
+    Args:
+        work_dir (str): The directory the repository is created in.
+        files (int): The number of source files.
+        lines_per_file (int, optional): The approximate number of lines per file. Defaults to 120.
+        seed (int, optional): The seed of the generated contents. Defaults to 0.
+
+    Returns:
+        str: The file:// URL of the bare repository.
+    """
+    name = f"synthetic-{files}x{lines_per_file}-{seed}"
+    bare_dir = os.path.abspath(os.path.join(work_dir, f"{name}.git"))
+    if os.path.isdir(bare_dir):
+        return f"file://{bare_dir}"
+
+    source_dir = os.path.join(work_dir, name)
+    os.makedirs(source_dir)
+    rng = random.Random(seed)
+    modules = [f"app.{PACKAGES[i % len(PACKAGES)]}.{rng.choice(NOUNS)}_{i}" for i in range(files)]
+    for i, module in enumerate(modules):
+        path = os.path.join(source_dir, *module.split(".")) + ".py"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        imports = rng.sample(modules[:i], min(i, 2))
+        with open(path, "w") as file:
+            file.write(_module_source(rng, module.rsplit(".", 1)[-1], imports, lines_per_file))
+    with open(os.path.join(source_dir, "README.md"), "w") as file:
+        file.write(f"# {name}\n\nA synthetic repository with {files} modules for benchmarking.\n")
+
+    _git(["init", "--quiet"], source_dir)
+    _git(["add", "-A"], source_dir)
+    _git(["commit", "--quiet", "-m", "Synthetic repository"], source_dir)
+    _git(["clone", "--bare", "--quiet", source_dir, bare_dir], work_dir)
+    return f"file://{bare_dir}"
@@ -0,0 +1,46 @@
+import asyncio
+from unittest.mock import patch
+
+from app.lib.codegen.checkpoints import CheckpointStore
+
+
+def test_checkpoint_store_saves_and_replaces_values(tmp_path):
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"))
+
+    async def run():
+        await store.save("run1", {"file_map": {"rendered": "a.py"}, "candidate/0": {"attempts": 1}})
+        await store.save("run1", {"candidate/0": {"attempts": 2}})
+        await store.save("run2", {"file_map": None})
+        return await store.load("run1"), await store.load("run2"), await store.load("run3")
+
+    run1, run2, run3 = asyncio.run(run())
+
+    assert run1 == {"file_map": {"rendered": "a.py"}, "candidate/0": {"attempts": 2}}
+    assert run2 == {"file_map": None}
+    assert run3 == {}
+
+
+def test_checkpoint_store_deletes_finished_and_expired_runs(tmp_path):
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"), ttl=60)
+
+    async def run():
+        with patch('app.lib.codegen.checkpoints.time.time', return_value=1000):
+            await store.save("old", {"file_map": "old"})
+        await store.save("finished", {"file_map": "finished"})
+        await store.delete("finished")
+        return await store.load("old"), await store.load("finished")
+
+    assert asyncio.run(run()) == ({}, {})
+
+
+def test_checkpoint_store_disabled_or_unavailable(tmp_path):
+    disabled = CheckpointStore(enabled=False, path=str(tmp_path / "checkpoints.sqlite3"))
+    unavailable = CheckpointStore(path=str(tmp_path / "missing" / "checkpoints.sqlite3"))
+
+    async def run():
+        for store in (disabled, unavailable):
+            await store.save("run", {"file_map": "a.py"})
+        return await disabled.load("run"), await unavailable.load("run")
+
+    assert asyncio.run(run()) == ({}, {})
+    assert not (tmp_path / "checkpoints.sqlite3").exists()
@@ -0,0 +1,112 @@
+import subprocess
+
+from app.lib.codegen.diff import check_file_diff, checkout_reader, parse_diff, validate_chunk_diffs
+from app.lib.filesystem import FileRecord
+
+FILE_CONTENT = "a\nb\nc\n\nd\ne\nf\ng\n"
+
+
+def test_parse_diff_is_lenient():
+    text = (
+        "Here is the diff:\n```diff\n"
+        "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n"
+        "@@ -2,9 +2,9 @@ def main():\n b\n+B\n\n c\n```\n"  # wrong counts, and a blank context line without a space
+        "--- /dev/null\n+++ b/new.py\n@@ -0,0 +1 @@\n+hello\n"
+    )
+
+    file_diffs = parse_diff(text, chunk_index=3)
+
+    assert [(file_diff.old_path, file_diff.new_path) for file_diff in file_diffs] == [
+        ("x.py", "x.py"), (None, "new.py")
+    ]
+    hunk = file_diffs[0].hunks[0]
+    assert hunk.lines == [" b", "+B", " ", " c"]
+    assert hunk.header == "@@ -2,3 +2,4 @@ def main():"
+    assert hunk.chunk_index == 3
+    assert file_diffs[1].hunks[0].header == "@@ -0,0 +1,1 @@"
+
+
+def test_parse_diff_drops_trailing_blank_lines():
+    file_diffs = parse_diff("--- a/x.py\n+++ b/x.py\n@@ -1,3 +1,3 @@\n-a\n+A\n b\n\n\n")
+
+    assert file_diffs[0].hunks[0].lines == ["-a", "+A", " b"]
+
+
+def test_file_diff_render_elides_context_and_summarize():
+    [file_diff] = parse_diff(
+        "--- a/x.py\n+++ b/x.py\n@@ -1,7 +1,7 @@ def main():\n a\n b\n c\n-d\n+D\n e\n f\n g\n"
+    )
+
+    assert file_diff.render(context_lines=1).splitlines()[3:] == [
+        "@@ -1,7 +1,7 @@ def main():", " ... (2 unchanged lines)", " c", "-d", "+D", " e", " ... (2 unchanged lines)"
+    ]
+    assert file_diff.summarize() == "x.py: modified, +1 -1 lines in 1 hunks (def main():)"
+
+
+def test_check_file_diff_relocates_hunks_and_adds_trailing_context():
+    [file_diff] = parse_diff("--- a/x.py\n+++ b/x.py\n@@ -9,2 +9,2 @@\n e  \n-f\n+F\n")
+
+    checked, failures = check_file_diff(file_diff, FILE_CONTENT)
+
+    assert failures == []
+    assert checked.render() == (
+        "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n@@ -6,3 +6,3 @@\n e\n-f\n+F\n g"
+    )
+
+
+def test_check_file_diff_reports_failures():
+    [file_diff] = parse_diff("--- a/x.py\n+++ b/x.py\n@@ -1 +1 @@\n-z\n+Z\n@@ -2 +2 @@\n-b\n+B\n")
+    checked, failures = check_file_diff(file_diff, FILE_CONTENT)
+    assert [hunk.header for hunk in checked.hunks] == ["@@ -2,2 +2,2 @@"]
+    assert [failure.describe() for failure in failures] == [
+        "x.py @@ -1,1 +1,1 @@: context or removed lines not found"
+    ]
+
+    _, failures = check_file_diff(file_diff, None)
+    assert {failure.reason for failure in failures} == {"the file does not exist"}
+
+    [new_file] = parse_diff("--- /dev/null\n+++ b/x.py\n@@ -0,0 +1 @@\n+hello\n")
+    _, failures = check_file_diff(new_file, FILE_CONTENT)
+    assert [failure.reason for failure in failures] == ["the file already exists"]
+
+
+def test_validate_chunk_diffs_merges_files_across_chunks(tmp_path):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / "x.py").write_text(FILE_CONTENT)
+    chunk_diffs = [
+        "diff --git a/x.py b/x.py\n--- a/x.py\n+++ b/x.py\n@@ -6,2 +6,2 @@\n e\n-f\n+F\n",
+        "--- a/x.py\n+++ b/x.py\n@@ -1,2 +1,3 @@\n a\n+A\n b\n--- /dev/null\n+++ b/y.py\n@@ -0,0 +1 @@\n+y\n",
+        "--- a/x.py\n+++ b/x.py\n@@ -1,2 +1,3 @@\n a\n+A\n b\n",  # a duplicate of the hunk above
+        "--- a/x.py\n+++ b/x.py\n@@ -7 +7 @@\n-f\n+f2\n",  # conflicts with the first chunk
+        "I could not generate a diff.",
+        None,
+        "",
+    ]
+
+    validation = validate_chunk_diffs(chunk_diffs, checkout_reader(str(tmp_path), []))
+
+    merged = validation.render()
+    assert merged.count("diff --git a/x.py b/x.py") == 1
+    assert [failure.reason for failure in validation.failures] == [
+        "the output is not a unified diff", "overlaps an earlier hunk"
+    ]
+    assert validation.failed_chunks == [3, 4]
+    (tmp_path / "merged.diff").write_text(merged)
+    subprocess.run(["git", "apply", "merged.diff"], cwd=tmp_path, check=True)
+    assert (tmp_path / "x.py").read_text() == "a\nA\nb\nc\n\nd\ne\nF\ng\n"
+    assert (tmp_path / "y.py").read_text() == "y\n"
+
+
+def test_checkout_reader_prefers_fetched_files(tmp_path):
+    (tmp_path / "on_disk.py").write_text("disk")
+    (tmp_path.parent / "outside.py").write_text("secret")
+    read_file = checkout_reader(str(tmp_path), [
+        FileRecord(path="fetched.py", content="memory", size=6, sha="abc"),
+        FileRecord(path="new.py", content="", size=0, sha=None),
+    ])
+
+    assert read_file("fetched.py") == "memory"
+    assert read_file("new.py") is None
+    assert read_file("on_disk.py") == "disk"
+    assert read_file("missing.py") is None
+    assert read_file("../outside.py") is None
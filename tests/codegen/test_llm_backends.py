@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import openai
+import pytest
+
+from app.common.exceptions import ApiError
+from app.lib.codegen.llm_backends import FakeLLMBackend, OpenAIBackend
+from app.lib.codegen.planner import CodeGenPlanner
+from app.lib.codegen.utils import FILE_HEADER
+from app.lib.codegen.worker import CodeGenWorker
+
+sample_messages = [{"role": "user", "content": "Generate a code diff"}]
+sample_function_call = {"name": "get_codegen_code_diff"}
+
+
+def test_fake_backend_simulates_latency_and_throughput():
+    backend = FakeLLMBackend(latency=0.1, latency_jitter=0, tokens_per_second=0,
+                             responses={"get_codegen_code_diff": {"code_diff": "x"}})
+
+    start = time.monotonic()
+    response = asyncio.run(backend.create_function_call("gpt-4", sample_messages, [], sample_function_call))
+
+    assert 0.1 <= time.monotonic() - start < 0.5
+    assert json.loads(response.arguments) == {"code_diff": "x"}
+    assert response.total_tokens > 0
+    assert backend.calls == 1
+
+    with pytest.raises(ApiError, match="No fake LLM response for unknown"):
+        asyncio.run(backend.create_function_call("gpt-4", sample_messages, [], {"name": "unknown"}))
+
+
+@pytest.fixture
+def fake_backend():
+    backend = FakeLLMBackend(latency=0, tokens_per_second=0)
+    with patch('app.lib.codegen.llm.llm_backend', backend):
+        yield backend
+
+
+def test_fake_backend_drives_planner_and_worker(fake_backend):
+    planner = CodeGenPlanner("Log startup", "src/\n  main.py", "", [], "gpt-4", ["src/main.py", "README.md"])
+    review, plan = asyncio.run(planner.review_and_plan())
+
+    assert review is None  # nothing to review before the first code diff
+    assert plan.file_paths == ["src/main.py", "README.md"]
+
+    chunk = FILE_HEADER.format(path="src/main.py") + "print('hello')\n"
+    code_diff = asyncio.run(CodeGenWorker(chunk, plan.steps, "gpt-4").generate_code_diff())
+
+    assert code_diff.splitlines()[-3:] == ["@@ -1,1 +1,2 @@", "+# Generated change", " print('hello')"]
+
+    planner = CodeGenPlanner("Log startup", "src/\n  main.py", code_diff, plan.steps, "gpt-4")
+    review, plan = asyncio.run(planner.review_and_plan())
+
+    assert review.score == 8
+    assert plan is None
+    assert fake_backend.calls == 3
+
+
+def test_openai_backend_reads_api_key_lazily_and_pools_connections():
+    backend = OpenAIBackend()
+    sessions = []
+
+    async def acreate(**kwargs):
+        sessions.append((openai.aiosession.get(), kwargs["api_key"]))
+        return Mock(choices=[{"message": {"function_call": {"arguments": "{}"}}}])
+
+    async def run():
+        with patch('openai.ChatCompletion.acreate', new=AsyncMock(side_effect=acreate)):
+            for _ in range(2):
+                await backend.create_function_call("gpt-4", sample_messages, [], sample_function_call)
+        await backend.close()
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}):
+        asyncio.run(run())
+
+    assert sessions[0][0] is not None
+    assert sessions[0] == sessions[1]
+    assert sessions[0][1] == "sk-test"
+    assert openai.aiosession.get() is None
+
+
+def test_openai_backend_closes_the_session_of_a_previous_event_loop():
+    backend = OpenAIBackend(api_key="test")
+
+    first = asyncio.run(backend._get_session())
+    second = asyncio.run(backend._get_session())
+    asyncio.run(backend.close())
+
+    assert first is not second
+    assert first.closed and second.closed
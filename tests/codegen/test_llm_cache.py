@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from app.common.exceptions import ApiError
+from app.lib.codegen.llm import create_function_call
+from app.lib.codegen.llm_cache import LLMResponseCache, generate_llm_cache_key
+
+sample_messages = [{"role": "user", "content": "Generate a code diff"}]
+sample_function = {"name": "get_codegen_code_diff", "description": "", "parameters": {}}
+sample_arguments = json.dumps({"code_diff": "New content here"})
+
+mock_response_with_data = Mock(choices=[{"message": {"function_call": {"arguments": sample_arguments}}}])
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMResponseCache(cache_path=str(tmp_path / "llm_cache"))
+
+
+def test_cache_key_depends_on_full_request():
+    key = generate_llm_cache_key("gpt-4", sample_messages, [sample_function], {"name": "get_codegen_code_diff"})
+
+    assert key == generate_llm_cache_key("gpt-4", sample_messages, [sample_function], {"name": "get_codegen_code_diff"})
+    assert key != generate_llm_cache_key("gpt-3.5-turbo", sample_messages, [sample_function], {"name": "x"})
+    assert key != generate_llm_cache_key("gpt-4", [], [sample_function], {"name": "get_codegen_code_diff"})
+
+
+def test_memory_and_disk_tiers(cache, tmp_path):
+    asyncio.run(cache.set("key", "value"))
+    assert asyncio.run(cache.get("key")) == "value"
+
+    cold_cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"))
+    assert asyncio.run(cold_cache.get("key")) == "value"
+    assert asyncio.run(cold_cache.get("key")) == "value"
+    assert asyncio.run(cold_cache.get("missing")) is None
+
+    assert cache.stats()["memory_hits"] == 1
+    assert cold_cache.stats() == {"memory_hits": 1, "disk_hits": 1, "misses": 1, "hit_rate": 2 / 3}
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"), ttl=0)
+    asyncio.run(cache.set("key", "value"))
+
+    assert asyncio.run(cache.get("key")) is None
+    assert not os.path.exists(cache._entry_path("key"))
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"), memory_entries=2)
+    for key in ["a", "b", "c"]:
+        asyncio.run(cache.set(key, key))
+
+    assert list(cache._memory) == ["b", "c"]
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"), disk_max_bytes=200)
+    for key in ["a", "b", "c", "d", "e"]:
+        asyncio.run(cache.set(key, "x" * 50))
+        os.utime(cache._entry_path(key), (0, ord(key)))  # make last-use order deterministic
+
+    assert not os.path.exists(cache._entry_path("a"))
+    assert os.path.exists(cache._entry_path("e"))
+
+
+def test_overwriting_an_entry_does_not_grow_the_disk_tier(tmp_path):
+    cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"), disk_max_bytes=200)
+    asyncio.run(cache.set("a", "x" * 50))
+    asyncio.run(cache.set("b", "x" * 50))
+    for _ in range(5):
+        asyncio.run(cache.set("b", "y" * 50))
+
+    cache_dir = tmp_path / "llm_cache"
+    assert cache._disk_bytes == sum(os.path.getsize(path) for path in cache_dir.rglob("*.json"))
+    assert os.path.exists(cache._entry_path("a"))
+    assert os.listdir(os.path.dirname(cache._entry_path("b"))) == ["b.json"]  # no temp files are left behind
+
+
+@patch('openai.ChatCompletion.acreate', return_value=mock_response_with_data)
+def test_create_function_call_uses_cache(mock_openai, cache):
+    with patch('app.lib.codegen.llm.llm_cache', cache):
+        first = asyncio.run(create_function_call("gpt-4", sample_messages, sample_function))
+        second = asyncio.run(create_function_call("gpt-4", sample_messages, sample_function))
+
+    assert first == second == sample_arguments
+    mock_openai.assert_called_once()
+
+
+@patch('openai.ChatCompletion.acreate', new_callable=AsyncMock)
+def test_create_function_call_does_not_cache_invalid_json(mock_openai, cache):
+    mock_openai.return_value = Mock(choices=[{"message": {"function_call": {"arguments": "{not json"}}}])
+    with patch('app.lib.codegen.llm.llm_cache', cache):
+        asyncio.run(create_function_call("gpt-4", sample_messages, sample_function))
+        asyncio.run(create_function_call("gpt-4", sample_messages, sample_function))
+
+    assert mock_openai.call_count == 2
+
+
+@patch('openai.ChatCompletion.acreate', new_callable=AsyncMock)
+def test_create_function_call_offline(mock_openai, tmp_path):
+    offline_cache = LLMResponseCache(cache_path=str(tmp_path / "llm_cache"), offline=True)
+    with patch('app.lib.codegen.llm.llm_cache', offline_cache):
+        with pytest.raises(ApiError, match="not found in offline cache"):
+            asyncio.run(create_function_call("gpt-4", sample_messages, sample_function))
+
+    mock_openai.assert_not_called()
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+import openai
+import pytest
+from aiohttp import web
+
+from app.common.context import current_job_id
+from app.lib.codegen.llm import LLM_TOKENS, create_function_call
+from app.lib.codegen.llm_backends import OpenAIBackend
+from app.lib.codegen.llm_scheduler import LLMPriority, LLMScheduler, TokenBucket
+
+sample_messages = [{"role": "user", "content": "Generate a code diff"}]
+sample_function = {"name": "get_codegen_code_diff", "description": "", "parameters": {}}
+sample_arguments = json.dumps({"code_diff": "New content here"})
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(60, clock=lambda: now[0])
+
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    now[0] = 30.0
+    assert bucket.wait_time(30) == 0.0
+    bucket.consume(40)  # overdrawn, e.g. after correcting an estimate
+    assert bucket.wait_time(1) == pytest.approx(11.0)
+    assert bucket.wait_time(1000) == pytest.approx(70.0)  # requests larger than the capacity wait for a full bucket
+
+
+def record_order(scheduler, order, name, priority=LLMPriority.WORKER, job_id=None):
+    async def call():
+        order.append(name)
+
+    async def run():
+        if job_id:
+            current_job_id.set(job_id)
+        await scheduler.run(call, priority)
+    return asyncio.create_task(run())
+
+
+def test_dispatches_by_priority_then_round_robin_across_jobs():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        order = []
+        release = asyncio.Event()
+        blocker = asyncio.create_task(scheduler.run(release.wait))
+        await asyncio.sleep(0)
+        tasks = [
+            record_order(scheduler, order, "a1", job_id="a"),
+            record_order(scheduler, order, "a2", job_id="a"),
+            record_order(scheduler, order, "a3", job_id="a"),
+            record_order(scheduler, order, "b1", job_id="b"),
+            record_order(scheduler, order, "plan", LLMPriority.PLANNER, job_id="c"),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.queued() == 5
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        return scheduler, order
+
+    scheduler, order = asyncio.run(run())
+
+    assert order == ["plan", "a1", "b1", "a2", "a3"]
+    assert scheduler.stats()["wait"]["worker"]["count"] == 5
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_tokens_per_minute_limit_delays_calls():
+    async def noop():
+        return None
+
+    async def run():
+        scheduler = LLMScheduler(tokens_per_minute=6000)  # refills 100 tokens per second
+        await scheduler.run(noop, estimated_tokens=6000)
+        start = time.monotonic()
+        await scheduler.run(noop, estimated_tokens=30)
+        return time.monotonic() - start, scheduler
+
+    elapsed, scheduler = asyncio.run(run())
+
+    assert 0.2 <= elapsed < 1
+    assert scheduler.stats()["wait"]["worker"]["max"] >= 0.2
+
+
+def test_cancelled_calls_leave_the_queue():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(scheduler.run(release.wait))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(scheduler.run(release.wait))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert scheduler.queued() == 0
+        release.set()
+        await blocker
+        return scheduler
+
+    assert asyncio.run(run()).stats()["in_flight"] == 0
+
+
+def test_errors_that_are_not_rate_limits_are_not_retried():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise openai.error.InvalidRequestError("bad request", None)
+
+    scheduler = LLMScheduler(retry_base_delay=0)
+    with pytest.raises(openai.error.InvalidRequestError):
+        asyncio.run(scheduler.run(call))
+
+    assert len(calls) == 1
+    assert scheduler.retries == 0
+
+
+def test_timeout_counts_from_dispatch():
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        blocker = asyncio.create_task(scheduler.run(lambda: asyncio.sleep(0.1)))
+        await asyncio.sleep(0)
+        queued = await scheduler.run(lambda: asyncio.sleep(0.01, result="done"), timeout=0.05)
+        await blocker
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.run(lambda: asyncio.sleep(1), timeout=0.05)
+        return queued, scheduler
+
+    queued, scheduler = asyncio.run(run())
+
+    assert queued == "done"  # waited 0.1s for the slot, longer than its timeout
+    assert scheduler.retries == 0
+    assert scheduler.stats()["in_flight"] == 0
+
+
+@pytest.fixture
+def completion_server():
+    """A fake local chat completion server that rate limits the first request and fails the second."""
+    requests = []
+
+    async def chat_completions(request):
+        requests.append(await request.json())
+        if len(requests) == 1:
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status=429, headers={"Retry-After": "0.1"}
+            )
+        if len(requests) == 2:
+            return web.json_response({"error": {"message": "Bad gateway", "type": "server_error"}}, status=502)
+        return web.json_response({
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None, "function_call": {
+                    "name": sample_function["name"], "arguments": sample_arguments
+                }},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app, requests
+
+
+def test_create_function_call_retries_against_completion_server(completion_server):
+    app, requests = completion_server
+    scheduler = LLMScheduler(retry_base_delay=0.01)
+    backend = OpenAIBackend(api_key="test")
+
+    async def run():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            with patch('openai.api_base', f"http://127.0.0.1:{port}/v1"), \
+                    patch('app.lib.codegen.llm.llm_backend', backend), \
+                    patch('app.lib.codegen.llm.llm_scheduler', scheduler):
+                return await create_function_call("gpt-4", sample_messages, sample_function)
+        finally:
+            await backend.close()
+            await runner.cleanup()
+
+    tokens_in = LLM_TOKENS.value(function=sample_function["name"], direction="in")
+
+    assert asyncio.run(run()) == sample_arguments
+    assert LLM_TOKENS.value(function=sample_function["name"], direction="in") == tokens_in + 10
+    assert len(requests) == 3
+    assert requests[0]["messages"] == sample_messages
+    assert scheduler.retries == 2
+    assert scheduler.rate_limited == 1
@@ -1,7 +1,23 @@
+import asyncio
 import pytest
-from unittest.mock import patch, Mock
-from app.lib.codegen.models import CodeGenPlan, CodeGenReview, CodeGenHistoryItem, CodeGenResult
-from app.lib.codegen.orchestrator import CodeGenOrchestrator
+from unittest.mock import patch, AsyncMock, Mock
+from app.common.exceptions import ApiError
+from app.lib.codegen.checkpoints import CheckpointStore
+from app.lib.codegen.llm import LLMUsage, current_llm_usage
+from app.lib.codegen.models import CodeGenHistoryItem, CodeGenPlan, CodeGenReview, CodeGenResult
+from app.lib.codegen.orchestrator import (
+    CODEGEN_ATTEMPTS,
+    CODEGEN_REQUESTS,
+    DIFF_REPAIRS,
+    WORKER_CHUNKS,
+    CodeGenCandidate,
+    CodeGenOrchestrator,
+    best_reviewed_code_diff,
+)
+from app.lib.codegen.result_cache import ResultCache
+from app.lib.file_index import FileIndex, FileIndexEntry
+from app.lib.filesystem import FileRecord
+from app.lib.symbols import Symbol
 
 # Mock successful review and plan
 mock_review = CodeGenReview(score=9, comment="Good job!")
@@ -10,52 +26,489 @@ mock_plan = CodeGenPlan(steps=["Step1"], file_paths=["path1"])
 # Mock unsuccessful review
 mock_unsuccessful_review = CodeGenReview(score=2, comment="Needs improvement!")
 
+# Mock plan for which the planner could not determine any steps
+mock_empty_plan = CodeGenPlan(steps=[], file_paths=[])
+
 # Mock fetch_files
-mock_files = "some file content"
+mock_files = [FileRecord(path="path1", content="some file content", size=17, sha="abc123")]
+
+# Mock worker code diff, which applies to mock_files
+mock_code_diff = (
+    "diff --git a/path1 b/path1\n--- a/path1\n+++ b/path1\n"
+    "@@ -1,1 +1,2 @@\n some file content\n+added line\n"
+)
 
-# Mock fetch_file_map
-mock_file_map = {"path1": "file1"}
+# Mock build_file_index
+mock_file_index = FileIndex([FileIndexEntry(path="path1", size=5, language=None)])
 
 
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
 @patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
-@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents')
-@patch('app.lib.codegen.orchestrator.fetch_file_map', return_value=mock_file_map)
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
 @patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
 @patch('app.lib.codegen.orchestrator.CodeGenWorker')
 @patch('app.lib.codegen.orchestrator.CodeGenPlanner')
 def test_generate_code_diff_success(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
-                                    mock_fetch_file_map, mock_fetch_github_repo_contents, mock_prepare_temp_dir):
+                                    mock_build_file_index, mock_fetch_github_repo_contents, mock_prepare_temp_dir,
+                                    mock_remove_temp_dir):
     # Setup
-    mockCodeGenPlanner.return_value.review_and_plan.return_value = (mock_review, mock_plan)
-    mockCodeGenWorker.return_value.generate_code_diff.return_value = "generated code"
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=[(None, mock_plan), (mock_review, None)])
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
     orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "generate function to add numbers")
+    attempts, succeeded = CODEGEN_ATTEMPTS.value(), CODEGEN_REQUESTS.value(outcome="succeeded")
 
     # Run
-    result = orchestrator.generate_code_diff()
+    result = asyncio.run(orchestrator.generate_code_diff())
 
     # Validate
     assert isinstance(result, CodeGenResult)
     assert result.exceeded_max_attempts is False
+    assert result.code_diff == mock_code_diff
+    assert CODEGEN_ATTEMPTS.value() == attempts + 2
+    assert CODEGEN_REQUESTS.value(outcome="succeeded") == succeeded + 1
     assert len(result.history) == 2  # Initial and final history item
+    mock_remove_temp_dir.assert_called_once_with("/tmp/repo")
+    mock_build_file_index.assert_awaited_once()  # the index is reused across planning attempts
+    assert mockCodeGenPlanner.call_args.args[1] == mock_file_index.rendered
 
 
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
 @patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
-@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents')
-@patch('app.lib.codegen.orchestrator.fetch_file_map', return_value=mock_file_map)
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
 @patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
 @patch('app.lib.codegen.orchestrator.CodeGenWorker')
 @patch('app.lib.codegen.orchestrator.CodeGenPlanner')
 def test_generate_code_diff_failure(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
-                                    mock_fetch_file_map, mock_fetch_github_repo_contents, mock_prepare_temp_dir):
+                                    mock_build_file_index, mock_fetch_github_repo_contents, mock_prepare_temp_dir,
+                                    mock_remove_temp_dir):
     # Setup
-    mockCodeGenPlanner.return_value.review_and_plan.return_value = (mock_unsuccessful_review, mock_plan)
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(return_value=(None, mock_empty_plan))
     orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "generate function to add numbers")
 
     # Run
-    result = orchestrator.generate_code_diff()
+    result = asyncio.run(orchestrator.generate_code_diff())
 
     # Validate
     assert isinstance(result, CodeGenResult)
     assert result.exceeded_max_attempts is False
+    assert result.code_diff == ""
     assert len(result.history) == 1  # Only the final history item
+    mockCodeGenWorker.assert_not_called()
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_exceeds_max_attempts(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                                 mock_build_file_index, mock_fetch_github_repo_contents,
+                                                 mock_prepare_temp_dir, mock_remove_temp_dir):
+    # Setup
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(return_value=(mock_unsuccessful_review, mock_plan))
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "generate function to add numbers")
+
+    # Run
+    result = asyncio.run(orchestrator.generate_code_diff())
+
+    # Validate
+    assert isinstance(result, CodeGenResult)
+    assert result.exceeded_max_attempts is True
+    assert result.code_diff == mock_code_diff
+
+
+def test_generate_code_diff_does_not_block_event_loop():
+    async def run_concurrently():
+        release = asyncio.Event()
+
+        async def slow_fetch(repo_url, temp_dir, mode, commit):
+            await release.wait()
+
+        with patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo"), \
+                patch('app.lib.codegen.orchestrator.remove_temp_dir'), \
+                patch('app.lib.codegen.orchestrator.build_file_index', return_value=mock_file_index), \
+                patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', side_effect=slow_fetch), \
+                patch('app.lib.codegen.orchestrator.CodeGenPlanner') as mockCodeGenPlanner:
+            mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(return_value=(None, mock_empty_plan))
+            orchestrators = [CodeGenOrchestrator("https://github.com/user/repo", f"prompt {i}") for i in range(3)]
+            tasks = [asyncio.create_task(orchestrator.generate_code_diff()) for orchestrator in orchestrators]
+            await asyncio.sleep(0.01)
+            assert not any(task.done() for task in tasks)  # all requests are in flight at the same time
+            release.set()
+            return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run_concurrently())
+
+    assert len(results) == 3
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_returns_first_finished_candidate(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                                             mock_build_file_index, mock_fetch_github_repo_contents,
+                                                             mock_prepare_temp_dir, mock_remove_temp_dir):
+    # Setup: the primary candidate stalls, the second plans, is accepted and wins
+    cancelled = []
+    second_candidate_responses = iter([(None, mock_plan), (mock_review, None)])
+
+    async def review_and_plan(use_cache):
+        if use_cache:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return next(second_candidate_responses)
+
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=review_and_plan)
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
+    events = []
+
+    async def event_handler(event):
+        events.append(event)
+
+    orchestrator = CodeGenOrchestrator(
+        "https://github.com/user/repo", "generate function to add numbers", candidates=2, event_handler=event_handler
+    )
+
+    # Run
+    result = asyncio.run(orchestrator.generate_code_diff())
+
+    # Validate
+    assert result.exceeded_max_attempts is False
+    assert result.code_diff == mock_code_diff
+    assert len(result.history) == 2
+    assert cancelled == [True]
+    assert {event.data["candidate"] for event in events if event.event != "result"} == {1}
+    assert "candidate" not in events[-1].data
+
+
+def test_extra_candidates_stop_at_token_budget():
+    orchestrator = CodeGenOrchestrator(
+        "https://github.com/user/repo", "prompt", candidates=2, candidate_token_budget=100
+    )
+
+    async def run(index):
+        token = current_llm_usage.set(LLMUsage(calls=3, tokens=150))
+        try:
+            return await orchestrator.run_candidate(CodeGenCandidate(index), "/tmp/repo", "", [], None)
+        finally:
+            current_llm_usage.reset(token)
+
+    with patch('app.lib.codegen.orchestrator.CodeGenPlanner') as mockCodeGenPlanner:
+        mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(return_value=(None, mock_empty_plan))
+        extra, primary = asyncio.run(run(1)), asyncio.run(run(0))
+
+    assert (extra.attempts, extra.finished) == (0, False)
+    assert (primary.attempts, primary.finished) == (1, True)
+
+
+def test_best_reviewed_code_diff():
+    def item(score, code_diff):
+        review = CodeGenReview(score=score, comment="") if score is not None else None
+        return CodeGenHistoryItem(plan=None, review=review, code_diff=code_diff)
+
+    # Newest first: each review is of the code diff of the item after it
+    history = [item(6, "diff 3"), item(6, "diff 2"), item(4, "diff 1"), item(None, None)]
+
+    assert best_reviewed_code_diff(history) == (6, "diff 2")
+    assert best_reviewed_code_diff(history[:1]) == (-1, None)
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_generate_chunk_diffs_bounded_and_ordered(mockCodeGenWorker):
+    in_flight = 0
+    max_in_flight = 0
+
+    async def generate(content_chunk):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01 * (5 - int(content_chunk)))  # later chunks finish first
+        in_flight -= 1
+        return f"diff {content_chunk}"
+
+    mockCodeGenWorker.side_effect = lambda content_chunk, steps, model, related_definitions, timeout: Mock(
+        generate_code_diff=lambda: generate(content_chunk)
+    )
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt", worker_concurrency=2)
+
+    code_diff_chunks = asyncio.run(orchestrator.generate_chunk_diffs(["1", "2", "3", "4"], ["Step1"]))
+
+    assert code_diff_chunks == ["diff 1", "diff 2", "diff 3", "diff 4"]
+    assert max_in_flight == 2
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_generate_chunk_diffs_partial_failure(mockCodeGenWorker):
+    hung_worker_cancelled = False
+
+    async def generate(content_chunk):
+        nonlocal hung_worker_cancelled
+        if content_chunk == "hung":  # e.g. stuck queueing and retrying in the LLM scheduler
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                hung_worker_cancelled = True
+                raise
+        if content_chunk == "broken":
+            raise ApiError("Failed to get plan from API")
+        return f"diff {content_chunk}"
+
+    mockCodeGenWorker.side_effect = lambda content_chunk, steps, model, related_definitions, timeout: Mock(
+        generate_code_diff=lambda: generate(content_chunk)
+    )
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt", worker_deadline=0.05)
+
+    code_diff_chunks = asyncio.run(orchestrator.generate_chunk_diffs(["ok", "hung", "broken"], ["Step1"]))
+
+    assert code_diff_chunks == ["diff ok", None, None]
+    assert hung_worker_cancelled
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_generate_chunk_diffs_all_failed(mockCodeGenWorker):
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(side_effect=ApiError("Failed to get plan from API"))
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt")
+
+    with pytest.raises(ApiError, match="Code generation failed for all 2 content chunks"):
+        asyncio.run(orchestrator.generate_chunk_diffs(["1", "2"], ["Step1"]))
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_merge_chunk_diffs_regenerates_only_failing_chunks(mockCodeGenWorker):
+    files = [
+        FileRecord(path="a.py", content="one\ntwo\n", size=8, sha="a"),
+        FileRecord(path="b.py", content="three\n", size=6, sha="b"),
+    ]
+    good_b = "--- a/b.py\n+++ b/b.py\n@@ -1 +1 @@\n-three\n+THREE\n"
+    calls = []
+
+    def worker(content_chunk, steps, model, related_definitions, timeout):
+        calls.append((content_chunk, steps))
+        return Mock(generate_code_diff=AsyncMock(return_value=good_b))
+
+    mockCodeGenWorker.side_effect = worker
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt")
+    code_diff_chunks = [
+        "--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n one\n-two\n+TWO\n",
+        "--- a/b.py\n+++ b/b.py\n@@ -1 +1 @@\n-four\n+FOUR\n",  # does not match b.py
+    ]
+    repairs = DIFF_REPAIRS.value()
+
+    validation = asyncio.run(orchestrator.merge_chunk_diffs(
+        "/tmp/repo", files, ["chunk a", "chunk b"], ["Step1"], code_diff_chunks
+    ))
+
+    assert [content_chunk for content_chunk, _ in calls] == ["chunk b"]
+    assert calls[0][1][0] == "Step1"
+    assert "b.py @@ -1,1 +1,1 @@: context or removed lines not found" in calls[0][1][1]
+    assert validation.failures == []
+    assert validation.render() == (
+        "diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n one\n-two\n+TWO\n"
+        "diff --git a/b.py b/b.py\n--- a/b.py\n+++ b/b.py\n@@ -1,1 +1,1 @@\n-three\n+THREE\n"
+    )
+    assert DIFF_REPAIRS.value() == repairs + 1
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_later_attempts_regenerate_only_changed_chunks(mockCodeGenWorker):
+    files = [
+        FileRecord(path="a.py", content="one\n", size=4, sha="a"),
+        FileRecord(path="b.py", content="three\n", size=6, sha="b"),
+    ]
+    chunks = ["\n--- File: a.py ---\none\n", "\n--- File: b.py ---\nthree\n"]
+    calls = []
+
+    def worker(content_chunk, steps, model, related_definitions, timeout):
+        calls.append((content_chunk, steps))
+        path, line = ("a.py", "one") if "a.py" in content_chunk else ("b.py", "three")
+        code_diff = f"--- a/{path}\n+++ b/{path}\n@@ -1 +1 @@\n-{line}\n+{line} ({len(calls)})\n"
+        return Mock(generate_code_diff=AsyncMock(return_value=code_diff))
+
+    mockCodeGenWorker.side_effect = worker
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt")
+    memo_hits = WORKER_CHUNKS.value(source="memo")
+
+    async def attempt(steps, attempt_number):
+        code_diff_chunks = await orchestrator.generate_chunk_diffs(chunks, steps, attempt_number)
+        validation = await orchestrator.merge_chunk_diffs("/tmp/repo", files, chunks, steps, code_diff_chunks)
+        return validation.render()
+
+    first = asyncio.run(attempt(["Update a.py", "Update b.py", "Add comments"], 1))
+    second = asyncio.run(attempt(["Update a.py", "Rewrite b.py", "Add comments"], 2))
+
+    assert calls == [
+        (chunks[0], ["Update a.py", "Add comments"]),
+        (chunks[1], ["Update b.py", "Add comments"]),
+        (chunks[1], ["Rewrite b.py", "Add comments"]),
+    ]
+    assert "+one (1)" in first and "+three (2)" in first
+    assert "+one (1)" in second and "+three (3)" in second  # the diff of a.py is reused
+    assert WORKER_CHUNKS.value(source="memo") == memo_hits + 1
+
+
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_merge_chunk_diffs_leaves_out_hunks_that_still_fail(mockCodeGenWorker):
+    files = [FileRecord(path="a.py", content="one\n", size=4, sha="a")]
+    bad = "--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-zero\n+ZERO\n"
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=bad)
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt", diff_repair_attempts=2)
+
+    validation = asyncio.run(orchestrator.merge_chunk_diffs("/tmp/repo", files, ["chunk"], ["Step1"], [bad]))
+
+    assert mockCodeGenWorker.call_count == 2
+    assert validation.render() == ""
+    assert validation.failed_chunks == [0]
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_emits_events(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                         mock_build_file_index, mock_fetch_github_repo_contents, mock_prepare_temp_dir,
+                                         mock_remove_temp_dir):
+    # Setup
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=[(None, mock_plan), (mock_review, None)])
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
+    events = []
+
+    async def event_handler(event):
+        events.append(event)
+
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt", event_handler=event_handler)
+
+    # Run
+    result = asyncio.run(orchestrator.generate_code_diff())
+
+    # Validate
+    assert [event.event for event in events] == ["plan", "code_diff_chunk", "code_diff", "plan", "result"]
+    assert events[0].data["plan"] == mock_plan
+    assert events[1].data == {"attempt": 1, "chunk_index": 0, "chunk_count": 1, "code_diff": mock_code_diff}
+    assert events[-1].data["result"] == result
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.resolve_github_repo_head', new_callable=AsyncMock, return_value="abc123")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_result_cache(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                         mock_build_file_index, mock_fetch_github_repo_contents,
+                                         mock_resolve_github_repo_head, mock_prepare_temp_dir, mock_remove_temp_dir,
+                                         tmp_path):
+    # Setup
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=[(None, mock_plan), (mock_review, None)])
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
+    cache = ResultCache(cache_path=str(tmp_path / "result_cache"))
+
+    # Run
+    with patch('app.lib.codegen.orchestrator.result_cache', cache):
+        first = asyncio.run(CodeGenOrchestrator("https://github.com/user/repo", "prompt").generate_code_diff())
+        second = asyncio.run(CodeGenOrchestrator("https://github.com/user/repo", "prompt").generate_code_diff())
+        mock_resolve_github_repo_head.return_value = "def456"  # a new commit invalidates the cached result
+        with pytest.raises(StopAsyncIteration):
+            asyncio.run(CodeGenOrchestrator("https://github.com/user/repo", "prompt").generate_code_diff())
+
+    # Validate
+    assert second == first
+    mock_fetch_github_repo_contents.assert_any_await("https://github.com/user/repo", "/tmp/repo", "full", "abc123")
+    assert mock_fetch_github_repo_contents.await_count == 2
+    assert mockCodeGenPlanner.return_value.review_and_plan.await_count == 3
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.resolve_github_repo_head', new_callable=AsyncMock, return_value="abc123")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_resumes_from_checkpoints(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                                     mock_build_file_index, mock_fetch_github_repo_contents,
+                                                     mock_resolve_github_repo_head, mock_prepare_temp_dir,
+                                                     mock_remove_temp_dir, tmp_path):
+    # Setup: the first run is interrupted after planning, while the workers run
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=[(None, mock_plan), (mock_review, None)])
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(side_effect=[RuntimeError("timeout"), mock_code_diff])
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"))
+
+    # Run
+    with patch('app.lib.codegen.orchestrator.checkpoint_store', store):
+        with pytest.raises(ApiError):
+            asyncio.run(CodeGenOrchestrator("https://github.com/user/repo", "prompt").generate_code_diff())
+        orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt")
+        result = asyncio.run(orchestrator.generate_code_diff())
+
+    # Validate: the retried run neither plans the first attempt again nor rebuilds the file map
+    assert result.exceeded_max_attempts is False
+    assert result.code_diff == mock_code_diff
+    assert [item.code_diff for item in result.history] == [None, mock_code_diff]
+    assert mockCodeGenPlanner.return_value.review_and_plan.await_count == 2
+    mock_build_file_index.assert_awaited_once()
+    assert asyncio.run(store.load(orchestrator.run_key)) == {}  # removed once the run finished
+
+
+@patch('app.lib.codegen.orchestrator.remove_temp_dir')
+@patch('app.lib.codegen.orchestrator.prepare_temp_dir', return_value="/tmp/repo")
+@patch('app.lib.codegen.orchestrator.fetch_github_repo_contents', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.build_file_index', new_callable=AsyncMock, return_value=mock_file_index)
+@patch('app.lib.codegen.orchestrator.load_retrieval_index', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.fetch_files', return_value=mock_files)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+@patch('app.lib.codegen.orchestrator.CodeGenPlanner')
+def test_generate_code_diff_uses_retrieval_candidates(mockCodeGenPlanner, mockCodeGenWorker, mock_fetch_files,
+                                                      mock_load_retrieval_index, mock_build_file_index,
+                                                      mock_fetch_github_repo_contents, mock_prepare_temp_dir,
+                                                      mock_remove_temp_dir):
+    # Setup
+    mockCodeGenPlanner.return_value.review_and_plan = AsyncMock(side_effect=[(None, mock_plan), (mock_review, None)])
+    mockCodeGenWorker.return_value.generate_code_diff = AsyncMock(return_value=mock_code_diff)
+    mock_load_retrieval_index.return_value.search = Mock(
+        return_value=[("path1", 3.0), ("path2", 2.0), ("path3", 1.0), ("path4", 0.5), ("path5", 0.1)]
+    )
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt", retrieval_top_k=5)
+
+    # Run
+    asyncio.run(orchestrator.generate_code_diff())
+
+    # Validate
+    mock_load_retrieval_index.assert_awaited_once_with("/tmp/repo", ["path1"], None, True)
+    assert mockCodeGenPlanner.call_args.args[5] == ["path1", "path2", "path3", "path4", "path5"]
+    mock_fetch_files.assert_called_once_with("/tmp/repo", ["path1", "path2", "path3"])
+
+
+@patch('app.lib.codegen.orchestrator.load_symbol_index', new_callable=AsyncMock)
+@patch('app.lib.codegen.orchestrator.CodeGenWorker')
+def test_find_related_definitions(mockCodeGenWorker, mock_load_symbol_index):
+    symbol_index = Mock(related_definitions=AsyncMock(side_effect=[
+        [Symbol("add", "function", "src/util.py", 1, "def add(a, b):")],
+        [],
+    ]))
+    orchestrator = CodeGenOrchestrator("https://github.com/user/repo", "prompt")
+
+    related_definitions = asyncio.run(orchestrator.find_related_definitions(
+        symbol_index, ["\n--- File: src/main.py ---\nadd(1, 2)\n", "\n--- File: README.md ---\nhello\n"]
+    ))
 
+    assert related_definitions == ["# src/util.py\ndef add(a, b):", None]
+    symbol_index.related_definitions.assert_any_await(["src/main.py"])
+    assert asyncio.run(orchestrator.find_related_definitions(None, ["chunk"])) == [None]
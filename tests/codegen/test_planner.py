@@ -1,3 +1,4 @@
+import asyncio
 import json
 import pytest
 from unittest.mock import patch, Mock
@@ -17,7 +18,7 @@ mock_response_with_data = Mock(choices=[{
     "message": {
         "function_call": {
             "arguments": json.dumps({
-                "review": {"score": 0.8, "comment": "Good"},
+                "review": {"score": 5, "comment": "Good"},  # an integer from 0 to 10, as CodeGenReview.score is an int
                 "plan": {"steps": ["Step3"], "file_paths": ["file3"]}
             })
         }
@@ -32,12 +33,12 @@ def planner():
     return CodeGenPlanner(sample_prompt, sample_repo_file_map, sample_code_diff, sample_steps, sample_openai_model)
 
 
-@patch('openai.ChatCompletion.create', return_value=mock_response_with_data)
+@patch('openai.ChatCompletion.acreate', return_value=mock_response_with_data)
 def test_review_and_plan_success(mock_openai, planner):
-    review, plan = planner.review_and_plan()
+    review, plan = asyncio.run(planner.review_and_plan())
     
     assert isinstance(review, CodeGenReview)
-    assert review.score == 0.8
+    assert review.score == 5
     assert review.comment == "Good"
     
     assert isinstance(plan, CodeGenPlan)
@@ -47,23 +48,23 @@ def test_review_and_plan_success(mock_openai, planner):
     mock_openai.assert_called_once()
 
 
-@patch('openai.ChatCompletion.create', return_value=mock_response_empty)
+@patch('openai.ChatCompletion.acreate', return_value=mock_response_empty)
 def test_review_and_plan_api_error(mock_openai, planner):
     with pytest.raises(ApiError, match="Failed to get plan from API"):
-        planner.review_and_plan()
+        asyncio.run(planner.review_and_plan())
     mock_openai.assert_called_once()
 
 
-@patch('openai.ChatCompletion.create', side_effect=Exception("Random Exception"))
+@patch('openai.ChatCompletion.acreate', side_effect=Exception("Random Exception"))
 def test_review_and_plan_random_exception(mock_openai, planner):
     with pytest.raises(Exception, match="Random Exception"):
-        planner.review_and_plan()
+        asyncio.run(planner.review_and_plan())
     mock_openai.assert_called_once()
 
 
-@patch('openai.ChatCompletion.create', return_value=mock_response_with_data)
+@patch('openai.ChatCompletion.acreate', return_value=mock_response_with_data)
 def test_review_and_plan_json_decode_error(mock_openai, planner):
     with patch('json.loads', side_effect=json.JSONDecodeError("Error", "Doc", 1)):
         with pytest.raises(ApiError, match="Failed to decode codegen planner JSON response from API"):
-            planner.review_and_plan()
+            asyncio.run(planner.review_and_plan())
     mock_openai.assert_called_once()
@@ -0,0 +1,149 @@
+from unittest.mock import patch
+
+from app.lib.codegen.utils import (
+    CHUNK_SEPARATOR,
+    chunk_files,
+    parse_chunk_paths,
+    relevant_steps,
+    render_related_definitions,
+    split_file_content,
+)
+from app.lib.codegen.utils.prompts import generate_review_and_plan_prompt
+from app.lib.codegen.utils.tokens import count_tokens, count_tokens_cached
+from app.lib.file_index import FileIndex, FileIndexEntry
+from app.lib.filesystem import FileRecord
+from app.lib.symbols import Symbol
+
+
+def make_file(path: str, content: str) -> FileRecord:
+    return FileRecord(path=path, content=content, size=len(content), sha=None)
+
+
+def make_function(name: str, body_lines: int) -> str:
+    return f"def {name}():\n" + "".join(f"    value_{i} = {i}\n" for i in range(body_lines)) + "\n"
+
+
+def test_small_files_are_packed_into_one_chunk_in_order():
+    files = [make_file("a.py", "a = 1\n"), make_file("b.py", "b = 2\n"), make_file("new.py", "")]
+
+    chunks = chunk_files(files, max_tokens=100)
+
+    assert chunks == [CHUNK_SEPARATOR.join([
+        "\n--- File: a.py ---\na = 1\n",
+        "\n--- File: b.py ---\nb = 2\n",
+        "\n--- File: new.py ---\n",
+    ])]
+
+
+def test_chunks_stay_within_budget_and_bin_packing_minimises_chunks():
+    sizes = [("a", 30), ("c", 30), ("b", 5), ("d", 5)]
+    files = [make_file(f"{name}.py", make_function(name, lines)) for name, lines in sizes]
+    big_tokens = count_tokens("\n--- File: a.py ---\n" + files[0].content)
+    small_tokens = count_tokens("\n--- File: b.py ---\n" + files[2].content)
+    max_tokens = big_tokens + small_tokens + count_tokens(CHUNK_SEPARATOR)
+
+    chunks = chunk_files(files, max_tokens=max_tokens)
+
+    # Sequential packing needs three chunks (a, c+b, d); first-fit decreasing pairs each large file with a small one
+    assert len(chunks) == 2
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks)
+    assert chunks[0].startswith("\n--- File: a.py ---\n") and "--- File: b.py ---" in chunks[0]
+
+
+def test_oversize_file_is_split_on_top_level_definitions():
+    content = "import os\n\n" + make_function("first", 20) + "@decorator\n" + make_function("second", 20)
+
+    chunks = chunk_files([make_file("big.py", content)], max_tokens=count_tokens(content) * 2 // 3)
+
+    assert len(chunks) == 2
+    assert chunks[0].startswith("\n--- File: big.py (lines 1-")
+    assert chunks[0].rstrip().endswith("value_19 = 19")
+    assert "(lines" in chunks[1] and chunks[1].split(" ---\n", 1)[1].startswith("@decorator\ndef second():")
+
+
+def test_oversize_definition_falls_back_to_line_windows():
+    content = make_function("huge", 200)
+
+    parts = split_file_content(content, max_tokens=100)
+
+    assert len(parts) > 1
+    assert "".join(part for _, _, part in parts) == content
+    assert all(count_tokens(part) <= 100 for _, _, part in parts)
+    assert [start for start, _, _ in parts[1:]] == [end + 1 for _, end, _ in parts[:-1]]
+
+
+def test_token_counts_are_cached_by_content_hash():
+    with patch("app.lib.codegen.utils.tokens.count_tokens", return_value=42) as mock_count_tokens:
+        assert count_tokens_cached("some uncached content for the test") == 42
+        assert count_tokens_cached("some uncached content for the test") == 42
+
+    mock_count_tokens.assert_called_once()
+
+
+def test_parse_chunk_paths():
+    chunk = "\n--- File: a.py ---\na = 1\n" + CHUNK_SEPARATOR + "\n--- File: big.py (lines 1-20) ---\nb = 2\n"
+
+    assert parse_chunk_paths(chunk) == ["a.py", "big.py"]
+
+
+def test_relevant_steps():
+    steps = ["Add a helper to app/utils.py.", "Call it from main.py", "Add type hints everywhere", "Fix lib/utils.py"]
+    all_paths = ["app/utils.py", "src/main.py", "lib/utils.py"]
+
+    assert relevant_steps(steps, ["app/utils.py"], all_paths) == [
+        "Add a helper to app/utils.py.", "Add type hints everywhere"
+    ]
+    assert relevant_steps(steps, ["src/main.py", "lib/utils.py"], all_paths) == [
+        "Call it from main.py", "Add type hints everywhere", "Fix lib/utils.py"
+    ]
+
+
+def test_render_related_definitions_within_budget():
+    symbols = [
+        Symbol("add", "function", "src/util.py", 1, "def add(a, b):"),
+        Symbol("Big", "class", "src/big.py", 1, "class Big:\n" + "    def method(self):\n" * 50),
+        Symbol("sub", "function", "src/util.py", 5, "def sub(a, b):"),
+    ]
+
+    assert render_related_definitions(symbols, max_tokens=40) == "# src/util.py\ndef add(a, b):\n\ndef sub(a, b):"
+    assert render_related_definitions([], max_tokens=40) == ""
+
+
+def test_review_and_plan_prompt_fits_budget_with_a_stable_prefix():
+    file_index = FileIndex(
+        [FileIndexEntry(path=f"src/app_{i}.py", size=1024, language=None) for i in range(100)] +
+        [FileIndexEntry(path=f"vendor/lib_{i}.py", size=1024, language=None) for i in range(100)]
+    )
+    context = "".join(f" unchanged_line_{i} = {i}\n" for i in range(300))
+    code_diff = (
+        "diff --git a/src/app_1.py b/src/app_1.py\n--- a/src/app_1.py\n+++ b/src/app_1.py\n"
+        f"@@ -1,301 +1,301 @@\n-old = 1\n+new = 1\n{context}"
+    )
+    args = ("Add logging", file_index.rendered, code_diff, ["Step1"], ["src/app_1.py"])
+    pruned_file_map = file_index.render(keep_paths=["src/app_1.py"])
+
+    full_prompt = generate_review_and_plan_prompt(*args, max_tokens=0, pruned_file_map=pruned_file_map)
+    prompt = generate_review_and_plan_prompt(*args, max_tokens=3000, pruned_file_map=pruned_file_map)
+    first_attempt_prompt = generate_review_and_plan_prompt(
+        *args[:2], "", [], args[4], max_tokens=3000, pruned_file_map=pruned_file_map
+    )
+
+    assert "lib_1.py" in full_prompt and "unchanged_line_299" in full_prompt
+    assert count_tokens(prompt) <= 3000 < count_tokens(full_prompt)
+    assert "vendor/ (100 files)" in prompt and "app_99.py" in prompt
+    assert "-old = 1\n+new = 1\n unchanged_line_0 = 0\n ... (299 unchanged lines)" in prompt
+    prefix = prompt[:prompt.index("Previously Generated Code Diff")]
+    assert first_attempt_prompt.startswith(prefix)  # the same across planning attempts, for prompt caching
+
+
+def test_review_and_plan_prompt_summarizes_large_file_diffs():
+    additions = "".join(f"+added_line_{i} = {i}\n" for i in range(200))
+    code_diff = (
+        f"--- /dev/null\n+++ b/big.py\n@@ -0,0 +1,200 @@\n{additions}"
+        "--- a/small.py\n+++ b/small.py\n@@ -1 +1 @@\n-a\n+b\n"
+    )
+
+    prompt = generate_review_and_plan_prompt("Add logging", "2 files", code_diff, ["Step1"], max_tokens=1200)
+
+    assert "# Summary: big.py: new file, +200 -0 lines in 1 hunks" in prompt
+    assert "--- a/small.py\n+++ b/small.py\n@@ -1,1 +1,1 @@\n-a\n+b" in prompt
@@ -0,0 +1,54 @@
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from app.lib.codegen.checkpoints import CheckpointStore
+from app.lib.codegen.llm_cache import LLMResponseCache
+from app.lib.codegen.result_cache import ResultCache
+from app.lib.retrieval import RetrievalIndexCache
+
+
+def git(*args, cwd=None):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd, check=True, capture_output=True
+    )
+
+
+@pytest.fixture
+def source_repo(tmp_path):
+    repo_dir = tmp_path / "source"
+    repo_dir.mkdir()
+    git("init", "--quiet", cwd=repo_dir)
+    git("config", "uploadpack.allowFilter", "true", cwd=repo_dir)
+    (repo_dir / "README.md").write_text("hello\n")
+    (repo_dir / "src").mkdir()
+    (repo_dir / "src" / "main.py").write_text("print('hello')\n")
+    git("add", "-A", cwd=repo_dir)
+    git("commit", "--quiet", "-m", "initial", cwd=repo_dir)
+    return repo_dir
+
+
+@pytest.fixture(autouse=True)
+def disable_llm_cache():
+    with patch('app.lib.codegen.llm.llm_cache', LLMResponseCache(enabled=False)):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def disable_result_cache():
+    with patch('app.lib.codegen.orchestrator.result_cache', ResultCache(enabled=False)):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def disable_checkpoints():
+    with patch('app.lib.codegen.orchestrator.checkpoint_store', CheckpointStore(enabled=False)):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def disable_retrieval_index_cache():
+    with patch('app.lib.retrieval.retrieval_index_cache', RetrievalIndexCache(enabled=False)):
+        yield
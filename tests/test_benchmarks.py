@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.codegen_load import compare_to_baseline, percentile
+
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 95) == pytest.approx(4.8)
+
+
+def test_compare_to_baseline_flags_slowdowns():
+    baseline = {"results": {"latency": {"p95": 1.0, "p99": 2.0}, "requests_per_second": 10.0}}
+    faster = {"latency": {"p95": 0.9, "p99": 2.1}, "requests_per_second": 11.0}
+    slower = {"latency": {"p95": 1.5, "p99": 2.1}, "requests_per_second": 5.0}
+
+    assert compare_to_baseline(faster, baseline, 0.2) == []
+    assert compare_to_baseline(slower, baseline, 0.2) == [
+        "p95 latency regressed by 50%", "time per request regressed by 100%"
+    ]
+
+
+def test_codegen_load_benchmark_end_to_end(tmp_path):
+    output = tmp_path / "results.json"
+    process = subprocess.run(
+        [
+            sys.executable, "-m", "benchmarks.codegen_load", "--files", "10", "--requests", "3", "--concurrency", "2",
+            "--llm-latency", "0", "--llm-tokens-per-second", "0", "--work-dir", str(tmp_path / "work"),
+            "--output", str(output),
+        ],
+        capture_output=True, text=True, timeout=120
+    )
+
+    assert process.returncode == 0, process.stderr
+    results = json.loads(output.read_text())["results"]
+    assert results["errors"] == 0
+    assert results["latency"]["p50"] <= results["latency"]["p99"]
+    assert results["llm_calls"] > 0
+    assert {"clone", "file_map", "plan", "chunk", "work", "persist"} <= set(results["stages"])
@@ -1,9 +1,13 @@
+import asyncio
 import json
-import logging
 import pytest
 from unittest.mock import Mock, patch
 from app.api.endpoints.codegen.codegen_service import CodeGenService
-from app.lib.codegen.models import CodeGenResult, CodeGenHistoryItem, CodeGenPlan, CodeGenReview
+from app.common.context import current_job_id
+from app.common.exceptions import ApiError, GitCommandError
+from app.lib.codegen.models import CodeGenEvent, CodeGenResult, CodeGenHistoryItem, CodeGenPlan, CodeGenReview
+from app.lib.job_queue import JobStatus
+from app.lib.persistence import SQLiteBackend, WriteBehindWriter
 
 # Mock the CodeGenResult object
 mock_codegen_result = CodeGenResult(
@@ -15,34 +19,35 @@ mock_codegen_result = CodeGenResult(
     exceeded_max_attempts=False
 )
 
-# Mock the Supabase response
-mock_supabase_response = {'data': 'inserted_record', 'error': None}
-
 # Mock the logger
 mock_logger = Mock()
 
 @pytest.fixture
-def service():
-    return CodeGenService()
+def service(tmp_path):
+    service = CodeGenService()
+    service.persistence = WriteBehindWriter(
+        SQLiteBackend(str(tmp_path / "tinygen.sqlite3")), spill_path=str(tmp_path / "spill.jsonl")
+    )
+    return service
 
 @pytest.fixture(autouse=True)
 def disable_logging():
-    with patch.object(logging, 'info', mock_logger):
+    with patch('app.api.endpoints.codegen.codegen_service.logger', mock_logger):
         yield
 
 @patch('app.lib.codegen.orchestrator.CodeGenOrchestrator.generate_code_diff', return_value=mock_codegen_result)
-@patch('app.lib.supabase_client.SupabaseClient.insert_record', return_value=mock_supabase_response)
-def test_request_codegen_success(mock_insert_record, mock_generate_code_diff, service):
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+def test_request_codegen_success(mock_enqueue, mock_generate_code_diff, service):
     repo_url = 'http://test.repo'
     prompt = 'Create function'
 
-    response = service.request_codegen(repo_url, prompt)
+    response = asyncio.run(service.request_codegen(repo_url, prompt))
     
     assert isinstance(response, CodeGenService.RequestCodeGenRes)
     assert response.result == mock_codegen_result
 
-    mock_generate_code_diff.assert_called_once_with()
-    mock_insert_record.assert_called_once_with(
+    mock_generate_code_diff.assert_awaited_once_with()
+    mock_enqueue.assert_called_once_with(
         'code_gen_requests',
         {
             'repo_url': repo_url,
@@ -52,3 +57,155 @@ def test_request_codegen_success(mock_insert_record, mock_generate_code_diff, se
             'exceeded_max_attempts': mock_codegen_result.exceeded_max_attempts,
         }
     )
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+@patch('app.lib.codegen.orchestrator.CodeGenOrchestrator.generate_code_diff', return_value=mock_codegen_result)
+def test_codegen_job_success(mock_generate_code_diff, mock_enqueue, service):
+    async def run():
+        job = await service.submit_codegen_job('http://test.repo', 'Create function')
+        assert job.status == JobStatus.QUEUED
+        for _ in range(100):
+            job = await service.get_codegen_job(job.jobId)
+            if job.status == JobStatus.SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        await service.stop()
+        return job
+
+    job = asyncio.run(run())
+
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.result == mock_codegen_result
+    mock_generate_code_diff.assert_awaited_once_with()
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+def test_codegen_job_runs_under_its_job_id(mock_enqueue, service):
+    job_ids = []
+
+    async def generate_code_diff(orchestrator):
+        job_ids.append(current_job_id.get())
+        return mock_codegen_result
+
+    async def run():
+        job = await service.submit_codegen_job('http://test.repo', 'Create function')
+        for _ in range(100):
+            if (await service.get_codegen_job(job.jobId)).status == JobStatus.SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        await service.stop()
+        await service.request_codegen('http://test.repo', 'Create another function')
+        return job
+
+    with patch('app.lib.codegen.orchestrator.CodeGenOrchestrator.generate_code_diff', generate_code_diff):
+        job = asyncio.run(run())
+
+    assert job_ids[0] == job.jobId
+    assert job_ids[1].startswith("request-")  # requests outside a job get a request ID of their own
+
+
+def test_get_unknown_codegen_job(service):
+    assert asyncio.run(service.get_codegen_job('unknown')) is None
+
+
+class FakeStreamingOrchestrator:
+    cancelled = False
+
+    def __init__(self, repo_url, prompt, event_handler=None):
+        self.event_handler = event_handler
+
+    async def generate_code_diff(self):
+        await self.event_handler(CodeGenEvent(event="plan", data={"attempt": 1}))
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            FakeStreamingOrchestrator.cancelled = True
+            raise
+        await self.event_handler(CodeGenEvent(event="result", data={"result": mock_codegen_result}))
+        return mock_codegen_result
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+@patch('app.api.endpoints.codegen.codegen_service.CodeGenOrchestrator', FakeStreamingOrchestrator)
+def test_stream_codegen(mock_enqueue, service):
+    async def run():
+        events = [event async for event in service.stream_codegen('http://test.repo', 'Create function')]
+        await asyncio.sleep(0.01)  # let the result be saved
+        return events
+
+    events = asyncio.run(run())
+
+    assert [event.event for event in events] == ["plan", "result"]
+    mock_enqueue.assert_called_once()
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+@patch('app.api.endpoints.codegen.codegen_service.CodeGenOrchestrator', FakeStreamingOrchestrator)
+def test_stream_codegen_cancelled_early(mock_enqueue, service):
+    async def run():
+        events = service.stream_codegen('http://test.repo', 'Create function')
+        first_event = await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.02)
+        return first_event
+
+    first_event = asyncio.run(run())
+
+    assert first_event.event == "plan"
+    assert FakeStreamingOrchestrator.cancelled is True
+    mock_enqueue.assert_not_called()
+
+
+@pytest.mark.parametrize("error, detail", [
+    (ApiError("Code generation failed for all 2 content chunks"), "Code generation failed for all 2 content chunks"),
+    (GitCommandError("fatal: could not read /srv/repos/secret.git"), "Code generation failed"),
+])
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+def test_stream_codegen_error_hides_internal_details(mock_enqueue, service, error, detail):
+    async def run():
+        with patch('app.lib.codegen.orchestrator.CodeGenOrchestrator.generate_code_diff', side_effect=error):
+            return [event async for event in service.stream_codegen('http://test.repo', 'Create function')]
+
+    events = asyncio.run(run())
+
+    assert [(event.event, event.data) for event in events] == [("error", {"detail": detail})]
+    mock_enqueue.assert_not_called()
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+@patch('app.lib.codegen.orchestrator.CodeGenOrchestrator.generate_code_diff')
+def test_identical_requests_are_coalesced(mock_generate_code_diff, mock_enqueue, service):
+    async def generate_code_diff():
+        await asyncio.sleep(0.01)
+        return mock_codegen_result
+
+    mock_generate_code_diff.side_effect = generate_code_diff
+
+    async def run():
+        return await asyncio.gather(
+            service.request_codegen('http://test.repo', 'Create function'),
+            service.request_codegen('http://test.repo', 'Create function'),
+            service.request_codegen('http://test.repo', 'Create another function'),
+        )
+
+    responses = asyncio.run(run())
+
+    assert all(response.result == mock_codegen_result for response in responses)
+    assert mock_generate_code_diff.await_count == 2
+    assert mock_enqueue.call_count == 3
+
+
+@patch('app.lib.persistence.WriteBehindWriter.enqueue')
+@patch('app.api.endpoints.codegen.codegen_service.CodeGenOrchestrator', FakeStreamingOrchestrator)
+def test_stream_codegen_follower_receives_result(mock_enqueue, service):
+    async def collect():
+        return [event.event async for event in service.stream_codegen('http://test.repo', 'Create function')]
+
+    async def run():
+        return await asyncio.gather(collect(), collect())
+
+    leader_events, follower_events = asyncio.run(run())
+
+    assert leader_events == ["plan", "result"]
+    assert follower_events == ["result"]
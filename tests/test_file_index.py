@@ -0,0 +1,110 @@
+import asyncio
+
+from app.lib.file_index import (
+    FileIndex,
+    FileIndexEntry,
+    build_file_index,
+    detect_language,
+    is_ignored_path,
+)
+from tests.conftest import git
+
+
+def test_build_file_index_skips_ignored_binary_and_generated_files(source_repo):
+    (source_repo / ".gitignore").write_text("*.log\n")
+    (source_repo / "debug.log").write_text("ignored by .gitignore\n")
+    (source_repo / "node_modules" / "left-pad").mkdir(parents=True)
+    (source_repo / "node_modules" / "left-pad" / "index.js").write_text("module.exports = 1\n")
+    (source_repo / "logo.png").write_bytes(b"\x89PNG")
+    (source_repo / "data.dat").write_bytes(b"\x00\x01\x02")
+    (source_repo / "app.min.js").write_text("var a=1;\n")
+    (source_repo / "src" / "api_pb2.py").write_text("# generated\n")
+    (source_repo / "src" / "schema.py").write_text("# @generated by a tool\n")
+    git("add", "-A", cwd=source_repo)
+    git("commit", "--quiet", "-m", "add files", cwd=source_repo)
+    (source_repo / "untracked.py").write_text("x = 1\n")
+
+    file_index = asyncio.run(build_file_index(str(source_repo)))
+
+    assert file_index.paths == [".gitignore", "README.md", "src/main.py"]
+    assert file_index.entries[2] == FileIndexEntry(path="src/main.py", size=15, language="Python")
+
+
+def test_build_file_index_walks_directories_outside_git(tmp_path):
+    (tmp_path / ".gitignore").write_text("# comment\nsecrets/\n")
+    (tmp_path / "secrets").mkdir()
+    (tmp_path / "secrets" / "key.txt").write_text("key\n")
+    (tmp_path / ".venv").mkdir()
+    (tmp_path / ".venv" / "site.py").write_text("x = 1\n")
+    (tmp_path / "main.go").write_text("package main\n")
+
+    file_index = asyncio.run(build_file_index(str(tmp_path)))
+
+    assert file_index.paths == [".gitignore", "main.go"]
+
+
+def test_build_file_index_without_reading_files(source_repo, tmp_path):
+    git("rm", "--quiet", "-r", "--cached", "README.md", cwd=source_repo)
+    git("commit", "--quiet", "-m", "untrack readme", cwd=source_repo)
+
+    file_index = asyncio.run(build_file_index(str(source_repo), read_files=False))
+
+    assert file_index.entries == [FileIndexEntry(path="src/main.py", size=None, language="Python")]
+
+
+def test_rendered_tree_collapses_single_directory_chains():
+    file_index = FileIndex([
+        FileIndexEntry(path="src/main/java/App.java", size=2048, language="Java"),
+        FileIndexEntry(path="src/main/java/Util.java", size=100, language="Java"),
+        FileIndexEntry(path="README.md", size=None, language="Markdown"),
+    ])
+
+    assert file_index.rendered == "\n".join([
+        "3 files (Java 2, Markdown 1)",
+        "README.md",
+        "src/main/java/",
+        "  App.java 2.0K",
+        "  Util.java 100B",
+    ])
+    assert "/tmp/repo" not in file_index.rendered
+
+
+def test_render_collapses_directories_without_kept_paths():
+    paths = ["README.md", "docs/one.md", "lib/deep/q.py", "lib/w.py", "src/a/x.py", "src/a/y.py", "src/b/z.py"]
+    index = FileIndex([FileIndexEntry(path=path, size=10, language=None) for path in paths])
+
+    assert index.render(keep_paths=["src/a/x.py"]) == "\n".join([
+        "7 files",
+        "README.md 10B",
+        "docs/ (1 file)",
+        "lib/ (2 files)",
+        "src/",
+        "  a/",
+        "    x.py 10B",
+        "    y.py 10B",
+        "  b/ (1 file)",
+    ])
+    assert index.render(keep_paths=paths) == index.rendered
+
+
+def test_render_keeps_file_names_that_look_like_sizes():
+    paths = ["notes 12B", "docs/notes 1.5K", "src/main/java/App.java", "src/main/java/Util.java"]
+    index = FileIndex([FileIndexEntry(path=path, size=None, language=None) for path in paths])
+
+    assert index.render(keep_paths=["notes 12B", "src/main/java/App.java"]) == "\n".join([
+        "4 files",
+        "docs/ (1 file)",
+        "notes 12B",
+        "src/main/java/",
+        "  App.java",
+        "  Util.java",
+    ])
+
+
+def test_is_ignored_path_and_detect_language():
+    assert is_ignored_path("web/node_modules/react/index.js", ["node_modules"])
+    assert is_ignored_path("docs/build.log", ["*.log"])
+    assert not is_ignored_path("src/builder.py", ["build"])
+    assert detect_language("app/main.py") == "Python"
+    assert detect_language("Dockerfile") == "Dockerfile"
+    assert detect_language("notes.unknown") is None
@@ -0,0 +1,38 @@
+import hashlib
+
+from app.lib.filesystem import FileRecord, fetch_files
+
+
+def test_fetch_files_returns_records_in_requested_order(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "main.py").write_text("print('hello')\n")
+    (tmp_path / "empty.py").write_text("")
+
+    records = fetch_files(str(tmp_path), ["src/main.py", "new.py", "empty.py", "src/main.py"])
+
+    assert records == [
+        FileRecord("src/main.py", "print('hello')\n", 15, hashlib.sha256(b"print('hello')\n").hexdigest()),
+        FileRecord("new.py", "", 0, None),
+        FileRecord("empty.py", "", 0, hashlib.sha256(b"").hexdigest()),
+    ]
+
+
+def test_fetch_files_skips_binaries_directories_and_invalid_utf8(tmp_path):
+    (tmp_path / "image.png").write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "latin1.txt").write_bytes("caf\xe9\n".encode("latin-1"))
+
+    records = fetch_files(str(tmp_path), ["image.png", "src", "latin1.txt"])
+
+    assert [(record.path, record.content) for record in records] == [("latin1.txt", "caf\n")]
+
+
+def test_fetch_files_enforces_byte_budgets(tmp_path):
+    for name, size in [("a.txt", 40), ("big.txt", 200), ("b.txt", 40), ("c.txt", 40)]:
+        (tmp_path / name).write_text("x" * size)
+
+    records = fetch_files(
+        str(tmp_path), ["a.txt", "big.txt", "b.txt", "c.txt"], max_file_bytes=100, max_total_bytes=100, workers=2
+    )
+
+    assert [record.path for record in records] == ["a.txt", "b.txt"]
@@ -0,0 +1,72 @@
+import asyncio
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from app.lib.git import list_tracked_files, sparse_checkout_add, to_sparse_checkout_pattern
+from app.lib.github import (
+    FETCH_MODE_FULL,
+    FETCH_MODE_SPARSE,
+    fetch_github_repo_contents,
+    resolve_github_repo_head,
+)
+from app.lib.repo_cache import RepoCache
+from tests.conftest import git
+
+
+@pytest.fixture(autouse=True)
+def allow_local_urls():
+    with patch('app.lib.github.ALLOW_LOCAL_REPOS', True):
+        yield
+
+
+def test_fetch_sparse_checks_out_nothing(source_repo, tmp_path):
+    repo_dir = tmp_path / "checkout"
+
+    asyncio.run(fetch_github_repo_contents(f"file://{source_repo}", str(repo_dir), FETCH_MODE_SPARSE))
+
+    assert sorted(asyncio.run(list_tracked_files(str(repo_dir)))) == ["README.md", "src/main.py"]
+    assert not (repo_dir / "README.md").exists()
+    assert not (repo_dir / "src" / "main.py").exists()
+
+
+def test_sparse_checkout_add_fetches_selected_paths(source_repo, tmp_path):
+    repo_dir = tmp_path / "checkout"
+    asyncio.run(fetch_github_repo_contents(f"file://{source_repo}", str(repo_dir), FETCH_MODE_SPARSE))
+
+    asyncio.run(sparse_checkout_add(str(repo_dir), ["src/main.py", "src/new_file.py"]))
+
+    assert (repo_dir / "src" / "main.py").read_text() == "print('hello')\n"
+    assert not (repo_dir / "README.md").exists()
+
+
+def test_fetch_invalid_mode(source_repo, tmp_path):
+    with pytest.raises(ValueError, match="Invalid repository fetch mode"):
+        asyncio.run(fetch_github_repo_contents(f"file://{source_repo}", str(tmp_path / "checkout"), "bogus"))
+
+
+def test_to_sparse_checkout_pattern_escapes_special_characters():
+    assert to_sparse_checkout_pattern("src/main.py") == "/src/main.py"
+    assert to_sparse_checkout_pattern("/docs/[draft]*.md") == "/docs/\\[draft\\]\\*.md"
+
+
+def test_resolve_github_repo_head(source_repo):
+    head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=source_repo, capture_output=True, text=True).stdout.strip()
+
+    assert asyncio.run(resolve_github_repo_head(f"file://{source_repo}")) == head
+
+
+@pytest.mark.parametrize("mode", [FETCH_MODE_FULL, FETCH_MODE_SPARSE])
+def test_fetch_pinned_commit(mode, source_repo, tmp_path):
+    initial = asyncio.run(resolve_github_repo_head(f"file://{source_repo}"))
+    (source_repo / "README.md").write_text("updated\n")
+    git("commit", "--quiet", "-am", "update", cwd=source_repo)
+    repo_dir = tmp_path / "checkout"
+
+    with patch('app.lib.github.repo_cache', RepoCache(cache_path=str(tmp_path / "cache"))):
+        asyncio.run(fetch_github_repo_contents(f"file://{source_repo}", str(repo_dir), mode, initial))
+    if mode == FETCH_MODE_SPARSE:
+        asyncio.run(sparse_checkout_add(str(repo_dir), ["README.md"]))
+
+    assert (repo_dir / "README.md").read_text() == "hello\n"
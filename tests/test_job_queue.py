@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from app.common.exceptions import QueueFullError
+from app.lib.job_queue import InMemoryJobBackend, JobQueue, JobStatus
+
+
+class EchoResult(BaseModel):
+    value: str
+
+
+async def wait_for_status(queue, job_id, status):
+    for _ in range(100):
+        job = await queue.get(job_id)
+        if job.status == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} never reached status {status}")
+
+
+def test_job_succeeds():
+    async def handler(payload):
+        return EchoResult(value=payload["value"])
+
+    async def run():
+        queue = JobQueue(handler, InMemoryJobBackend(), workers=1)
+        queue.start()
+        job = await queue.submit({"value": "hello"})
+        assert job.status == JobStatus.QUEUED
+        job = await wait_for_status(queue, job.job_id, JobStatus.SUCCEEDED)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+
+    assert job.result == {"value": "hello"}
+    assert job.finished_at is not None
+
+
+def test_job_fails():
+    async def handler(payload):
+        raise ValueError("Invalid GitHub repository URL")
+
+    async def run():
+        queue = JobQueue(handler, InMemoryJobBackend(), workers=1)
+        queue.start()
+        job = await queue.submit({})
+        job = await wait_for_status(queue, job.job_id, JobStatus.FAILED)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+
+    assert job.error == "Invalid GitHub repository URL"
+    assert job.result is None
+
+
+def test_submit_rejects_when_queue_is_full():
+    async def handler(payload):
+        return EchoResult(value="")
+
+    async def run():
+        queue = JobQueue(handler, InMemoryJobBackend(), workers=1, max_depth=2)  # workers are not started
+        await queue.submit({})
+        await queue.submit({})
+        await queue.submit({})
+
+    with pytest.raises(QueueFullError):
+        asyncio.run(run())
+
+
+def test_workers_are_bounded():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(payload):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return EchoResult(value="")
+
+    async def run():
+        queue = JobQueue(handler, InMemoryJobBackend(), workers=2)
+        queue.start()
+        jobs = [await queue.submit({}) for _ in range(6)]
+        for job in jobs:
+            await wait_for_status(queue, job.job_id, JobStatus.SUCCEEDED)
+        await queue.stop()
+
+    asyncio.run(run())
+
+    assert max_in_flight == 2
+
+
+def test_finished_jobs_expire():
+    async def handler(payload):
+        return EchoResult(value="")
+
+    async def run():
+        queue = JobQueue(handler, InMemoryJobBackend(result_ttl=0), workers=1)
+        queue.start()
+        first = await queue.submit({})
+        await asyncio.sleep(0.05)
+        await queue.submit({})
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        return await queue.get(first.job_id)
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,103 @@
+import io
+import json
+import logging
+import queue
+import threading
+
+import pytest
+
+from app.common.context import current_job_id
+from app.common.logger import DroppingQueueHandler, Payload, configure_logging, parse_log_levels, shutdown_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    logging.getLogger("tests.quiet").setLevel(logging.NOTSET)
+
+
+def test_payload_truncates_and_hashes_large_values():
+    assert str(Payload("short", max_chars=10)) == "short"
+
+    rendered = str(Payload("x" * 100, max_chars=10))
+    assert rendered.startswith("x" * 10 + "...")
+    assert "[100 chars, sha256:" in rendered
+    assert str(Payload("x" * 100, max_chars=10)) == rendered
+
+
+def test_payload_is_only_rendered_if_the_record_is_emitted():
+    class Expensive:
+        def __str__(self):
+            raise AssertionError("rendered")
+
+    logger = logging.getLogger("tests.lazy")
+    logger.setLevel(logging.WARNING)
+    logger.info("Plan: %s", Payload(Expensive()))
+
+
+def test_parse_log_levels():
+    assert parse_log_levels(["app.lib.git=debug", " uvicorn = WARNING "]) == {
+        "app.lib.git": "DEBUG", "uvicorn": "WARNING"
+    }
+    with pytest.raises(ValueError):
+        parse_log_levels(["app.lib.git"])
+
+
+def test_logs_json_with_the_job_id(restore_logging):
+    stream = io.StringIO()
+    configure_logging(level="INFO", levels=["tests.quiet=ERROR"], log_format="json", stream=stream)
+
+    current_job_id.set("job-1")
+    logging.getLogger("tests.loud").info("Queued %d jobs", 3)
+    logging.getLogger("tests.quiet").warning("Not logged")
+    shutdown_logging()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(entries) == 1
+    assert entries[0]["message"] == "Queued 3 jobs"
+    assert entries[0]["logger"] == "tests.loud"
+    assert entries[0]["level"] == "INFO"
+    assert entries[0]["job_id"] == "job-1"
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord("tests", logging.INFO, __file__, 1, "message", None, None)
+
+    handler.handle(record)
+    handler.handle(record)
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_records_are_formatted_on_the_listener_thread(restore_logging):
+    stream = io.StringIO()
+    configure_logging(level="INFO", levels=[], log_format="json", stream=stream)
+    rendered_on = []
+
+    class Recorder:
+        def __str__(self):
+            rendered_on.append(threading.current_thread())
+            return "payload"
+
+    current_job_id.set("job-2")
+    logger = logging.getLogger("tests.threads")
+    logger.info("Plan: %s", Payload(Recorder()))
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Failed")
+    shutdown_logging()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert rendered_on and threading.main_thread() not in rendered_on
+    assert entries[0]["message"] == "Plan: payload"
+    assert entries[1]["message"] == "Failed"
+    assert "ValueError: boom" in entries[1]["exception"]
+    assert {entry["job_id"] for entry in entries} == {"job-2"}
@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.lib.metrics import MetricsRegistry
+from app.main import app
+
+
+def test_counters_and_histograms_render_in_prometheus_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["outcome"])
+    duration = registry.histogram("duration_seconds", "Durations.", ["stage"], buckets=[0.1, 1])
+    registry.register_callback("queued", "Queued calls.", "gauge", lambda: [({}, 3)])
+
+    requests.inc(outcome="succeeded")
+    requests.inc(2, outcome='with "quotes"')
+    duration.observe(0.1, stage="plan")
+    duration.observe(5, stage="plan")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{outcome="succeeded"} 1.0',
+        'requests_total{outcome="with \\"quotes\\""} 2.0',
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{stage="plan",le="0.1"} 1.0',
+        'duration_seconds_bucket{stage="plan",le="1.0"} 1.0',
+        'duration_seconds_bucket{stage="plan",le="+Inf"} 2.0',
+        'duration_seconds_sum{stage="plan"} 5.1',
+        'duration_seconds_count{stage="plan"} 2.0',
+        "# HELP queued Queued calls.",
+        "# TYPE queued gauge",
+        "queued 3.0",
+    ]
+    assert duration.count(stage="plan") == 2
+
+
+def test_metrics_validate_labels_and_names():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["outcome"])
+
+    with pytest.raises(ValueError, match="expects labels"):
+        requests.inc(status="ok")
+    with pytest.raises(ValueError, match="already registered"):
+        registry.counter("requests_total", "Requests.")
+
+
+def test_metrics_endpoint():
+    async def scrape():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/metrics")
+
+    response = asyncio.run(scrape())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE codegen_stage_duration_seconds histogram" in response.text
+    assert "# TYPE llm_tokens_total counter" in response.text
@@ -0,0 +1,145 @@
+import asyncio
+from typing import List
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.common.context import current_job_id
+from app.common.exceptions import ApiError
+from app.lib.persistence import PersistenceBackend, SQLiteBackend, WriteBehindWriter
+from app.lib.supabase_client import SupabaseClient
+
+
+class FlakyBackend(PersistenceBackend):
+    """Fails the first `failures` inserts, then stores the batches in memory."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches: List[tuple] = []
+
+    async def insert_many(self, table, records):
+        if self.failures:
+            self.failures -= 1
+            raise ApiError("backend unavailable")
+        self.batches.append((table, records))
+
+
+def make_writer(backend, tmp_path, **kwargs):
+    kwargs = {"batch_size": 2, "retry_backoff": 0, "max_retries": 1, **kwargs}
+    return WriteBehindWriter(backend, spill_path=str(tmp_path / "spill.jsonl"), **kwargs)
+
+
+def test_flush_writes_batched_multi_row_inserts_per_table(tmp_path):
+    backend = FlakyBackend()
+    writer = make_writer(backend, tmp_path)
+    for i in range(3):
+        writer.enqueue("requests", {"i": i})
+    writer.enqueue("events", {"i": 3})
+
+    asyncio.run(writer.flush())
+
+    assert backend.batches == [
+        ("events", [{"i": 3}]), ("requests", [{"i": 0}, {"i": 1}]), ("requests", [{"i": 2}])
+    ]
+    assert writer.written == 4
+
+
+def test_failed_batches_are_retried_then_spilled_and_replayed(tmp_path):
+    backend = FlakyBackend(failures=3)
+    writer = make_writer(backend, tmp_path)
+    writer.enqueue("requests", {"i": 0})
+    writer.enqueue("requests", {"i": 1})
+    writer.enqueue("requests", {"i": 2})
+
+    asyncio.run(writer.flush())  # the first batch fails twice and is spilled; the second fails once, then succeeds
+
+    assert backend.batches == [("requests", [{"i": 2}])]
+    assert writer.spilled == 2
+    assert (tmp_path / "spill.jsonl").exists()
+
+    asyncio.run(writer.flush())
+
+    assert backend.batches[1] == ("requests", [{"i": 0}, {"i": 1}])
+    assert not (tmp_path / "spill.jsonl").exists()
+
+
+def test_full_buffer_spills_to_disk_in_the_background(tmp_path):
+    backend = FlakyBackend()
+    writer = make_writer(backend, tmp_path, buffer_size=1)
+
+    async def run():
+        writer.enqueue("requests", {"i": 0})
+        with patch.object(writer, "_spill", wraps=writer._spill) as spill:
+            writer.enqueue("requests", {"i": 1})
+            spill.assert_not_called()  # not on the caller's path
+            await asyncio.sleep(0.05)
+        assert writer.spilled == 1
+        await writer.flush()
+
+    asyncio.run(run())
+
+    assert sorted(record["i"] for _, records in backend.batches for record in records) == [0, 1]
+
+
+def test_persist_spans_carry_the_job_ids_of_their_records(tmp_path):
+    backend = FlakyBackend(failures=2)
+    writer = make_writer(backend, tmp_path)
+    exported = []
+
+    async def enqueue(job_id, i):
+        current_job_id.set(job_id)
+        writer.enqueue("requests", {"i": i})
+
+    async def run():
+        await enqueue("job-1", 0)
+        await enqueue("job-2", 1)
+        await writer.flush()  # fails twice, so the batch is spilled along with its job IDs
+        await enqueue("job-3", 2)
+        await writer.flush()
+
+    with patch("app.lib.tracing.span_exporter", Mock(export=exported.append)):
+        asyncio.run(run())
+
+    assert [span.job_id for span in exported] == ["job-1,job-2", "job-1,job-2", "job-1,job-2", "job-3"]
+
+
+def test_background_flush_and_flush_on_stop(tmp_path):
+    backend = FlakyBackend()
+
+    async def run():
+        writer = make_writer(backend, tmp_path, flush_interval=60)
+        writer.start()
+        writer.enqueue("requests", {"i": 0})
+        writer.enqueue("requests", {"i": 1})  # a full batch wakes the background task
+        await asyncio.sleep(0.05)
+        assert backend.batches == [("requests", [{"i": 0}, {"i": 1}])]
+        writer.enqueue("requests", {"i": 2})
+        await writer.stop()
+
+    asyncio.run(run())
+
+    assert backend.batches[-1] == ("requests", [{"i": 2}])
+
+
+def test_sqlite_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "tinygen.sqlite3"))
+
+    asyncio.run(backend.insert_many("code_gen_requests", [{"prompt": "a"}, {"prompt": "b"}]))
+
+    assert backend.fetch_all("code_gen_requests") == [{"prompt": "a"}, {"prompt": "b"}]
+    with pytest.raises(ApiError, match="Invalid table name"):
+        asyncio.run(backend.insert_many("requests; DROP TABLE x", [{}]))
+
+
+@patch('app.lib.supabase_client.create_client')
+def test_supabase_client_connects_lazily_and_raises_on_failure(mock_create_client):
+    client = SupabaseClient()
+    mock_create_client.assert_not_called()
+
+    mock_create_client.return_value.table.return_value.insert.return_value.execute = Mock(
+        side_effect=RuntimeError("connection refused")
+    )
+    with pytest.raises(ApiError, match="Failed to insert 1 records into requests"):
+        asyncio.run(client.insert_records("requests", [{"i": 0}]))
+    assert asyncio.run(client.insert_record("requests", {"i": 0})) is None
+    mock_create_client.assert_called_once()
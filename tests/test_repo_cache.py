@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+import pytest
+
+from app.lib.repo_cache import RepoCache
+from tests.conftest import git
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RepoCache(cache_path=str(tmp_path / "cache"), max_bytes=1024 ** 3, fetch_ttl=0)
+
+
+def test_checkout_miss_then_hit(cache, source_repo, tmp_path):
+    repo_url = f"file://{source_repo}"
+
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout1")))
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout2")))
+
+    assert (tmp_path / "checkout1" / "README.md").read_text() == "hello\n"
+    assert (tmp_path / "checkout2" / "README.md").read_text() == "hello\n"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_checkout_fetches_new_commits(cache, source_repo, tmp_path):
+    repo_url = f"file://{source_repo}"
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout1")))
+
+    (source_repo / "README.md").write_text("updated\n")
+    git("commit", "--quiet", "-am", "update", cwd=source_repo)
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout2")))
+
+    assert (tmp_path / "checkout2" / "README.md").read_text() == "updated\n"
+
+
+def test_checkout_skips_fetch_for_fresh_mirror(source_repo, tmp_path):
+    cache = RepoCache(cache_path=str(tmp_path / "cache"), fetch_ttl=3600)
+    repo_url = f"file://{source_repo}"
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout1")))
+
+    (source_repo / "README.md").write_text("updated\n")
+    git("commit", "--quiet", "-am", "update", cwd=source_repo)
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout2")))
+
+    assert (tmp_path / "checkout2" / "README.md").read_text() == "hello\n"
+
+
+def test_evict_least_recently_used(source_repo, tmp_path):
+    cache = RepoCache(cache_path=str(tmp_path / "cache"), max_bytes=0, fetch_ttl=0)
+    repo_url = f"file://{source_repo}"
+
+    asyncio.run(cache.checkout(repo_url, str(tmp_path / "checkout")))
+
+    assert not os.path.exists(cache.mirror_path(repo_url))
+    assert (tmp_path / "checkout" / "README.md").exists()
+    assert cache.evictions == 1
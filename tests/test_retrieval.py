@@ -0,0 +1,84 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from app.lib import retrieval
+from app.lib.retrieval import (
+    BM25Index,
+    RetrievalIndexCache,
+    build_retrieval_index,
+    load_retrieval_index,
+    shutdown_index_pool,
+    tokenize,
+)
+
+
+@pytest.fixture
+def repo_dir(tmp_path):
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app" / "billing.py").write_text(
+        'def charge_invoice(invoice):\n    """Charge the customer for an invoice."""\n    return invoice.total\n'
+    )
+    (tmp_path / "app" / "auth.py").write_text("def login(user, password):\n    return check_password(user, password)\n")
+    (tmp_path / "app" / "emailSender.py").write_text("def send_email(address):\n    pass\n")
+    (tmp_path / "README.md").write_text("A sample project.\n")
+    return tmp_path
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("fetchFileMap(repo_dir) HTTPServer") == [
+        "fetchfilemap", "fetch", "file", "map", "repo_dir", "repo", "dir", "httpserver", "http", "server"
+    ]
+    assert tokenize("Add a new function to the class") == []
+
+
+def test_search_ranks_relevant_files_first(repo_dir):
+    paths = ["README.md", "app/auth.py", "app/billing.py", "app/emailSender.py"]
+    retrieval_index = asyncio.run(build_retrieval_index(str(repo_dir), paths))
+
+    assert retrieval_index.search("Charge a late fee on each invoice", 2)[0][0] == "app/billing.py"
+    assert retrieval_index.search("Validate the password on login", 1)[0][0] == "app/auth.py"
+    assert retrieval_index.search("Retry sending the email", 1)[0][0] == "app/emailSender.py"
+    assert retrieval_index.search("unrelated words", 5) == []
+
+
+def test_index_round_trips_through_json(repo_dir):
+    retrieval_index = asyncio.run(build_retrieval_index(str(repo_dir), ["app/auth.py", "app/billing.py"]))
+
+    restored = BM25Index.from_json(retrieval_index.to_json())
+
+    assert restored.search("invoice", 5) == retrieval_index.search("invoice", 5)
+
+
+def test_parallel_build_matches_serial_build(repo_dir):
+    paths = ["README.md", "app/auth.py", "app/billing.py", "app/emailSender.py"]
+    serial = asyncio.run(build_retrieval_index(str(repo_dir), paths, workers=1))
+
+    async def build_twice():
+        first = await build_retrieval_index(str(repo_dir), paths, workers=2)
+        pool = retrieval._index_pool
+        second = await build_retrieval_index(str(repo_dir), paths, workers=2)
+        assert retrieval._index_pool is pool  # the worker processes are reused across builds
+        await shutdown_index_pool()
+        return first, second
+
+    with patch('app.lib.retrieval.RETRIEVAL_PARALLEL_MIN_FILES', 1):
+        parallel, repeated = asyncio.run(build_twice())
+
+    assert parallel.paths == serial.paths
+    assert parallel.postings == serial.postings == repeated.postings
+    assert retrieval._index_pool is None
+
+
+def test_index_is_persisted_per_commit(source_repo, tmp_path):
+    cache = RetrievalIndexCache(cache_path=str(tmp_path / "retrieval"))
+
+    with patch('app.lib.retrieval.retrieval_index_cache', cache):
+        first = asyncio.run(load_retrieval_index(str(source_repo), ["README.md", "src/main.py"]))
+        with patch('app.lib.retrieval.build_retrieval_index', return_value=first) as mock_build_retrieval_index:
+            second = asyncio.run(load_retrieval_index(str(source_repo), ["README.md", "src/main.py"]))
+            asyncio.run(load_retrieval_index(str(source_repo), ["README.md", "src/main.py"], commit="other"))
+
+    assert second.postings == first.postings
+    mock_build_retrieval_index.assert_called_once()  # only the unknown commit is indexed again
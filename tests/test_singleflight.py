@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from app.lib.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def run():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*(single_flight.do("key", fn) for _ in range(5)))
+        assert not single_flight.in_flight("key")
+        return single_flight, results
+
+    single_flight, results = asyncio.run(run())
+
+    assert results == [1, 1, 1, 1, 1]
+    assert calls == 1
+    assert single_flight.coalesced == 4
+
+
+def test_sequential_calls_are_not_coalesced():
+    async def fn():
+        return "result"
+
+    async def run():
+        single_flight = SingleFlight()
+        await single_flight.do("key", fn)
+        await single_flight.do("key", fn)
+        return single_flight
+
+    assert asyncio.run(run()).coalesced == 0
+
+
+def test_exceptions_are_shared():
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("Invalid GitHub repository URL")
+
+    async def run():
+        single_flight = SingleFlight()
+        return await asyncio.gather(*(single_flight.do("key", fn) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_call_survives_leader_cancellation():
+    async def fn():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def run():
+        single_flight = SingleFlight()
+        leader = asyncio.create_task(single_flight.do("key", fn))
+        follower = asyncio.create_task(single_flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+
+
+def test_call_is_cancelled_when_all_waiters_are_cancelled():
+    cancelled = False
+
+    async def fn():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def run():
+        single_flight = SingleFlight()
+        waiter = asyncio.create_task(single_flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert cancelled is True
@@ -0,0 +1,115 @@
+import asyncio
+from unittest.mock import patch
+
+from app.lib.git import list_tree_blobs, read_blobs
+from app.lib.symbols import extract_python_symbols, extract_regex_symbols, load_symbol_index
+from tests.conftest import git
+
+PYTHON_SOURCE = '''
+import os
+from app.lib import git
+from .models import Job, JobStatus
+
+
+class JobQueue(BaseQueue):
+    """Run jobs in the background.
+
+    More details.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+
+    async def submit(self, payload: dict) -> Job:
+        return Job(payload=payload, status=JobStatus.QUEUED)
+
+    def _work(self):
+        git.run_git(["status"])
+
+
+def helper(value):
+    return os.path.join(value)
+'''
+
+
+def test_extract_python_symbols():
+    file_symbols = extract_python_symbols("app/lib/job_queue.py", PYTHON_SOURCE)
+
+    assert [(symbol.name, symbol.kind, symbol.line) for symbol in file_symbols.definitions] == [
+        ("JobQueue", "class", 7), ("helper", "function", 23)
+    ]
+    assert file_symbols.definitions[0].signature == "\n".join([
+        "class JobQueue(BaseQueue):",
+        '    """Run jobs in the background."""',
+        "    def __init__(self, workers: int=4):",
+        "    async def submit(self, payload: dict) -> Job:",
+    ])
+    assert file_symbols.imports[0].candidates[:2] == ["os.py", "os/__init__.py"]
+    assert ["app/lib/models.py", "app/lib/models/__init__.py"] in [i.candidates for i in file_symbols.imports]
+    assert ["app/lib/git.py", "app/lib/git/__init__.py"] in [i.candidates for i in file_symbols.imports]
+    assert {"Job", "run_git", "join", "BaseQueue"} <= file_symbols.references
+
+
+def test_extract_python_symbols_falls_back_to_regex_on_syntax_errors():
+    file_symbols = extract_python_symbols("broken.py", "def ok():\n    pass\n\ndef broken(:\n")
+
+    assert [symbol.name for symbol in file_symbols.definitions] == ["ok", "broken"]
+
+
+def test_extract_regex_symbols():
+    source = (
+        "import { formatDate } from './utils/date';\n"
+        "const api = require('../api');\n"
+        "export async function loadUser(id) {\n"
+        "  return formatDate(api.get(id));\n"
+        "}\n"
+        "export const saveUser = async (user) => api.post(user);\n"
+        "export default class UserStore {\n"
+    )
+
+    file_symbols = extract_regex_symbols("web/src/user.js", source)
+
+    assert [(symbol.name, symbol.signature) for symbol in file_symbols.definitions] == [
+        ("loadUser", "export async function loadUser(id)"),
+        ("saveUser", "export const saveUser = async (user) => api.post(user);"),
+        ("UserStore", "export default class UserStore"),
+    ]
+    assert file_symbols.imports[0].candidates[:2] == ["web/src/utils/date", "web/src/utils/date.ts"]
+    assert file_symbols.imports[1].candidates[0] == "web/api"
+    assert "formatDate" in file_symbols.references
+
+
+def test_read_blobs(source_repo):
+    blobs = asyncio.run(list_tree_blobs(str(source_repo)))
+
+    contents = asyncio.run(read_blobs(str(source_repo), [blobs["README.md"], "0" * 40]))
+
+    assert contents == {blobs["README.md"]: b"hello\n"}
+
+
+def test_related_definitions_follow_imports(source_repo):
+    (source_repo / "src" / "util.py").write_text(
+        "def add(a: int, b: int) -> int:\n    return a + b\n\n\ndef unused():\n    pass\n\n\n"
+        "def subtract(a, b):\n    return a - b\n"
+    )
+    (source_repo / "src" / "main.py").write_text(
+        "from src.util import add\nfrom src import util\n\nprint(add(1, 2), util.subtract(3, 1))\n"
+    )
+    git("add", "-A", cwd=source_repo)
+    git("commit", "--quiet", "-m", "add util", cwd=source_repo)
+
+    symbol_index = asyncio.run(load_symbol_index(str(source_repo)))
+    symbols = asyncio.run(symbol_index.related_definitions(["src/main.py"]))
+
+    assert [(symbol.path, symbol.name) for symbol in symbols] == [("src/util.py", "add"), ("src/util.py", "subtract")]
+    assert symbols[0].signature == "def add(a: int, b: int) -> int:"
+
+    # Symbols are cached by blob, so a new index of the same commit reads nothing from git
+    with patch('app.lib.symbols.read_blobs') as mock_read_blobs:
+        symbol_index = asyncio.run(load_symbol_index(str(source_repo)))
+        assert len(asyncio.run(symbol_index.related_definitions(["src/main.py"]))) == 2
+    mock_read_blobs.assert_not_called()
+
+
+def test_load_symbol_index_outside_git(tmp_path):
+    assert asyncio.run(load_symbol_index(str(tmp_path))) is None
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pytest
+
+from app.common.context import current_job_id
+from app.lib.tracing import STAGE_DURATION, SpanFileExporter, StageTimer, span, stage_timer
+
+
+def test_stage_timer_aggregates_runs():
+    timer = StageTimer()
+    timer.record("plan", 1.0)
+    timer.record("plan", 3.0)
+
+    assert timer.summary() == {"plan": {"count": 2, "total": 4.0, "mean": 2.0, "max": 3.0}}
+    timer.reset()
+    assert timer.summary() == {}
+
+
+def test_spans_nest_across_tasks_and_carry_the_job_id():
+    spans = {}
+
+    async def work(index):
+        with span("worker", chunk_index=index) as worker_span:
+            spans[f"worker{index}"] = worker_span
+
+    async def run():
+        current_job_id.set("job-1")
+        with span("codegen") as root:
+            spans["codegen"] = root
+            await asyncio.gather(work(0), work(1))
+
+    asyncio.run(run())
+
+    root = spans["codegen"]
+    assert root.parent_span_id is None
+    assert root.job_id == "job-1"
+    for name in ["worker0", "worker1"]:
+        assert spans[name].trace_id == root.trace_id
+        assert spans[name].parent_span_id == root.span_id
+        assert spans[name].job_id == "job-1"
+        assert root.start_time_ns <= spans[name].start_time_ns <= spans[name].end_time_ns <= root.end_time_ns
+    assert spans["worker1"].attributes == {"chunk_index": 1}
+
+
+def test_spans_record_failures_and_stage_timings():
+    count = STAGE_DURATION.count(stage="clone")
+
+    with pytest.raises(ValueError):
+        with span("clone") as clone_span:
+            raise ValueError("clone failed")
+
+    assert clone_span.error == "ValueError: clone failed"
+    assert STAGE_DURATION.count(stage="clone") == count + 1
+    assert stage_timer.summary()["clone"]["count"] >= 1
+
+
+def test_span_file_exporter_writes_otlp_json_lines(tmp_path):
+    path = tmp_path / "traces" / "spans.jsonl"
+    exporter = SpanFileExporter(str(path))
+    with span("codegen", attempt=2) as root:
+        root.job_id = "job-1"
+        with span("plan") as child:
+            pass
+    exporter.export(child)
+    exporter.export(root)
+    exporter.close()
+
+    requests = [json.loads(line) for line in path.read_text().splitlines()]
+    exported = [request["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for request in requests]
+    assert [exported_span["name"] for exported_span in exported] == ["plan", "codegen"]
+    assert exported[0]["parentSpanId"] == exported[1]["spanId"]
+    assert exported[1]["attributes"] == [
+        {"key": "attempt", "value": {"intValue": "2"}}, {"key": "job.id", "value": {"stringValue": "job-1"}}
+    ]
+    assert int(exported[1]["endTimeUnixNano"]) >= int(exported[1]["startTimeUnixNano"])
+    assert requests[0]["resourceSpans"][0]["resource"]["attributes"][0]["key"] == "service.name"